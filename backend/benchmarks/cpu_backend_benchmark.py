@@ -0,0 +1,199 @@
+"""Compare the CPU inference backends (float32, int8, onnx) of cpu_backends.
+
+Each backend is loaded in its own subprocess so that resident memory is
+measured in isolation. For the embedder it reports encoding throughput and
+how closely the embeddings (cosine similarity) and top-5 retrieval results
+agree with float32; for the generator it reports tokens/s of greedy
+decoding and how many generated tokens match the float32 output.
+
+    python -m benchmarks.cpu_backend_benchmark --backends float32 int8 onnx --max-new-tokens 32
+    python -m benchmarks.cpu_backend_benchmark --skip-llm --texts 2000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def knowledge_texts(n):
+    with open("../data/knowledge.json", "r") as f:
+        texts = [item["text"] for item in json.load(f)]
+    return [texts[i % len(texts)] + ("" if i < len(texts) else f" ({i})") for i in range(n)]
+
+
+def run_embedder(args, out_dir):
+    from cpu_backends import load_embedding_model
+
+    model = load_embedding_model(args.embedding_model, args.backend)
+    texts = knowledge_texts(args.texts)
+    model.encode(texts[:args.batch_size], batch_size=args.batch_size)  # warm-up
+    start = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=args.batch_size, convert_to_numpy=True)
+    elapsed = time.perf_counter() - start
+    np.save(os.path.join(out_dir, f"embeddings-{args.backend}.npy"), embeddings.astype(np.float32))
+    return {"texts_per_s": round(len(texts) / elapsed, 1), "rss_mb": round(rss_mb()), "peak_rss_mb": round(peak_rss_mb())}
+
+
+def run_generator(args, out_dir):
+    import torch
+    from cpu_backends import load_causal_lm
+    from benchmarks.inference_load_test import load_prompts
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model, tokenizer = load_causal_lm(args.model, args.backend, trust_remote_code=True)
+    loaded_rss = rss_mb()
+    prompts = load_prompts(args.prompts)
+
+    outputs, new_tokens, elapsed = [], 0, 0.0
+    for i, prompt in enumerate(prompts):
+        inputs = tokenizer(prompt, return_tensors="pt")
+        start = time.perf_counter()
+        with torch.no_grad():
+            generated = model.generate(**inputs, max_new_tokens=args.max_new_tokens, do_sample=False,
+                                       pad_token_id=tokenizer.eos_token_id)
+        if i > 0:  # the first prompt is a warm-up
+            elapsed += time.perf_counter() - start
+            new_tokens += generated.shape[1] - inputs["input_ids"].shape[1]
+        outputs.append(generated[0, inputs["input_ids"].shape[1]:].tolist())
+
+    with open(os.path.join(out_dir, f"tokens-{args.backend}.json"), "w") as f:
+        json.dump(outputs, f)
+    return {
+        "tokens_per_s": round(new_tokens / elapsed, 2) if elapsed else None,
+        "rss_mb": round(loaded_rss),
+        "peak_rss_mb": round(peak_rss_mb()),
+    }
+
+
+def embedding_agreement(reference, candidate, k=5):
+    ref = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    cand = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosine = np.sum(ref * cand, axis=1)
+    # Use every 10th text as a query and compare the top-k neighbours
+    queries = np.arange(0, len(ref), 10)
+    ref_top = np.argsort(-(ref[queries] @ ref.T), axis=1)[:, :k]
+    cand_top = np.argsort(-(cand[queries] @ cand.T), axis=1)[:, :k]
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_top, cand_top)])
+    return {"cosine_mean": round(float(cosine.mean()), 4), "cosine_min": round(float(cosine.min()), 4),
+            f"top{k}_overlap": round(float(overlap), 3)}
+
+
+def token_agreement(reference, candidate):
+    matched = total = exact = 0
+    for ref, cand in zip(reference, candidate):
+        prefix = next((i for i, (a, b) in enumerate(zip(ref, cand)) if a != b), min(len(ref), len(cand)))
+        matched += prefix
+        total += len(ref)
+        exact += ref == cand
+    return {"matching_prefix": round(matched / total, 3) if total else None,
+            "exact_match": round(exact / len(reference), 3) if reference else None}
+
+
+def run_worker(args):
+    run = run_embedder if args.worker == "embedder" else run_generator
+    result = run(args, args.out_dir)
+    with open(os.path.join(args.out_dir, f"{args.worker}-{args.backend}.json"), "w") as f:
+        json.dump(result, f)
+
+
+def spawn(worker, backend, args, out_dir):
+    command = [sys.executable, "-m", "benchmarks.cpu_backend_benchmark", "--worker", worker,
+               "--backend", backend, "--out-dir", out_dir,
+               "--model", args.model, "--embedding-model", args.embedding_model,
+               "--texts", str(args.texts), "--batch-size", str(args.batch_size),
+               "--prompts", str(args.prompts), "--max-new-tokens", str(args.max_new_tokens),
+               "--threads", str(args.threads)]
+    if subprocess.run(command).returncode != 0:
+        return None
+    with open(os.path.join(out_dir, f"{worker}-{backend}.json")) as f:
+        return json.load(f)
+
+
+def print_table(title, rows):
+    print(title)
+    # A backend that failed to load has fewer columns than the rest
+    header = list(dict.fromkeys(key for row in rows for key in row))
+    print("  ".join(f"{h:>16}" for h in header))
+    for row in rows:
+        print("  ".join(f"{'-' if row.get(h) is None else row[h]!s:>16}" for h in header))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["float32", "int8", "onnx"])
+    parser.add_argument("--model", default="microsoft/phi-2")
+    parser.add_argument("--embedding-model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--texts", type=int, default=1000, help="texts to embed")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--prompts", type=int, default=5, help="prompts to generate for (the first is a warm-up)")
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0 keeps the default)")
+    parser.add_argument("--skip-llm", action="store_true")
+    parser.add_argument("--skip-embedder", action="store_true")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--worker", choices=["embedder", "generator"], help=argparse.SUPPRESS)
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    parser.add_argument("--out-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    # float32 is the reference for the agreement columns
+    backends = ["float32"] + [b for b in args.backends if b != "float32"]
+    results = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        if not args.skip_embedder:
+            rows = []
+            for backend in backends:
+                row = {"backend": backend, **(spawn("embedder", backend, args, out_dir) or {"error": "failed"})}
+                path = os.path.join(out_dir, f"embeddings-{backend}.npy")
+                reference = os.path.join(out_dir, "embeddings-float32.npy")
+                if os.path.exists(path) and os.path.exists(reference):
+                    row.update(embedding_agreement(np.load(reference), np.load(path)))
+                rows.append(row)
+            results["embedder"] = rows
+
+        if not args.skip_llm:
+            rows = []
+            for backend in backends:
+                row = {"backend": backend, **(spawn("generator", backend, args, out_dir) or {"error": "failed"})}
+                path = os.path.join(out_dir, f"tokens-{backend}.json")
+                reference = os.path.join(out_dir, "tokens-float32.json")
+                if os.path.exists(path) and os.path.exists(reference):
+                    with open(reference) as f, open(path) as g:
+                        row.update(token_agreement(json.load(f), json.load(g)))
+                rows.append(row)
+            results["generator"] = rows
+
+    if args.json:
+        print(json.dumps({"config": vars(args), "results": results}, indent=2))
+        return
+    if "embedder" in results:
+        print_table(f"{args.embedding_model}: {args.texts} texts, batch size {args.batch_size}", results["embedder"])
+    if "generator" in results:
+        print_table(f"{args.model}: {args.prompts - 1} prompts, {args.max_new_tokens} new tokens (greedy)",
+                    results["generator"])
+
+
+if __name__ == "__main__":
+    main()
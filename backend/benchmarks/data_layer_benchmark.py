@@ -0,0 +1,257 @@
+"""Mixed read/write load on the patient stores from async request handlers.
+
+``--clients`` coroutines on one event loop each run ``--ops`` operations:
+``get`` of a random patient, or (``--write-ratio`` of the time) ``update``
+of a patient owned by that client, setting its name to a new value. Stores:
+
+- legacy_inline: the original JSON store (whole file read per call, whole
+  file rewritten in place per write), called directly in the handler.
+- legacy_threads: the same store called from worker threads, as
+  synchronous handlers would.
+- json_cached: the write-through JSON store behind AsyncPatientRepository.
+- sqlite: the SQLite store behind AsyncPatientRepository.
+
+Afterwards the store is reopened from disk and every patient's name is
+compared with the last value written to it: ``lost_updates`` counts the
+ones that differ, ``errors`` the operations that raised (e.g. reading a
+half-written file). ``loop_lag_p99_ms`` is how late a 1 ms timer on the
+same event loop fires, i.e. how long handlers block the loop.
+
+``--check`` exits with status 1 unless the stores the server uses
+(json_cached and sqlite) lost no updates, raised no errors and kept the
+p99 loop lag below the legacy_inline baseline's.
+
+    python -m benchmarks.data_layer_benchmark --patients 2000 --clients 32 --ops 100
+    python -m benchmarks.data_layer_benchmark --check
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import iter_patients
+
+
+class LegacyJsonPatientRepository:
+    """The original store: every call reads (and writes) the whole JSON file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load_all(self):
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def get(self, patient_id):
+        return next((p for p in self.load_all() if p["id"] == patient_id), None)
+
+    def update(self, patient_id, patient):
+        patients = self.load_all()
+        for i, p in enumerate(patients):
+            if p["id"] == patient_id:
+                patients[i] = {"id": patient_id, **patient}
+                with open(self.path, "w") as f:
+                    json.dump(patients, f, indent=2)
+                return patients[i]
+        return None
+
+
+class InlineCalls:
+    """Awaitable wrapper that calls the store on the event loop thread"""
+
+    def __init__(self, repository):
+        self.repository = repository
+
+    async def get(self, patient_id):
+        return self.repository.get(patient_id)
+
+    async def update(self, patient_id, patient):
+        return self.repository.update(patient_id, patient)
+
+
+class ThreadCalls(InlineCalls):
+    async def get(self, patient_id):
+        return await asyncio.to_thread(self.repository.get, patient_id)
+
+    async def update(self, patient_id, patient):
+        return await asyncio.to_thread(self.repository.update, patient_id, patient)
+
+
+async def run_load(store, patients, args, seed):
+    rng = random.Random(seed)
+    latencies = {"get": [], "update": []}
+    errors = 0
+    expected = {}
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - start - 0.001)
+
+    async def client(k):
+        nonlocal errors
+        owned = [p for p in patients if p["id"] % args.clients == k]
+        for op in range(args.ops):
+            write = owned and rng.random() < args.write_ratio
+            start = time.perf_counter()
+            try:
+                if write:
+                    patient = rng.choice(owned)
+                    name = f"client{k}-op{op}"
+                    await store.update(patient["id"], {**{f: v for f, v in patient.items() if f != "id"}, "name": name})
+                    expected[patient["id"]] = name
+                else:
+                    await store.get(rng.randint(1, len(patients)))
+            except Exception:
+                errors += 1
+                continue
+            latencies["update" if write else "get"].append(time.perf_counter() - start)
+
+    lag_task = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*(client(k) for k in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await lag_task
+    return latencies, errors, expected, lags, elapsed
+
+
+def ms(values, q):
+    return round(float(np.percentile(np.array(values) * 1000, q)), 2) if values else None
+
+
+# Stores behind AsyncPatientRepository, which --check holds to its guarantees
+CHECKED_STORES = ("json_cached", "sqlite")
+
+
+def check(rows):
+    """Reasons the checked stores failed, empty if they passed"""
+    by_store = {row["store"]: row for row in rows}
+    baseline = by_store["legacy_inline"]["loop_lag_p99_ms"]
+    failures = []
+    for name in CHECKED_STORES:
+        row = by_store.get(name)
+        if row is None:
+            continue
+        if row["lost_updates"]:
+            failures.append(f"{name}: {row['lost_updates']} lost updates")
+        if row["errors"]:
+            failures.append(f"{name}: {row['errors']} errors")
+        if row["loop_lag_p99_ms"] >= baseline:
+            failures.append(f"{name}: p99 loop lag {row['loop_lag_p99_ms']} ms is not below "
+                            f"legacy_inline's {baseline} ms")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--ops", type=int, default=100, help="operations per client")
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--stores", nargs="+", default=["legacy_inline", "legacy_threads", "json_cached", "sqlite"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--check", action="store_true",
+                        help="exit with status 1 if json_cached or sqlite lose updates, raise errors "
+                             "or block the event loop as long as legacy_inline")
+    args = parser.parse_args()
+    if args.check and "legacy_inline" not in args.stores:
+        parser.error("--check compares against legacy_inline, so --stores must include it")
+
+    data_dir = tempfile.mkdtemp(prefix="cdss-data-layer-")
+    # Before anything imports config
+    os.environ.update(CDSS_DATA_DIR=data_dir)
+    from patient_store import AsyncPatientRepository, JsonPatientRepository, SQLitePatientRepository
+
+    patients = list(iter_patients(args.patients, args.seed))
+    rows = []
+    try:
+        for name in args.stores:
+            store_dir = os.path.join(data_dir, name)
+            os.makedirs(store_dir)
+            json_path = os.path.join(store_dir, "patients.json")
+            db_path = os.path.join(store_dir, "cdss.db")
+            with open(json_path, "w") as f:
+                json.dump(patients, f, indent=2)
+
+            if name == "legacy_inline":
+                repository = LegacyJsonPatientRepository(json_path)
+                store = InlineCalls(repository)
+            elif name == "legacy_threads":
+                repository = LegacyJsonPatientRepository(json_path)
+                store = ThreadCalls(repository)
+            elif name == "json_cached":
+                repository = JsonPatientRepository(json_path)
+                store = AsyncPatientRepository(repository)
+            elif name == "sqlite":
+                repository = SQLitePatientRepository(db_path, json_path=json_path)
+                store = AsyncPatientRepository(repository)
+            else:
+                raise ValueError(f"Unknown store '{name}'")
+
+            latencies, errors, expected, lags, elapsed = asyncio.run(run_load(store, patients, args, args.seed))
+            if hasattr(repository, "close"):
+                # Writes the last coalesced changes of the JSON store
+                repository.close()
+
+            # Reopen from disk
+            if name == "sqlite":
+                stored = SQLitePatientRepository(db_path, json_path=None).list()
+            else:
+                try:
+                    stored = LegacyJsonPatientRepository(json_path).load_all()
+                except json.JSONDecodeError:
+                    stored = []
+            names = {p["id"]: p["name"] for p in stored}
+            lost = sum(names.get(patient_id) != value for patient_id, value in expected.items())
+
+            ops = len(latencies["get"]) + len(latencies["update"])
+            rows.append({
+                "store": name,
+                "ops_per_s": round(ops / elapsed, 1),
+                "get_p50_ms": ms(latencies["get"], 50),
+                "get_p99_ms": ms(latencies["get"], 99),
+                "update_p50_ms": ms(latencies["update"], 50),
+                "update_p99_ms": ms(latencies["update"], 99),
+                "loop_lag_p99_ms": ms(lags, 99),
+                "errors": errors,
+                "lost_updates": lost,
+            })
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    failures = check(rows) if args.check else []
+    if args.json:
+        output = {"config": vars(args), "results": rows}
+        if args.check:
+            output["failures"] = failures
+        print(json.dumps(output, indent=2))
+    else:
+        print(f"{args.patients} patients, {args.clients} clients x {args.ops} operations, "
+              f"{args.write_ratio:.0%} writes")
+        header = list(rows[0].keys())
+        print("  ".join(f"{h:>15}" for h in header))
+        for row in rows:
+            print("  ".join(f"{'-' if row[h] is None else row[h]!s:>15}" for h in header))
+        if args.check:
+            for failure in failures:
+                print(f"FAIL {failure}")
+            if not failures:
+                print("Check passed")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
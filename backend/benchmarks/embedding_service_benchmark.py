@@ -0,0 +1,124 @@
+"""Query embedding throughput: per-call encode vs. the micro-batching EmbeddingService.
+
+Simulates ``retrieve_relevant_knowledge`` under concurrent load. Each
+request embeds only the bare query (the patient comes in through the
+cached profile vector it is blended with, which needs no encoding). The
+baseline is a single-text ``SentenceTransformer.encode`` call per request,
+with no sharing between threads. The service coalesces concurrent
+requests into micro-batches, with or without its LRU cache.
+``--distinct`` controls how many different queries the load draws from,
+so repeated queries can hit the LRU.
+
+    python -m benchmarks.embedding_service_benchmark --requests 2000 --concurrency 1 8 32
+"""
+import argparse
+import json
+import random
+import threading
+import time
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from embedding_service import EmbeddingService
+from benchmarks.inference_load_test import QUERIES
+
+
+def make_requests(n, distinct, seed):
+    rng = random.Random(seed)
+    pool = [f"{QUERIES[i % len(QUERIES)]} (case {i // len(QUERIES)})" for i in range(distinct)]
+    return [rng.choice(pool) for _ in range(n)]
+
+
+def run_load(handle, requests, concurrency):
+    pending = list(requests)
+    lock = threading.Lock()
+    latencies = []
+
+    def client():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                request = pending.pop()
+            start = time.perf_counter()
+            handle(request)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return np.array(latencies), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--distinct", type=int, default=200, help="distinct queries the load draws from")
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    model = SentenceTransformer(args.model, device="cpu")
+    requests = make_requests(args.requests, args.distinct, args.seed)
+    model.encode([requests[0]])  # warm-up
+
+    def per_call(query):
+        model.encode([query], convert_to_numpy=True)
+
+    def encode_batch(batch):
+        return model.encode(batch, batch_size=len(batch), convert_to_numpy=True)
+
+    rows = []
+    for concurrency in args.concurrency:
+        configs = [("per-call", None), ("service", 0), ("service+lru", 4096)]
+        for name, cache_size in configs:
+            service = None
+            handle = per_call
+            if cache_size is not None:
+                service = EmbeddingService(encode_batch, max_batch_size=args.max_batch_size,
+                                           max_wait_ms=args.max_wait_ms, cache_size=cache_size)
+                handle = lambda query: service.encode([query])
+            latencies, elapsed = run_load(handle, requests, concurrency)
+            row = {
+                "path": name,
+                "concurrency": concurrency,
+                "requests_per_s": round(len(requests) / elapsed, 1),
+                "latency_ms_p50": round(float(np.percentile(latencies, 50)) * 1000, 2),
+                "latency_ms_p95": round(float(np.percentile(latencies, 95)) * 1000, 2),
+                "mean_batch_size": 1.0,
+                "forward_passes": len(requests),
+            }
+            if service is not None:
+                stats = service.stats()
+                service.stop()
+                row["mean_batch_size"] = round(stats["mean_batch_size"], 2)
+                row["forward_passes"] = stats["batches"]
+            rows.append(row)
+
+    baselines = {row["concurrency"]: row["requests_per_s"] for row in rows if row["path"] == "per-call"}
+    for row in rows:
+        row["speedup"] = round(row["requests_per_s"] / baselines[row["concurrency"]], 2)
+
+    if args.json:
+        print(json.dumps({"config": vars(args), "results": rows}, indent=2))
+        return
+
+    print(f"{args.model}: {args.requests} requests over {args.distinct} distinct queries")
+    header = list(rows[0].keys())
+    print("  ".join(f"{h:>16}" for h in header))
+    for row in rows:
+        print("  ".join(f"{row[h]!s:>16}" for h in header))
+
+
+if __name__ == "__main__":
+    main()
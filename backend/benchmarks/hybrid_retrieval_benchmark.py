@@ -0,0 +1,138 @@
+"""Latency and quality of hybrid (BM25 + dense, RRF) vs. the original two-pass retrieval.
+
+The original ``retrieve_relevant_knowledge`` ran a dense search for the
+patient-augmented query. It then checked whether the raw query string
+occurred in the joined result texts and, if not, embedded the bare query
+and ran a second dense search for two more items. The hybrid path embeds
+only the bare query, runs one dense search for that vector blended with
+the cached patient profile vector and one BM25 search for the query text
+(with the patient's term weights), and fuses the two rankings with RRF.
+
+Queries are generated from the knowledge base itself: each picks a target
+chunk, takes a few of its distinctive words and pairs them with a random
+patient. Hit rate and MRR measure how often (and how high) the target
+comes back.
+
+    python -m benchmarks.hybrid_retrieval_benchmark --queries 500
+"""
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from embedding_service import EmbeddingService
+from ingestion import build_snapshot, chunk_hash, iter_knowledge_chunks
+from lexical_index import STOPWORDS, tokenize
+from patient_profiles import PatientProfileCache
+from rag import RAGSystem
+from vector_index import FlatIndex
+
+
+def make_queries(snapshot, n, words_per_query, seed):
+    with open("../data/patients.json", "r") as f:
+        patients = json.load(f)
+    rng = random.Random(seed)
+    live = [i for i, text in enumerate(snapshot.texts) if text is not None]
+    queries = []
+    for _ in range(n):
+        target = rng.choice(live)
+        words = sorted({t for t in tokenize(snapshot.texts[target]) if t not in STOPWORDS and len(t) > 3})
+        picked = rng.sample(words, min(words_per_query, len(words)))
+        queries.append((" ".join(picked), rng.choice(patients), target))
+    return queries
+
+
+def patient_info(query, patient):
+    return (f"{query} for a {patient['age']} year old {patient['gender']} with medical history of "
+            f"{', '.join(patient['medicalHistory'])} taking {', '.join(patient['medications'])}")
+
+
+def two_pass(model, snapshot, query, patient, top_k=3):
+    """The original retrieval path, kept here as the baseline"""
+    scores, ids = snapshot.index.search(model.encode([patient_info(query, patient)], convert_to_numpy=True), top_k)
+    retrieved = [int(i) for i in ids[0] if i >= 0]
+    if query.lower() not in " ".join(snapshot.texts[i].lower() for i in retrieved):
+        _, extra = snapshot.index.search(model.encode([query], convert_to_numpy=True), 2)
+        retrieved += [int(i) for i in extra[0] if i >= 0 and int(i) not in retrieved]
+    return retrieved
+
+
+def evaluate(retrieve, queries):
+    latencies, hits, reciprocal_ranks, returned = [], 0, [], 0
+    for query, patient, target in queries:
+        start = time.perf_counter()
+        ids = retrieve(query, patient)
+        latencies.append(time.perf_counter() - start)
+        returned += len(ids)
+        if target in ids:
+            hits += 1
+            reciprocal_ranks.append(1.0 / (ids.index(target) + 1))
+        else:
+            reciprocal_ranks.append(0.0)
+    latencies = np.array(latencies)
+    return {
+        "hit_rate": round(hits / len(queries), 3),
+        "mrr": round(float(np.mean(reciprocal_ranks)), 3),
+        "mean_results": round(returned / len(queries), 2),
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)) * 1000, 2),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--words-per-query", type=int, default=3)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    model = SentenceTransformer(args.model, device="cpu")
+    chunks = list(iter_knowledge_chunks())
+    vectors = model.encode([item["text"] for _, item in chunks], convert_to_numpy=True)
+
+    def build_index(embeddings):
+        index = FlatIndex(embeddings.shape[1])
+        index.add(np.arange(len(embeddings)), embeddings)
+        return index
+
+    snapshot = build_snapshot(chunks, vectors, build_index)
+    queries = make_queries(snapshot, args.queries, args.words_per_query, args.seed)
+
+    # A RAGSystem with just the retrieval parts, skipping the LLM; no LRU so
+    # every query pays for its embedding like the baseline does
+    rag = RAGSystem.__new__(RAGSystem)
+    rag.knowledge = snapshot
+    rag.embedding_service = EmbeddingService(
+        lambda batch: model.encode(batch, batch_size=len(batch), convert_to_numpy=True), max_wait_ms=0, cache_size=0)
+    rag.patient_profiles = PatientProfileCache(rag.embedding_service.encode)
+
+    def hybrid(query, patient):
+        texts = [item["text"] for item in rag.retrieve_relevant_knowledge(query, patient, args.top_k)]
+        return [snapshot.ids[chunk_hash(text)] for text in texts]
+
+    evaluate(hybrid, queries[:5])  # warm-up
+    rows = [
+        {"path": "two-pass dense", **evaluate(lambda q, p: two_pass(model, snapshot, q, p, args.top_k), queries)},
+        {"path": "hybrid bm25+dense", **evaluate(hybrid, queries)},
+    ]
+    rag.embedding_service.stop()
+
+    if args.json:
+        print(json.dumps({"config": vars(args), "chunks": len(chunks), "results": rows}, indent=2))
+        return
+
+    print(f"{args.model}: {len(chunks)} chunks, {args.queries} queries of {args.words_per_query} words")
+    header = list(rows[0].keys())
+    print("  ".join(f"{h:>18}" for h in header))
+    for row in rows:
+        print("  ".join(f"{row[h]!s:>18}" for h in header))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Load test for the batched LLM inference scheduler on CPU.
+
+Fires ``--requests`` generations from ``--concurrency`` concurrent clients
+through ``BatchInferenceScheduler`` once per ``--batch-sizes`` value. A max
+batch size of 1 is the serial baseline (one generation at a time, as before
+batching), so the throughput column shows the gain from dynamic batching.
+
+    python -m benchmarks.inference_load_test --model microsoft/phi-2 --max-new-tokens 64
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
+
+from inference import BatchInferenceScheduler
+
+QUERIES = [
+    "What is the recommended metformin dose?",
+    "Any contraindications for NSAIDs?",
+    "How should hypertension be managed?",
+    "Is the current asthma treatment adequate?",
+    "What monitoring is needed for lisinopril?",
+    "Recommend next steps for chest pain",
+]
+
+
+def load_prompts(n):
+    with open("../data/patients.json", "r") as f:
+        patients = json.load(f)
+    prompts = []
+    for i in range(n):
+        patient = patients[i % len(patients)]
+        query = QUERIES[i % len(QUERIES)]
+        prompts.append(
+            "You are an AI clinical decision support system designed to help healthcare professionals.\n"
+            f"Patient: {patient['name']}, {patient['age']}y, {patient['gender']}. "
+            f"Medical history: {', '.join(patient['medicalHistory'])}. "
+            f"Medications: {', '.join(patient['medications'])}.\n\n"
+            f"Clinical Query: {query}\n\nResponse:"
+        )
+    return prompts
+
+
+def build_generate_batch(model_name, max_new_tokens, threads):
+    if threads:
+        torch.set_num_threads(threads)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32)
+    llm = pipeline("text-generation", model=model, tokenizer=tokenizer, device=-1)
+    if llm.tokenizer.pad_token is None:
+        llm.tokenizer.pad_token = llm.tokenizer.eos_token
+    llm.tokenizer.padding_side = "left"
+
+    def generate_batch(prompts):
+        # Greedy decoding so that every configuration does the same work
+        generated = llm(prompts, batch_size=len(prompts), max_new_tokens=max_new_tokens,
+                        do_sample=False, return_full_text=False)
+        return [sequences[0]["generated_text"] for sequences in generated]
+
+    return generate_batch, tokenizer
+
+
+async def run_load(scheduler, prompts, concurrency):
+    pending = list(enumerate(prompts))
+    latencies = []
+    outputs = [None] * len(prompts)
+
+    async def client():
+        while pending:
+            i, prompt = pending.pop(0)
+            start = time.perf_counter()
+            outputs[i] = await scheduler.submit(prompt)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return outputs, np.array(latencies), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="microsoft/phi-2")
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--max-wait-ms", type=int, default=20)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0 keeps the default)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    generate_batch, tokenizer = build_generate_batch(args.model, args.max_new_tokens, args.threads)
+    prompts = load_prompts(args.requests)
+    generate_batch(prompts[:1])  # warm-up
+
+    rows = []
+    for batch_size in args.batch_sizes:
+        scheduler = BatchInferenceScheduler(generate_batch, max_batch_size=batch_size, max_wait_ms=args.max_wait_ms)
+        outputs, latencies, elapsed = asyncio.run(run_load(scheduler, prompts, args.concurrency))
+        stats = scheduler.stats()
+        scheduler.stop()
+        tokens = sum(len(tokenizer(output)["input_ids"]) for output in outputs)
+        rows.append({
+            "max_batch_size": batch_size,
+            "requests_per_s": round(len(prompts) / elapsed, 3),
+            "tokens_per_s": round(tokens / elapsed, 1),
+            "latency_s_p50": round(float(np.percentile(latencies, 50)), 2),
+            "latency_s_p95": round(float(np.percentile(latencies, 95)), 2),
+            "mean_batch_size": round(stats["mean_batch_size"], 2),
+            "max_queue_depth": stats["max_queue_depth"],
+        })
+
+    baseline = rows[0]["requests_per_s"]
+    for row in rows:
+        row["speedup"] = round(row["requests_per_s"] / baseline, 2)
+
+    if args.json:
+        print(json.dumps({"config": vars(args), "results": rows}, indent=2))
+        return
+
+    print(f"{args.model}: {args.requests} requests, concurrency {args.concurrency}, "
+          f"{args.max_new_tokens} new tokens, {torch.get_num_threads()} threads")
+    header = list(rows[0].keys())
+    print("  ".join(f"{h:>16}" for h in header))
+    for row in rows:
+        print("  ".join(f"{row[h]!s:>16}" for h in header))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Patient search: the in-memory patient index vs. the linear scan and the SQLite store.
+
+A synthetic registry (see ``benchmarks.synthetic``) is written to a scratch
+directory and searched with random queries of three kinds: a name
+substring, a name plus a condition, and a condition plus an age range.
+Each query is answered by:
+
+- json_scan: the original path, loading patients.json and checking
+  ``name.lower() in p["name"].lower()`` (plus the filters) for every patient.
+- memory_scan: the same scan over a list already in memory.
+- sqlite: SQLitePatientRepository.list (name only; filters applied after).
+- index_all: PatientIndex.search for every match, then fetching the records.
+- index_page: the first page of ``--page-size`` matches, as the API serves it.
+
+    python -m benchmarks.patient_search_benchmark --patients 100000 --queries 200
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import CONDITIONS, FIRST_NAMES, LAST_NAMES, write_dataset
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def make_queries(n, rng):
+    queries = []
+    for i in range(n):
+        name = rng.choice(FIRST_NAMES + LAST_NAMES).lower()
+        start = rng.randint(0, max(0, len(name) - 3))
+        substring = name[start:start + rng.randint(3, 5)]
+        condition = rng.choice(CONDITIONS).split()[-1]
+        kind = ("name", "name_condition", "condition_age")[i % 3]
+        if kind == "name":
+            queries.append((kind, {"name": substring}))
+        elif kind == "name_condition":
+            queries.append((kind, {"name": substring, "condition": condition}))
+        else:
+            low = rng.randint(18, 80)
+            queries.append((kind, {"condition": condition, "min_age": low, "max_age": low + 10}))
+    return queries
+
+
+def scan(patients, name=None, condition=None, min_age=None, max_age=None):
+    from cohort import matches_filters
+
+    return [
+        p for p in patients
+        if (not name or name.lower() in p["name"].lower())
+        and matches_filters(p, condition)
+        and (min_age is None or p["age"] >= min_age)
+        and (max_age is None or p["age"] <= max_age)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=150)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--json-scan-queries", type=int, default=15,
+                        help="queries for json_scan, which reloads the file every time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix="cdss-search-")
+    try:
+        write_dataset(data_dir, args.patients, knowledge=1, history=0, seed=args.seed)
+        # Before anything imports config
+        os.environ.update(CDSS_DATA_DIR=data_dir)
+        from patient_index import PatientIndex
+        from patient_store import JsonPatientRepository, SQLitePatientRepository
+
+        json_repository = JsonPatientRepository(os.path.join(data_dir, "patients.json"))
+        sqlite_repository = SQLitePatientRepository(
+            os.path.join(data_dir, "cdss.db"), json_path=os.path.join(data_dir, "patients.json"),
+        )
+        in_memory = json_repository.load_all()
+
+        index = PatientIndex(sqlite_repository)
+        before = rss_mb()
+        start = time.perf_counter()
+        len(index)
+        build_s = time.perf_counter() - start
+        index_mb = rss_mb() - before
+
+        def index_search(limit):
+            def run(**query):
+                ids, _ = index.search(limit=limit, **query)
+                return sqlite_repository.get_many(ids)
+            return run
+
+        methods = {
+            "json_scan": lambda **query: scan(json_repository.load_all(), **query),
+            "memory_scan": lambda **query: scan(in_memory, **query),
+            "sqlite": lambda name=None, **query: scan(sqlite_repository.list(name), **query),
+            "index_all": index_search(None),
+            "index_page": index_search(args.page_size),
+        }
+        queries = make_queries(args.queries, random.Random(args.seed))
+        rows = []
+        for method, run in methods.items():
+            timings, mismatches = {}, {}
+            for i, (kind, query) in enumerate(queries):
+                if method == "json_scan" and i >= args.json_scan_queries:
+                    break
+                start = time.perf_counter()
+                found = run(**query)
+                timings.setdefault(kind, []).append(time.perf_counter() - start)
+                expected = [p["id"] for p in scan(in_memory, **query)]
+                if method == "index_page":
+                    expected = expected[:args.page_size]
+                mismatches[kind] = mismatches.get(kind, 0) + ([p["id"] for p in found] != expected)
+            for kind, latencies in timings.items():
+                latencies = np.array(latencies) * 1000
+                rows.append({
+                    "method": method,
+                    "query": kind,
+                    "queries": len(latencies),
+                    "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+                    "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+                    "mismatches": mismatches[kind],
+                })
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    results = {
+        "config": vars(args),
+        "index_build_s": round(build_s, 2),
+        "index_rss_mb": round(index_mb, 1),
+        "results": rows,
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{args.patients} patients; index built in {results['index_build_s']}s "
+          f"using about {results['index_rss_mb']} MB")
+    header = list(rows[0].keys())
+    print("  ".join(f"{h:>14}" for h in header))
+    for row in rows:
+        print("  ".join(f"{row[h]!s:>14}" for h in header))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Prefill time of full prompts vs. prompts whose instruction block comes from the prefix KV cache.
+
+Prompts are built by the RAG pipeline (``prepare_context`` and
+``_build_prompt``) for the patients in ``data/patients.json``, with the
+token budget of ``CDSS_PROMPT_MAX_TOKENS``. Prefill time is measured as
+the time ``generate`` takes for a single new token, per batch of
+``--batch-sizes`` prompts:
+
+- full: the whole prompt is processed, as the text-generation pipeline does.
+- prefix_cache: the cached key/value state of ``STATIC_PROMPT_PREFIX`` is
+  copied and only the rest of each prompt is processed.
+
+With ``--check-tokens N`` the first prompts are also decoded greedily for
+N tokens both ways and the share of identical tokens is reported.
+
+    python -m benchmarks.prefill_benchmark --prompts 20 --batch-sizes 1 4 --threads 8
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from benchmarks.inference_load_test import QUERIES
+
+
+def build_prompts(n):
+    # Retrieval only shapes the knowledge snippets; the offline embedder keeps this quick
+    os.environ.setdefault("CDSS_EMBEDDING_MODEL", "hash")
+    os.environ["CDSS_LLM"] = "stub"
+    from patient_store import create_patient_repository
+    from rag import RAGSystem
+
+    rag_system = RAGSystem()
+    patients = create_patient_repository().list()
+    prompts = []
+    for i in range(n):
+        patient, query = patients[i % len(patients)], QUERIES[i % len(QUERIES)]
+        _, context = rag_system.prepare_context(query, patient)
+        prompts.append(rag_system._build_prompt(context, query, patient))
+    rag_system.embedding_service.stop()
+    return prompts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="microsoft/phi-2")
+    parser.add_argument("--backend", default="float32", choices=["float32", "int8"])
+    parser.add_argument("--prompts", type=int, default=20)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--threads", type=int, default=0, help="torch threads (default: torch's choice)")
+    parser.add_argument("--check-tokens", type=int, default=16, help="greedy tokens compared per prompt (0 skips)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    # Before anything imports config
+    prompts = build_prompts(args.prompts)
+
+    import torch
+    from cpu_backends import load_causal_lm
+    from prompt_cache import PrefixKVCache
+    from rag import STATIC_PROMPT_PREFIX
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model, tokenizer = load_causal_lm(args.model, args.backend, trust_remote_code=True)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    cache = PrefixKVCache(model, tokenizer, STATIC_PROMPT_PREFIX)
+    suffixes = [prompt[len(STATIC_PROMPT_PREFIX):] for prompt in prompts]
+
+    start = time.perf_counter()
+    cache.generate_inputs(suffixes[:1])
+    prefix_build_ms = (time.perf_counter() - start) * 1000
+
+    def full_inputs(batch):
+        inputs = tokenizer(batch, return_tensors="pt", padding=True)
+        return {"input_ids": inputs["input_ids"], "attention_mask": inputs["attention_mask"]}
+
+    def cached_inputs(batch):
+        return cache.generate_inputs([prompt[len(STATIC_PROMPT_PREFIX):] for prompt in batch])
+
+    def prefill(make_inputs, batch):
+        # Input preparation is timed too: for the cache it includes copying the prefix state
+        start = time.perf_counter()
+        inputs = make_inputs(batch)
+        with torch.no_grad():
+            model.generate(**inputs, max_new_tokens=1, do_sample=False, pad_token_id=tokenizer.pad_token_id)
+        return time.perf_counter() - start
+
+    rows = []
+    for batch_size in args.batch_sizes:
+        batches = [prompts[i:i + batch_size] for i in range(0, len(prompts), batch_size)]
+        # Warm-up
+        prefill(full_inputs, batches[0])
+        prefill(cached_inputs, batches[0])
+        timings = {"full": [], "prefix_cache": []}
+        for batch in batches:
+            timings["full"].append(prefill(full_inputs, batch))
+            timings["prefix_cache"].append(prefill(cached_inputs, batch))
+        full_ms = float(np.median(timings["full"])) * 1000
+        cached_ms = float(np.median(timings["prefix_cache"])) * 1000
+        rows.append({
+            "batch_size": batch_size,
+            "batches": len(batches),
+            "full_p50_ms": round(full_ms, 1),
+            "prefix_cache_p50_ms": round(cached_ms, 1),
+            "speedup": round(full_ms / cached_ms, 2),
+        })
+
+    prompt_tokens = [len(tokenizer(prompt)["input_ids"]) for prompt in prompts]
+    results = {
+        "config": vars(args),
+        "prefix_tokens": cache.prefix_tokens,
+        "prompt_tokens_mean": round(float(np.mean(prompt_tokens)), 1),
+        "prompt_tokens_max": int(max(prompt_tokens)),
+        "prefix_build_ms": round(prefix_build_ms, 1),
+        "results": rows,
+    }
+
+    if args.check_tokens:
+        matching = total = 0
+        for prompt in prompts[:4]:
+            generated = []
+            for inputs in (full_inputs([prompt]), cached_inputs([prompt])):
+                with torch.no_grad():
+                    output = model.generate(**inputs, max_new_tokens=args.check_tokens, do_sample=False,
+                                            pad_token_id=tokenizer.pad_token_id)
+                generated.append(output[0, inputs["input_ids"].shape[1]:].tolist())
+            full, cached = generated
+            matching += sum(a == b for a, b in zip(full, cached))
+            total += len(full)
+        results["greedy_token_agreement"] = round(matching / total, 3) if total else None
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{len(prompts)} prompts, {results['prompt_tokens_mean']} tokens on average "
+          f"(max {results['prompt_tokens_max']}), {results['prefix_tokens']} of them in the cached prefix "
+          f"(built once in {results['prefix_build_ms']} ms)")
+    if "greedy_token_agreement" in results:
+        print(f"Greedy tokens identical with and without the cache: {results['greedy_token_agreement']:.1%}")
+    header = list(rows[0].keys())
+    print("  ".join(f"{h:>20}" for h in header))
+    for row in rows:
+        print("  ".join(f"{row[h]!s:>20}" for h in header))
+
+
+if __name__ == "__main__":
+    main()
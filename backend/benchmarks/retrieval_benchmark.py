@@ -0,0 +1,113 @@
+"""Recall@k vs. latency for the vector index backends.
+
+Compares the brute-force ``util.cos_sim`` + ``torch.topk`` path that
+``retrieve_relevant_knowledge`` used originally against the flat and IVF-PQ
+backends in ``vector_index``. The corpus is synthetic and clustered so that
+it can be generated at any scale without the embedding model.
+
+    python -m benchmarks.retrieval_benchmark --size 200000 --nprobe 4 8 16 32
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import torch
+from sentence_transformers import util
+
+from vector_index import FlatIndex, IVFPQIndex
+
+
+def make_corpus(size, dim, n_queries, seed, latent_dim=48):
+    """Clustered vectors on a low-dimensional subspace, like sentence embeddings"""
+    rng = np.random.default_rng(seed)
+    n_topics = max(1, size // 500)
+    topics = rng.normal(size=(n_topics, latent_dim))
+    latent = topics[rng.integers(0, n_topics, size)] + 0.5 * rng.normal(size=(size, latent_dim))
+    projection = rng.normal(size=(latent_dim, dim)) / np.sqrt(latent_dim)
+    corpus = latent @ projection + 0.05 * rng.normal(size=(size, dim))
+    picked = rng.integers(0, size, n_queries)
+    queries = (latent[picked] + 0.3 * rng.normal(size=(n_queries, latent_dim))) @ projection
+    return corpus.astype(np.float32), queries.astype(np.float32)
+
+
+def brute_force_search(corpus_tensor, query, k):
+    """The original retrieval path: cosine similarity over the whole tensor, then topk"""
+    cos_scores = util.cos_sim(torch.from_numpy(query[None, :]), corpus_tensor)[0]
+    top_results = torch.topk(cos_scores, k=min(k, len(cos_scores)))
+    return top_results[1].numpy()
+
+
+def timed_searches(search, queries):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, np.array(latencies)
+
+
+def summarise(name, results, latencies, ground_truth, k, build_seconds):
+    recall = np.mean([len(set(r[:k]) & set(g)) / len(g) for r, g in zip(results, ground_truth)])
+    return {
+        "backend": name,
+        f"recall@{k}": round(float(recall), 4),
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+        "latency_ms_mean": round(float(latencies.mean()), 3),
+        "build_s": round(build_seconds, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100000, help="number of corpus vectors")
+    parser.add_argument("--dim", type=int, default=384, help="embedding dimension (all-MiniLM-L6-v2 is 384)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3, help="top-k, as used by retrieve_relevant_knowledge")
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--m", type=int, default=32, help="PQ subvectors")
+    parser.add_argument("--rerank", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    corpus, queries = make_corpus(args.size, args.dim, args.queries, args.seed)
+    ids = np.arange(len(corpus))
+    rows = []
+
+    corpus_tensor = torch.from_numpy(corpus)
+    ground_truth, latencies = timed_searches(lambda q: brute_force_search(corpus_tensor, q, args.k), queries)
+    rows.append(summarise("brute-force (cos_sim+topk)", ground_truth, latencies, ground_truth, args.k, 0.0))
+
+    start = time.perf_counter()
+    flat = FlatIndex(args.dim)
+    flat.add(ids, corpus)
+    build = time.perf_counter() - start
+    results, latencies = timed_searches(lambda q: flat.search(q, args.k)[1][0], queries)
+    rows.append(summarise("flat", results, latencies, ground_truth, args.k, build))
+
+    start = time.perf_counter()
+    ivfpq = IVFPQIndex(args.dim, nlist=args.nlist, m=args.m, rerank=args.rerank, seed=args.seed)
+    ivfpq.add(ids, corpus)
+    build = time.perf_counter() - start
+    for nprobe in args.nprobe:
+        ivfpq.nprobe = nprobe
+        results, latencies = timed_searches(lambda q: ivfpq.search(q, args.k)[1][0], queries)
+        rows.append(summarise(f"ivfpq nprobe={nprobe}", results, latencies, ground_truth, args.k, build))
+
+    if args.json:
+        print(json.dumps({"config": vars(args), "results": rows}, indent=2))
+        return
+
+    print(f"{args.size} vectors x {args.dim} dims, {args.queries} queries, k={args.k}")
+    header = ["backend", f"recall@{args.k}", "latency_ms_p50", "latency_ms_p95", "latency_ms_mean", "build_s"]
+    print("  ".join(f"{h:>26}" if i == 0 else f"{h:>15}" for i, h in enumerate(header)))
+    for row in rows:
+        print("  ".join(f"{row[h]!s:>26}" if i == 0 else f"{row[h]!s:>15}" for i, h in enumerate(header)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Throughput and memory of the forked server (serve.py) for several worker counts.
+
+For each ``--workers`` value the server is started in a subprocess and,
+once ``/readyz`` answers, ``--concurrency`` client threads send ``/api/query``
+requests (rotating patients and queries) for ``--duration`` seconds. Then
+the memory of every server process is read from /proc:
+
+- RSS counts shared pages in full for every process, so the RSS total
+  overstates what a multi-process server really uses.
+- PSS splits each shared page between the processes that map it; the PSS
+  total is the real footprint.
+
+``--baseline`` also runs ``uvicorn main:app --workers N``, where each worker
+loads its own copy of the models, for comparison.
+
+    python -m benchmarks.serving_benchmark --workers 1 2 4 --duration 30 --baseline
+"""
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+QUERIES = [
+    "What is the recommended metformin dose?",
+    "Any contraindications for NSAIDs?",
+    "How should hypertension be managed?",
+    "Is the current asthma treatment adequate?",
+    "What monitoring is needed for lisinopril?",
+    "Recommend next steps for chest pain",
+]
+
+
+def request(url, body=None, timeout=600):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        return response.status, response.read()
+
+
+def wait_ready(url, server, timeout, consecutive):
+    """Wait for ``consecutive`` 200s from /readyz in a row (one per worker, roughly)"""
+    deadline = time.monotonic() + timeout
+    ok = 0
+    while ok < consecutive and time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            status, _ = request(f"{url}/readyz", timeout=2)
+            ok = ok + 1 if status == 200 else 0
+        except (urllib.error.URLError, ConnectionError, OSError):
+            ok = 0
+            time.sleep(0.5)
+    if ok < consecutive:
+        raise RuntimeError("Server did not become ready in time")
+
+
+def process_tree(pid):
+    pids = [pid]
+    for child in open(f"/proc/{pid}/task/{pid}/children").read().split():
+        pids.extend(process_tree(int(child)))
+    return pids
+
+
+def memory_mb(pid):
+    """(RSS, PSS) of a process in MB"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                values[parts[0]] = int(parts[1]) / 1024
+    return values.get("Rss:", 0.0), values.get("Pss:", 0.0)
+
+
+def load(url, patients, concurrency, duration):
+    latencies, errors = [], []
+    lock = threading.Lock()
+    bodies = itertools.cycle(
+        {"patientId": patient["id"], "query": query} for query in QUERIES for patient in patients
+    )
+    deadline = time.monotonic() + duration
+
+    def client():
+        while time.monotonic() < deadline:
+            with lock:
+                body = next(bodies)
+            start = time.perf_counter()
+            try:
+                request(f"{url}/api/query", body)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+            except (urllib.error.URLError, ConnectionError, OSError) as e:
+                with lock:
+                    errors.append(str(e))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def measure(mode, workers, args):
+    url = f"http://127.0.0.1:{args.port}"
+    if mode == "serve.py":
+        command = [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(args.port),
+                   "--workers", str(workers), "--threads", str(args.threads),
+                   "--inference-procs", str(args.inference_procs)]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port),
+                   "--workers", str(workers), "--log-level", "warning"]
+    env = dict(os.environ, CDSS_MODEL_LOADING="eager")
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(url, server, args.timeout, consecutive=2 * workers)
+        _, body = request(f"{url}/api/patients")
+        patients = json.loads(body)
+        latencies, errors, elapsed = load(url, patients, args.concurrency, args.duration)
+        memory = [memory_mb(pid) for pid in process_tree(server.pid)]
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    latencies = np.array(latencies) if latencies else np.zeros(1)
+    master_rss = memory[0][0]
+    children_rss = [rss for rss, _ in memory[1:]]
+    return {
+        "mode": mode,
+        "workers": workers,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "req_per_s": round(len(latencies) / elapsed, 2),
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)) * 1000, 1),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)) * 1000, 1),
+        "processes": len(memory),
+        "master_rss_mb": round(master_rss, 1),
+        "child_rss_mb": round(float(np.mean(children_rss)), 1) if children_rss else None,
+        "total_rss_mb": round(sum(rss for rss, _ in memory), 1),
+        "total_pss_mb": round(sum(pss for _, pss in memory), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=1, help="torch threads per serve.py worker")
+    parser.add_argument("--inference-procs", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load per configuration")
+    parser.add_argument("--baseline", action="store_true", help="also run uvicorn --workers N")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--timeout", type=float, default=900, help="seconds to wait for each server")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    modes = ["serve.py"] + (["uvicorn"] if args.baseline else [])
+    rows = [measure(mode, workers, args) for workers in args.workers for mode in modes]
+
+    if args.json:
+        print(json.dumps({"config": vars(args), "results": rows}, indent=2))
+        return
+
+    print(f"{args.concurrency} concurrent clients, {args.duration:.0f}s per configuration; "
+          "child = mean over worker (and inference) processes")
+    header = list(rows[0].keys())
+    print("  ".join(f"{h:>14}" for h in header))
+    for row in rows:
+        print("  ".join(f"{'-' if row[h] is None else row[h]!s:>14}" for h in header))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Startup time of the API for each model loading mode.
+
+Starts ``uvicorn main:app`` in a subprocess once per ``--modes`` value
+(``CDSS_MODEL_LOADING``) and polls it, recording how long after launch
+each endpoint first answers 200:
+
+- ``/healthz``: the process accepts connections
+- ``/api/patients``: patient routes serve (no models needed)
+- ``/readyz``: the models are loaded and queries can be answered
+
+``eager`` is the old behaviour, where nothing serves until the models load.
+
+    python -m benchmarks.startup_benchmark --modes eager background --timeout 900
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ENDPOINTS = ("/healthz", "/api/patients", "/readyz")
+
+
+def status_of(url):
+    try:
+        with urllib.request.urlopen(url, timeout=2) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, ConnectionError, OSError):
+        return None
+
+
+def measure(mode, port, timeout, poll_interval):
+    env = dict(os.environ, CDSS_MODEL_LOADING=mode)
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    first_ok = {}
+    try:
+        while len(first_ok) < len(ENDPOINTS) and time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                break
+            for endpoint in ENDPOINTS:
+                if endpoint not in first_ok and status_of(f"http://127.0.0.1:{port}{endpoint}") == 200:
+                    first_ok[endpoint] = time.perf_counter() - start
+            time.sleep(poll_interval)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    row = {"mode": mode}
+    for endpoint in ENDPOINTS:
+        seconds = first_ok.get(endpoint)
+        row[f"{endpoint}_s"] = round(seconds, 2) if seconds is not None else None
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["eager", "background", "lazy"])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for each server")
+    parser.add_argument("--poll-interval", type=float, default=0.1)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    rows = [measure(mode, args.port, args.timeout, args.poll_interval) for mode in args.modes]
+
+    if args.json:
+        print(json.dumps({"config": vars(args), "results": rows}, indent=2))
+        return
+
+    print("Seconds from launch to the first 200 (- = not within the timeout; "
+          "lazy only loads on the first query)")
+    header = list(rows[0].keys())
+    print("  ".join(f"{h:>16}" for h in header))
+    for row in rows:
+        print("  ".join(f"{'-' if row[h] is None else row[h]!s:>16}" for h in header))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""End-to-end benchmark suite: synthetic data, startup, endpoint load, retrieval and memory.
+
+Generates a synthetic dataset (see ``benchmarks.synthetic``) in a scratch
+data directory and runs the API on it with ``uvicorn main:app``:
+
+1. Startup: seconds until ``/healthz`` and ``/readyz`` answer, for a cold
+   start (migrating the JSON files and embedding the knowledge base) and a
+   warm restart on the same data directory.
+2. Endpoints: latency percentiles and throughput of each endpoint at
+   each ``--concurrency`` level, ``--requests`` requests per run.
+3. Memory: RSS/PSS of the server after startup and after the load.
+4. Retrieval: in-process latency of ``retrieve_relevant_knowledge``.
+
+By default the suite is offline and deterministic: the LLM is replaced by
+the mock response generator (``CDSS_LLM=stub``) and the embedder by the
+hashing stand-in (``CDSS_EMBEDDING_MODEL=hash``). ``--real-models`` uses
+the configured models instead. Results are JSON (``--output`` or
+``--json``) so runs can be compared across commits.
+
+    python -m benchmarks.suite --patients 100000 --knowledge 10000 --history 100000 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+
+import numpy as np
+
+from benchmarks.serving_benchmark import memory_mb, process_tree, request
+from benchmarks.synthetic import FIRST_NAMES, make_query, write_dataset
+
+# Listing every patient is skipped above this many patients
+LIST_ALL_MAX_PATIENTS = 10000
+
+
+def percentiles(latencies):
+    latencies = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p90_ms": round(float(np.percentile(latencies, 90)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        "max_ms": round(float(latencies.max()), 2),
+    }
+
+
+def server_memory(pid):
+    memory = [memory_mb(p) for p in process_tree(pid)]
+    return {"rss_mb": round(sum(rss for rss, _ in memory), 1), "pss_mb": round(sum(pss for _, pss in memory), 1)}
+
+
+def start_server(port, env):
+    """Start uvicorn and wait for /readyz; returns (process, startup timings)"""
+    url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    timings = {}
+    while "readyz_s" not in timings:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        for key, endpoint in (("healthz_s", "/healthz"), ("readyz_s", "/readyz")):
+            if key in timings:
+                continue
+            try:
+                status, _ = request(url + endpoint, timeout=2)
+            except (urllib.error.URLError, ConnectionError, OSError):
+                break
+            if status == 200:
+                timings[key] = round(time.perf_counter() - start, 3)
+        time.sleep(0.05)
+    return server, timings
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def scenarios(n_patients, queries, rng):
+    """(name, method, make_path, make_body) for each benchmarked endpoint"""
+    def patient_id():
+        return rng.randint(1, n_patients)
+
+    def query_body():
+        return {"patientId": patient_id(), "query": rng.choice(queries)}
+
+    items = [
+        ("get_patient", "GET", lambda: f"/api/patients/{patient_id()}", None),
+        ("search_patients", "GET",
+         lambda: f"/api/patients?name={urllib.parse.quote(rng.choice(FIRST_NAMES))}", None),
+        ("history_page", "GET", lambda: f"/api/patients/{patient_id()}/history?limit=20", None),
+        ("query", "POST", lambda: "/api/query", query_body),
+        ("query_stream", "POST", lambda: "/api/query/stream", query_body),
+    ]
+    if n_patients <= LIST_ALL_MAX_PATIENTS:
+        items.insert(0, ("list_patients", "GET", lambda: "/api/patients", None))
+    return items
+
+
+def run_endpoint(url, make_path, make_body, concurrency, n_requests):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    remaining = [n_requests]
+
+    def client():
+        nonlocal errors
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+                path, body = make_path(), (make_body() if make_body else None)
+            start = time.perf_counter()
+            try:
+                request(url + path, body)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+            except (urllib.error.URLError, ConnectionError, OSError):
+                with lock:
+                    errors += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {"requests": len(latencies), "errors": errors,
+            "req_per_s": round(len(latencies) / elapsed, 2), **percentiles(latencies)}
+
+
+def measure_retrieval(queries, n_patients, n_queries, rng):
+    """Latency of retrieve_relevant_knowledge in this process (env already set)"""
+    from patient_store import create_patient_repository
+    from rag import RAGSystem
+
+    rag_system = RAGSystem()
+    repository = create_patient_repository()
+    patients = [repository.get(rng.randint(1, n_patients)) for _ in range(min(n_queries, 1000))]
+    latencies = []
+    for i in range(n_queries):
+        start = time.perf_counter()
+        rag_system.retrieve_relevant_knowledge(queries[i % len(queries)], patients[i % len(patients)])
+        latencies.append(time.perf_counter() - start)
+    rag_system.embedding_service.stop()
+    return {"queries": n_queries, "knowledge_chunks": len(rag_system.knowledge.ids), **percentiles(latencies)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--knowledge", type=int, default=1000)
+    parser.add_argument("--history", type=int, default=1000, help="chat history entries in total")
+    parser.add_argument("--distinct-queries", type=int, default=500, help="size of the query pool")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and concurrency level")
+    parser.add_argument("--retrieval-queries", type=int, default=500)
+    parser.add_argument("--real-models", action="store_true", help="use the configured embedder and LLM")
+    parser.add_argument("--data-dir", help="scratch data directory (default: a temporary directory)")
+    parser.add_argument("--keep-data", action="store_true")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="cdss-bench-")
+    rng = random.Random(args.seed)
+    queries = [make_query(rng) for _ in range(args.distinct_queries)]
+    results = {
+        "config": vars(args),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "commit": git_commit(),
+        },
+    }
+
+    try:
+        start = time.perf_counter()
+        results["dataset"] = write_dataset(data_dir, args.patients, args.knowledge, args.history, args.seed)
+        results["dataset"]["generation_s"] = round(time.perf_counter() - start, 2)
+
+        # Applies to the servers and to the in-process retrieval measurement
+        os.environ.update(CDSS_DATA_DIR=data_dir, CDSS_MODEL_LOADING="background")
+        if not args.real_models:
+            os.environ.update(CDSS_LLM="stub", CDSS_EMBEDDING_MODEL="hash")
+        env = dict(os.environ)
+
+        url = f"http://127.0.0.1:{args.port}"
+        server, cold = start_server(args.port, env)
+        stop_server(server)
+        server, warm = start_server(args.port, env)
+        results["startup"] = {"cold": cold, "warm": warm}
+        try:
+            memory = {"after_startup": server_memory(server.pid)}
+            endpoints = []
+            for name, method, make_path, make_body in scenarios(args.patients, queries, rng):
+                for concurrency in args.concurrency:
+                    row = run_endpoint(url, make_path, make_body, concurrency, args.requests)
+                    endpoints.append({"endpoint": name, "method": method, "concurrency": concurrency, **row})
+            memory["after_load"] = server_memory(server.pid)
+        finally:
+            stop_server(server)
+        results["endpoints"] = endpoints
+        results["memory"] = memory
+        results["retrieval"] = measure_retrieval(queries, args.patients, args.retrieval_queries, rng)
+    finally:
+        if not args.data_dir and not args.keep_data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    dataset = results["dataset"]
+    print(f"{dataset['patients']} patients, {dataset['knowledge']} knowledge items, "
+          f"{dataset['history']} history entries (generated in {dataset['generation_s']}s)")
+    print(f"Startup (s): cold {cold}, warm {warm}")
+    print(f"Memory (MB): {memory}")
+    retrieval = results["retrieval"]
+    print(f"Retrieval over {retrieval['knowledge_chunks']} chunks: p50 {retrieval['p50_ms']} ms, "
+          f"p99 {retrieval['p99_ms']} ms")
+    header = list(endpoints[0].keys())
+    print("  ".join(f"{h:>14}" for h in header))
+    for row in endpoints:
+        print("  ".join(f"{row[h]!s:>14}" for h in header))
+
+
+if __name__ == "__main__":
+    main()
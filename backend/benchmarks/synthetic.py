@@ -0,0 +1,149 @@
+"""Synthetic patients, knowledge and chat history at benchmark scale.
+
+Everything is generated from a seed, so the same arguments always give the
+same dataset. Records are written to the files the backend migrates from
+(``patients.json``, ``knowledge.json``, ``chat_history.json``); patients
+and knowledge are streamed to disk one record at a time.
+
+    python -m benchmarks.synthetic --data-dir /tmp/cdss-bench --patients 100000 --knowledge 10000 --history 100000
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+from typing import Any, Dict, Iterator
+
+CONDITIONS = [
+    "Hypertension", "Type 2 Diabetes", "Asthma", "COPD", "Coronary Artery Disease", "Atrial Fibrillation",
+    "Heart Failure", "Chronic Kidney Disease", "Osteoarthritis", "Rheumatoid Arthritis", "Hypothyroidism",
+    "Depression", "Anxiety", "Migraine", "Epilepsy", "GERD", "Hyperlipidemia", "Osteoporosis", "Gout",
+    "Peptic Ulcer Disease", "Anemia", "Obesity", "Sleep Apnea", "Psoriasis",
+]
+MEDICATIONS = [
+    "Metformin", "Lisinopril", "Amlodipine", "Atorvastatin", "Albuterol", "Tiotropium", "Warfarin", "Apixaban",
+    "Metoprolol", "Furosemide", "Levothyroxine", "Sertraline", "Omeprazole", "Ibuprofen", "Acetaminophen",
+    "Aspirin", "Insulin Glargine", "Prednisone", "Allopurinol", "Alendronate", "Gabapentin", "Losartan",
+    "Methotrexate", "Sumatriptan",
+]
+FIRST_NAMES = [
+    "John", "Jane", "Robert", "Maria", "David", "Aisha", "Wei", "Priya", "Carlos", "Emma", "Ahmed", "Olga",
+    "Kenji", "Fatima", "Lucas", "Sofia", "Rahul", "Grace", "Tomas", "Amara",
+]
+LAST_NAMES = [
+    "Doe", "Smith", "Johnson", "Garcia", "Chen", "Patel", "Kim", "Nguyen", "Okafor", "Rossi", "Novak",
+    "Silva", "Tanaka", "Haddad", "Muller", "Kowalski", "Brown", "Ivanova", "Mensah", "Larsen",
+]
+BLOOD_GROUPS = ["A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"]
+SOURCES = [
+    "American Heart Association Guidelines", "American Diabetes Association Standards of Care",
+    "GOLD COPD Report", "GINA Asthma Guidelines", "KDIGO Guidelines", "NICE Guidelines", "FDA Drug Label",
+]
+QUERY_TEMPLATES = [
+    "What is the recommended {drug} dose?",
+    "Any contraindications for {drug} with {condition}?",
+    "How should {condition} be managed?",
+    "Is {drug} safe for this patient?",
+    "What monitoring is needed for {drug}?",
+    "Next steps for worsening {condition}",
+    "Interactions between {drug} and {other}?",
+]
+KNOWLEDGE_TEMPLATES = [
+    "For patients with {condition}, {drug} is a common first-line option unless contraindicated. "
+    "Review renal function and adjust the dose in older adults.",
+    "{drug} may interact with {other}; monitor for adverse effects when both are prescribed, "
+    "especially in patients with {condition}.",
+    "In {condition}, reassess symptoms every {weeks} weeks and escalate therapy if targets are not met.",
+    "Avoid {drug} in patients with {condition} when safer alternatives exist; consider {other} instead.",
+    "Baseline and periodic laboratory monitoring is recommended during long-term {drug} therapy "
+    "for {condition}.",
+]
+
+
+def iter_patients(n: int, seed: int = 0) -> Iterator[Dict[str, Any]]:
+    rng = random.Random(seed)
+    for patient_id in range(1, n + 1):
+        yield {
+            "id": patient_id,
+            "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "age": rng.randint(18, 95),
+            "gender": rng.choice(["Male", "Female"]),
+            "bloodGroup": rng.choice(BLOOD_GROUPS),
+            "medicalHistory": rng.sample(CONDITIONS, rng.randint(1, 3)),
+            "medications": rng.sample(MEDICATIONS, rng.randint(1, 4)),
+        }
+
+
+def iter_knowledge(n: int, seed: int = 0) -> Iterator[Dict[str, str]]:
+    rng = random.Random(seed + 1)
+    for i in range(n):
+        drug, other = rng.sample(MEDICATIONS, 2)
+        text = rng.choice(KNOWLEDGE_TEMPLATES).format(
+            condition=rng.choice(CONDITIONS), drug=drug, other=other, weeks=rng.choice([2, 4, 6, 12]),
+        )
+        # The item number keeps every text distinct, so none is deduplicated away
+        yield {"text": f"{text} (Recommendation {i + 1}.)", "source": rng.choice(SOURCES)}
+
+
+def make_query(rng: random.Random) -> str:
+    drug, other = rng.sample(MEDICATIONS, 2)
+    return rng.choice(QUERY_TEMPLATES).format(drug=drug, other=other, condition=rng.choice(CONDITIONS))
+
+
+def iter_chat_history(n: int, n_patients: int, seed: int = 0) -> Iterator[Dict[str, Any]]:
+    """``n`` entries for random patients, in timestamp order"""
+    rng = random.Random(seed + 2)
+    start = datetime.datetime(2025, 1, 1)
+    for i in range(n):
+        query = make_query(rng)
+        yield {
+            "patientId": rng.randint(1, max(1, n_patients)),
+            "timestamp": (start + datetime.timedelta(seconds=30 * i)).isoformat(),
+            "query": query,
+            "response": f"Synthetic response to \"{query}\".",
+        }
+
+
+def _write_json_list(path: str, records: Iterator[Any]) -> int:
+    count = 0
+    with open(path, "w") as f:
+        f.write("[\n")
+        for record in records:
+            f.write(",\n" if count else "")
+            f.write(json.dumps(record))
+            count += 1
+        f.write("\n]\n")
+    return count
+
+
+def write_dataset(data_dir: str, patients: int, knowledge: int, history: int, seed: int = 0) -> Dict[str, int]:
+    """Write the three JSON files into ``data_dir``; returns the record counts"""
+    os.makedirs(data_dir, exist_ok=True)
+    counts = {
+        "patients": _write_json_list(os.path.join(data_dir, "patients.json"), iter_patients(patients, seed)),
+        "knowledge": _write_json_list(os.path.join(data_dir, "knowledge.json"), iter_knowledge(knowledge, seed)),
+    }
+    # chat_history.json maps patient id to that patient's entries
+    by_patient: Dict[str, list] = {}
+    for entry in iter_chat_history(history, patients, seed):
+        by_patient.setdefault(str(entry.pop("patientId")), []).append(entry)
+    with open(os.path.join(data_dir, "chat_history.json"), "w") as f:
+        json.dump(by_patient, f)
+    counts["history"] = history
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", required=True)
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--knowledge", type=int, default=1000)
+    parser.add_argument("--history", type=int, default=1000, help="chat history entries in total")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    counts = write_dataset(args.data_dir, args.patients, args.knowledge, args.history, args.seed)
+    print(json.dumps(counts))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import (
+    CHAT_HISTORY_FILE, DATABASE_FILE, CHAT_HISTORY_DURABILITY,
+    CHAT_HISTORY_GROUP_COMMIT_MS, CHAT_HISTORY_COMPACTION_INTERVAL_S,
+)
+
+DURABILITY_MODES = ("always", "group")
+
+
+class ChatHistoryStore:
+    """Append-only chat history log stored in an SQLite table.
+
+    Every entry is one row keyed by a monotonically increasing ``seq``; the
+    ``(patient_id, seq)`` index is the per-patient offset index, so reading a
+    page of one patient's history never touches other patients' rows and
+    ``seq`` doubles as the pagination cursor.
+
+    Durability is configurable:
+
+    - ``"always"``: each append is its own transaction and is fsynced
+      before ``append`` returns.
+    - ``"group"``: appends are buffered and committed together every
+      ``group_commit_ms`` milliseconds (one fsync per group). Reads in this
+      process flush the buffer first, so they always see their own writes;
+      a crash can lose at most one group window.
+
+    Compaction periodically checkpoints the write-ahead log back into the
+    database file and truncates it, so the log does not grow without bound.
+    """
+
+    def __init__(self, path: str = DATABASE_FILE, json_path: Optional[str] = CHAT_HISTORY_FILE,
+                 durability: str = CHAT_HISTORY_DURABILITY, group_commit_ms: int = CHAT_HISTORY_GROUP_COMMIT_MS,
+                 compaction_interval_s: int = CHAT_HISTORY_COMPACTION_INTERVAL_S, max_group_size: int = 256):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode '{durability}', expected one of {DURABILITY_MODES}")
+        self.path = path
+        self.durability = durability
+        self.group_commit_interval = group_commit_ms / 1000
+        self.compaction_interval = compaction_interval_s
+        self.max_group_size = max_group_size
+
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._pending: List[Tuple[int, str, str, str]] = []
+        self._closed = threading.Event()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # One writer connection, shared by request threads and the background threads
+        self._writer = self._open_connection(check_same_thread=False)
+        self._writer.execute("PRAGMA synchronous=FULL")
+        self._initialize_schema()
+        if json_path:
+            self.migrate_from_json(json_path)
+
+        self._threads = []
+        if self.durability == "group":
+            self._start_thread(self._group_commit_loop, "chat-history-group-commit")
+        if self.compaction_interval > 0:
+            self._start_thread(self._compaction_loop, "chat-history-compaction")
+
+    def _open_connection(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=check_same_thread)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open_connection()
+            self._local.conn = conn
+        return conn
+
+    def _initialize_schema(self):
+        with self._write_lock:
+            self._writer.execute("""
+                CREATE TABLE IF NOT EXISTS chat_history (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    patient_id INTEGER NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    response TEXT NOT NULL
+                )
+            """)
+            self._writer.execute(
+                "CREATE INDEX IF NOT EXISTS idx_chat_history_patient ON chat_history (patient_id, seq)"
+            )
+            self._writer.execute("CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def append(self, patient_id: int, query: str, response: str, timestamp: Optional[str] = None) -> Dict[str, Any]:
+        """Append one chat entry for a patient and return it"""
+        entry = {
+            "timestamp": timestamp or datetime.datetime.now().isoformat(),
+            "query": query,
+            "response": response,
+        }
+        row = (patient_id, entry["timestamp"], entry["query"], entry["response"])
+        with self._write_lock:
+            self._pending.append(row)
+            if self.durability == "always" or len(self._pending) >= self.max_group_size:
+                self._commit_pending()
+        return entry
+
+    def flush(self):
+        """Commit any buffered appends"""
+        with self._write_lock:
+            self._commit_pending()
+
+    def _commit_pending(self):
+        # Caller holds _write_lock
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        self._writer.execute("BEGIN IMMEDIATE")
+        try:
+            self._writer.executemany(
+                "INSERT INTO chat_history (patient_id, timestamp, query, response) VALUES (?, ?, ?, ?)", rows
+            )
+            self._writer.execute("COMMIT")
+        except BaseException:
+            self._writer.execute("ROLLBACK")
+            # Keep the entries for the next attempt rather than dropping them
+            self._pending = rows + self._pending
+            raise
+
+    def read(self, patient_id: int, cursor: Optional[int] = None,
+             limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Return a page of a patient's history in chronological order.
+
+        ``cursor`` is the ``nextCursor`` from the previous page (omit it for
+        the first page). The returned cursor is None once the history is
+        exhausted.
+        """
+        if self._pending:
+            self.flush()
+        sql = "SELECT seq, timestamp, query, response FROM chat_history WHERE patient_id = ? AND seq > ? ORDER BY seq"
+        params: Tuple[Any, ...] = (patient_id, cursor or 0)
+        if limit is not None:
+            # Fetch one extra row to learn whether another page exists
+            sql += " LIMIT ?"
+            params += (limit + 1,)
+        rows = self._reader().execute(sql, params).fetchall()
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1]["seq"]
+        entries = [{"timestamp": r["timestamp"], "query": r["query"], "response": r["response"]} for r in rows]
+        return entries, next_cursor
+
+    def compact(self):
+        """Fold the write-ahead log into the database file and truncate it"""
+        self.flush()
+        with self._write_lock:
+            self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._writer.execute("PRAGMA optimize")
+
+    def migrate_from_json(self, json_path: str) -> int:
+        """Import the legacy chat_history.json once, preserving entry order"""
+        if not os.path.exists(json_path):
+            return 0
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                done = self._writer.execute(
+                    "SELECT value FROM store_meta WHERE key = 'chat_history_migrated_from'"
+                ).fetchone()
+                if done:
+                    self._writer.execute("COMMIT")
+                    return 0
+                with open(json_path, "r") as f:
+                    try:
+                        history = json.load(f)
+                    except json.JSONDecodeError:
+                        history = {}
+                rows = [
+                    (int(patient_id), entry["timestamp"], entry["query"], entry["response"])
+                    for patient_id, entries in history.items()
+                    for entry in entries
+                ]
+                rows.sort(key=lambda row: row[1])
+                self._writer.executemany(
+                    "INSERT INTO chat_history (patient_id, timestamp, query, response) VALUES (?, ?, ?, ?)", rows
+                )
+                self._writer.execute(
+                    "INSERT INTO store_meta (key, value) VALUES ('chat_history_migrated_from', ?)",
+                    (os.path.abspath(json_path),),
+                )
+                self._writer.execute("COMMIT")
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+        print(f"Migrated {len(rows)} chat history entries from {json_path} to {self.path}")
+        return len(rows)
+
+    def _group_commit_loop(self):
+        while not self._closed.wait(self.group_commit_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Chat history group commit failed, will retry: {e}")
+
+    def _compaction_loop(self):
+        while not self._closed.wait(self.compaction_interval):
+            try:
+                self.compact()
+            except sqlite3.Error as e:
+                print(f"Chat history compaction failed: {e}")
+
+    def close(self):
+        """Stop the background threads and commit anything still buffered"""
+        self._closed.set()
+        for thread in self._threads:
+            thread.join()
+        self.flush()
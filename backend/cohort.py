@@ -0,0 +1,304 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from lexical_index import content_tokens
+from config import DATABASE_FILE
+from metrics import LLM_FALLBACKS
+
+
+def matches_filters(patient: Dict[str, Any], condition: Optional[str] = None,
+                    medication: Optional[str] = None) -> bool:
+    """Whether a patient has a condition and a medication containing all of the filter's terms.
+
+    Matching is by content tokens, so "diabetes" matches "Type 2 Diabetes".
+    """
+    for wanted, names in ((condition, patient["medicalHistory"]), (medication, patient["medications"])):
+        if wanted:
+            terms = content_tokens(wanted)
+            if not any(terms <= content_tokens(name) for name in names):
+                return False
+    return True
+
+
+class CohortJob:
+    """Progress of one cohort query; ``cancel`` stops it at the next result"""
+
+    def __init__(self, job_id: str, query: str, total: int):
+        self.id = job_id
+        self.query = query
+        self.total = total
+        self.completed = 0
+        self.failed = 0
+        self.cached = 0
+        self.started = time.time()
+        self.finished: Optional[float] = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def status(self) -> Dict[str, Any]:
+        if self.finished is None:
+            state = "running"
+        else:
+            state = "cancelled" if self.cancelled else "done"
+        return {
+            "jobId": self.id,
+            "query": self.query,
+            "status": state,
+            "total": self.total,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cached": self.cached,
+            "elapsedSeconds": round((self.finished or time.time()) - self.started, 3),
+        }
+
+
+class CohortRegistry:
+    """Cohort jobs by id, shared by every process that uses the same database.
+
+    Jobs run in the process that created them. A background thread writes
+    their progress to the ``cohort_jobs`` table every ``sync_interval_s`` and
+    picks up cancellations made through other processes, so under serve.py
+    any worker can report or cancel any job.
+    """
+
+    def __init__(self, path: str = DATABASE_FILE, max_finished: int = 100, sync_interval_s: float = 0.5):
+        self.path = path
+        self.max_finished = max_finished
+        self.sync_interval_s = sync_interval_s
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Jobs of this process whose final state has not been written yet
+        self._jobs: Dict[str, CohortJob] = {}
+        self._initialize_schema()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._sync_loop, name="cohort-sync", daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _initialize_schema(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # AUTOINCREMENT so ids of pruned jobs are never handed out again
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS cohort_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                query TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                completed INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                cached INTEGER NOT NULL DEFAULT 0,
+                started REAL NOT NULL,
+                finished REAL,
+                cancelled INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+
+    @staticmethod
+    def _row_id(job_id: str) -> Optional[int]:
+        prefix, _, number = job_id.partition("-")
+        return int(number) if prefix == "cohort" and number.isdigit() else None
+
+    def create(self, query: str, total: int) -> CohortJob:
+        conn = self._connect()
+        started = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row_id = conn.execute("INSERT INTO cohort_jobs (query, total, started) VALUES (?, ?, ?)",
+                                  (query, total, started)).lastrowid
+            # Forget the oldest finished jobs; running ones are always kept
+            conn.execute("""
+                DELETE FROM cohort_jobs WHERE finished IS NOT NULL AND id NOT IN (
+                    SELECT id FROM cohort_jobs WHERE finished IS NOT NULL ORDER BY id DESC LIMIT ?)
+            """, (self.max_finished,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        job = CohortJob(f"cohort-{row_id}", query, total)
+        job.started = started
+        with self._lock:
+            self._jobs[job.id] = job
+        return job
+
+    def _stored_job(self, job_id: str) -> Optional[CohortJob]:
+        row_id = self._row_id(job_id)
+        if row_id is None:
+            return None
+        row = self._connect().execute("SELECT * FROM cohort_jobs WHERE id = ?", (row_id,)).fetchone()
+        if row is None:
+            return None
+        job = CohortJob(job_id, row["query"], row["total"])
+        job.completed, job.failed, job.cached = row["completed"], row["failed"], row["cached"]
+        job.started, job.finished = row["started"], row["finished"]
+        if row["cancelled"]:
+            job.cancel()
+        return job
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status of a job; live if it runs in this process, else as last written by its owner"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            job = self._stored_job(job_id)
+        return job.status() if job is not None else None
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Cancel a job; one running in another process stops within ``sync_interval_s``"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            job.cancel()
+            return job.status()
+        row_id = self._row_id(job_id)
+        if row_id is not None:
+            self._connect().execute("UPDATE cohort_jobs SET cancelled = 1 WHERE id = ? AND finished IS NULL",
+                                    (row_id,))
+        return self.status(job_id)
+
+    def sync(self):
+        """Write the progress of this process's jobs and pick up cancellations made elsewhere"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if not jobs:
+            return
+        # Jobs that finished before this write are written for the last time
+        done = [job for job in jobs if job.finished is not None]
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("""
+                UPDATE cohort_jobs SET completed = ?, failed = ?, cached = ?, finished = ?,
+                    cancelled = MAX(cancelled, ?) WHERE id = ?
+            """, [(job.completed, job.failed, job.cached, job.finished, job.cancelled, self._row_id(job.id))
+                  for job in jobs])
+            cancelled = {row["id"] for row in conn.execute(
+                f"SELECT id FROM cohort_jobs WHERE cancelled = 1 AND id IN ({','.join('?' * len(jobs))})",
+                [self._row_id(job.id) for job in jobs])}
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        for job in jobs:
+            if self._row_id(job.id) in cancelled:
+                job.cancel()
+        with self._lock:
+            for job in done:
+                self._jobs.pop(job.id, None)
+
+    def _sync_loop(self):
+        while not self._closed.wait(self.sync_interval_s):
+            try:
+                self.sync()
+            except sqlite3.Error as e:
+                print(f"Cohort job sync failed: {e}")
+
+    def close(self):
+        """Stop the sync thread and write the final state of this process's jobs"""
+        self._closed.set()
+        self._thread.join()
+        self.sync()
+
+
+async def run_cohort(rag_system, query: str, patients: List[Dict[str, Any]], job: CohortJob,
+                     max_in_flight: int = 16) -> AsyncIterator[Dict[str, Any]]:
+    """Answer one query for every patient, yielding events as results complete.
+
+    Events are ``started``, then one ``result`` or ``error`` per patient in
+    completion order (each carrying ``completed``/``total``), then ``done``.
+    Retrieval for the whole cohort runs once in a worker thread; prompts go
+    to the shared batching scheduler at most ``max_in_flight`` at a time,
+    so interactive queries queued meanwhile are not stuck behind the whole
+    cohort. Prompts go through ``scheduler.submit``, so a prompt that times
+    out (under serve.py) is reported as that patient's ``error``. Closing the
+    generator or cancelling the job drops the prompts that have not been
+    generated yet.
+    """
+    max_in_flight = max(1, max_in_flight)
+    yield {"type": "started", "jobId": job.id, "total": job.total}
+
+    prepared = await asyncio.to_thread(rag_system.prepare_cohort, query, patients)
+    scheduler = rag_system.inference_scheduler
+
+    def progress(event):
+        return {**event, "completed": job.completed + job.failed, "total": job.total}
+
+    def result(item, response, cached=False):
+        job.completed += 1
+        job.cached += cached
+        return progress({"type": "result", "patientId": item["patient"]["id"],
+                         "patientName": item["patient"]["name"], "response": response, "cached": cached})
+
+    waiting = deque()
+    pending: Dict[asyncio.Future, Dict[str, Any]] = {}
+    try:
+        for item in prepared:
+            if job.cancelled:
+                break
+            if item["cached"] is not None:
+                yield result(item, item["cached"], cached=True)
+            elif scheduler is None:
+                response = rag_system._generate_mock_response(query, item["patient"], item["relevant_knowledge"])
+                rag_system.store_cached_response(item["cache_key"], query, response)
+                yield result(item, response)
+            else:
+                waiting.append(item)
+
+        while (waiting or pending) and not job.cancelled:
+            while waiting and len(pending) < max_in_flight:
+                item = waiting.popleft()
+                pending[asyncio.ensure_future(scheduler.submit(item["prompt"]))] = item
+            # Wake up periodically so a cancel from another request is noticed
+            done, _ = await asyncio.wait(pending, timeout=0.5, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                try:
+                    response = rag_system.record_generation(future.result())
+                except Exception as e:
+                    print(f"Error generating LLM response for patient {item['patient']['id']}: {e}")
+                    job.failed += 1
+                    LLM_FALLBACKS.inc(path="cohort")
+                    # Same fallback as a single query, but reported as an error
+                    yield progress({
+                        "type": "error",
+                        "patientId": item["patient"]["id"],
+                        "patientName": item["patient"]["name"],
+                        "detail": f"Error generating response: {str(e)}",
+                        "response": rag_system._generate_mock_response(query, item["patient"], item["relevant_knowledge"]),
+                    })
+                    continue
+                rag_system.store_cached_response(item["cache_key"], query, response)
+                yield result(item, response)
+    finally:
+        # A client disconnect closes the generator early; that counts as a cancel
+        if job.completed + job.failed < job.total:
+            job.cancel()
+        # Prompts not yet picked up by the scheduler are skipped
+        for future in pending:
+            # Tasks that already failed are not cancelled; collect their error so it is not logged
+            if not future.cancel():
+                future.exception()
+        job.finished = time.time()
+
+    yield {"type": "done", **job.status()}
@@ -0,0 +1,118 @@
+import os
+
+# Data paths (relative to backend/, matching how the API is launched)
+DATA_DIR = os.environ.get("CDSS_DATA_DIR", "../data")
+
+PATIENTS_FILE = os.path.join(DATA_DIR, "patients.json")
+KNOWLEDGE_FILE = os.path.join(DATA_DIR, "knowledge.json")
+CHAT_HISTORY_FILE = os.path.join(DATA_DIR, "chat_history.json")
+
+# Embedding model and the on-disk embedding store
+# "hash" selects an offline feature-hashing stand-in (no download, not semantic)
+EMBEDDING_MODEL_NAME = os.environ.get("CDSS_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# "phi-2" (default) or "stub": skip the LLM and answer with the deterministic mock responses
+LLM_MODE = os.environ.get("CDSS_LLM", "phi-2")
+EMBEDDING_CACHE_DIR = os.environ.get("CDSS_EMBEDDING_CACHE_DIR", os.path.join(DATA_DIR, "embeddings"))
+# "float32" or "float16"; float16 halves the file size and page-cache footprint
+# (the vector index searches it in place, converting a block of rows at a time)
+EMBEDDING_CACHE_DTYPE = os.environ.get("CDSS_EMBEDDING_CACHE_DTYPE", "float32")
+
+# Vector index used for knowledge retrieval: "flat" (exact) or "ivfpq" (approximate)
+VECTOR_INDEX_BACKEND = os.environ.get("CDSS_VECTOR_INDEX", "flat")
+# IVF-PQ recall/latency knobs; higher nprobe/rerank trade latency for recall
+IVF_NLIST = int(os.environ.get("CDSS_IVF_NLIST", "256"))
+IVF_NPROBE = int(os.environ.get("CDSS_IVF_NPROBE", "16"))
+PQ_SUBVECTORS = int(os.environ.get("CDSS_PQ_SUBVECTORS", "32"))
+IVF_RERANK = int(os.environ.get("CDSS_IVF_RERANK", "8"))
+
+# Patient store: "sqlite" (indexed, WAL mode) or "json" (the original single file)
+PATIENT_STORE = os.environ.get("CDSS_PATIENT_STORE", "sqlite")
+# "json" store: writes are coalesced into one atomic file write per interval
+PATIENT_FLUSH_INTERVAL_MS = int(os.environ.get("CDSS_PATIENT_FLUSH_INTERVAL_MS", "50"))
+DATABASE_FILE = os.environ.get("CDSS_DATABASE_FILE", os.path.join(DATA_DIR, "cdss.db"))
+
+# Chat history log: "always" fsyncs every append, "group" commits appends in batches
+CHAT_HISTORY_DURABILITY = os.environ.get("CDSS_CHAT_HISTORY_DURABILITY", "group")
+CHAT_HISTORY_GROUP_COMMIT_MS = int(os.environ.get("CDSS_CHAT_HISTORY_GROUP_COMMIT_MS", "50"))
+# How often the write-ahead log is checkpointed and truncated (0 disables)
+CHAT_HISTORY_COMPACTION_INTERVAL_S = int(os.environ.get("CDSS_CHAT_HISTORY_COMPACTION_INTERVAL_S", "600"))
+
+# Dynamic batching of concurrent LLM generations
+INFERENCE_MAX_BATCH_SIZE = int(os.environ.get("CDSS_INFERENCE_MAX_BATCH_SIZE", "8"))
+# How long the scheduler waits for more requests to join a batch
+INFERENCE_MAX_WAIT_MS = int(os.environ.get("CDSS_INFERENCE_MAX_WAIT_MS", "20"))
+# Streamed queries generate outside the batching scheduler; at most this many run at once per process
+STREAM_MAX_CONCURRENT = int(os.environ.get("CDSS_STREAM_MAX_CONCURRENT", "2"))
+# How long a streamed query waits for a free slot before answering 503
+STREAM_QUEUE_TIMEOUT_S = float(os.environ.get("CDSS_STREAM_QUEUE_TIMEOUT_S", "30"))
+# How long a cancelled stream waits for its generation thread to stop before freeing its slot
+STREAM_STOP_TIMEOUT_S = float(os.environ.get("CDSS_STREAM_STOP_TIMEOUT_S", "5"))
+
+# Prompt length budget in tokens (phi-2 reads 2048 tokens, generation adds up to 512);
+# the lowest-ranked knowledge snippets are dropped or shortened to fit
+PROMPT_MAX_TOKENS = int(os.environ.get("CDSS_PROMPT_MAX_TOKENS", "1024"))
+# Reuse the key/value state of the fixed instruction block instead of recomputing it per prompt
+PROMPT_PREFIX_CACHE_ENABLED = os.environ.get("CDSS_PROMPT_PREFIX_CACHE", "1") == "1"
+
+# Semantic response cache
+RESPONSE_CACHE_ENABLED = os.environ.get("CDSS_RESPONSE_CACHE", "1") == "1"
+# Minimum cosine similarity between queries for a cache hit
+RESPONSE_CACHE_SIMILARITY = float(os.environ.get("CDSS_RESPONSE_CACHE_SIMILARITY", "0.92"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("CDSS_RESPONSE_CACHE_MAX_ENTRIES", "2048"))
+RESPONSE_CACHE_MAX_MB = int(os.environ.get("CDSS_RESPONSE_CACHE_MAX_MB", "64"))
+RESPONSE_CACHE_TTL_S = int(os.environ.get("CDSS_RESPONSE_CACHE_TTL_S", "3600"))
+
+# Model loading: "background" (default), "lazy" (on first query) or "eager" (before serving)
+MODEL_LOADING = os.environ.get("CDSS_MODEL_LOADING", "background")
+# How long a query waits for the models before answering 503 (0 rejects immediately)
+MODEL_READY_TIMEOUT_S = float(os.environ.get("CDSS_MODEL_READY_TIMEOUT_S", "30"))
+
+# CPU inference backends: "float32", "int8" (dynamic quantisation) or "onnx" (ONNX Runtime)
+EMBEDDING_BACKEND = os.environ.get("CDSS_EMBEDDING_BACKEND", "float32")
+# Used for the LLM when no GPU is available
+LLM_CPU_BACKEND = os.environ.get("CDSS_LLM_CPU_BACKEND", "float32")
+# Where ONNX exports are cached so they are only built once
+MODEL_EXPORT_DIR = os.environ.get("CDSS_MODEL_EXPORT_DIR", os.path.join(DATA_DIR, "models"))
+
+# Query embedding service: concurrent encodes are coalesced into micro-batches
+EMBEDDING_MAX_BATCH_SIZE = int(os.environ.get("CDSS_EMBEDDING_MAX_BATCH_SIZE", "64"))
+EMBEDDING_MAX_WAIT_MS = int(os.environ.get("CDSS_EMBEDDING_MAX_WAIT_MS", "2"))
+# Recently embedded strings kept in memory (0 disables the LRU)
+EMBEDDING_LRU_SIZE = int(os.environ.get("CDSS_EMBEDDING_LRU_SIZE", "4096"))
+
+# Knowledge ingestion: guideline documents (.txt/.md) chunked alongside knowledge.json
+KNOWLEDGE_DOCS_DIR = os.environ.get("CDSS_KNOWLEDGE_DOCS_DIR", os.path.join(DATA_DIR, "guidelines"))
+# Chunk size and overlap in words (all-MiniLM-L6-v2 reads at most 256 word pieces)
+CHUNK_WORDS = int(os.environ.get("CDSS_CHUNK_WORDS", "160"))
+CHUNK_OVERLAP_WORDS = int(os.environ.get("CDSS_CHUNK_OVERLAP_WORDS", "32"))
+# Chunks embedded (and inserted into the index) per batch, bounding memory during ingestion
+INGEST_BATCH_SIZE = int(os.environ.get("CDSS_INGEST_BATCH_SIZE", "256"))
+
+# Per-patient profiles (context header, term sets, profile embedding) kept in memory
+PATIENT_PROFILE_CACHE_SIZE = int(os.environ.get("CDSS_PATIENT_PROFILE_CACHE_SIZE", "10000"))
+# Share of the query in the retrieval vector; the rest is the patient's profile vector
+PROFILE_QUERY_WEIGHT = float(os.environ.get("CDSS_PROFILE_QUERY_WEIGHT", "0.7"))
+
+# Cohort queries: one question answered for many patients
+COHORT_MAX_PATIENTS = int(os.environ.get("CDSS_COHORT_MAX_PATIENTS", "1000"))
+# Cohort prompts queued on the LLM scheduler at once; interactive queries queue behind at most this many
+COHORT_MAX_IN_FLIGHT = int(os.environ.get("CDSS_COHORT_MAX_IN_FLIGHT", str(2 * INFERENCE_MAX_BATCH_SIZE)))
+
+# Multi-process serving (serve.py): the models are loaded once and shared by forked workers
+SERVE_HOST = os.environ.get("CDSS_SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.environ.get("CDSS_SERVE_PORT", "8000"))
+SERVE_WORKERS = int(os.environ.get("CDSS_SERVE_WORKERS", "2"))
+# torch intra-op threads per HTTP worker (query embedding, streamed generation)
+SERVE_THREADS = int(os.environ.get("CDSS_SERVE_THREADS", "1"))
+# Dedicated LLM processes fed by all HTTP workers (0 generates inside each worker)
+INFERENCE_PROCESSES = int(os.environ.get("CDSS_INFERENCE_PROCESSES", "1"))
+INFERENCE_THREADS = int(os.environ.get("CDSS_INFERENCE_THREADS", str(max(1, (os.cpu_count() or 1) // 2))))
+# Seconds an HTTP worker waits for an inference process to answer a prompt before giving up
+INFERENCE_TIMEOUT_S = float(os.environ.get("CDSS_INFERENCE_TIMEOUT_S", "300"))
+# Seconds a stopping or replaced worker gets to finish its open requests
+SERVE_GRACEFUL_TIMEOUT_S = int(os.environ.get("CDSS_SERVE_GRACEFUL_TIMEOUT_S", "30"))
+
+# Per-request sampling profiler, switched on with an "X-CDSS-Profile: 1" request header
+PROFILING_ENABLED = os.environ.get("CDSS_PROFILING", "0") == "1"
+PROFILE_DIR = os.environ.get("CDSS_PROFILE_DIR", os.path.join(DATA_DIR, "profiles"))
+PROFILE_INTERVAL_MS = float(os.environ.get("CDSS_PROFILE_INTERVAL_MS", "5"))
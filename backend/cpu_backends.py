@@ -0,0 +1,153 @@
+import os
+import shutil
+import tempfile
+import zlib
+from typing import List, Tuple
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from config import MODEL_EXPORT_DIR
+from lexical_index import tokenize
+
+# Embedding model name of the offline stand-in, see HashingEmbedder
+HASH_EMBEDDING_MODEL = "hash"
+
+# "float32": the original PyTorch weights
+# "int8": PyTorch with nn.Linear weights dynamically quantised to int8
+# "onnx": an ONNX Runtime graph, exported once and cached under MODEL_EXPORT_DIR
+CPU_BACKENDS = ("float32", "int8", "onnx")
+
+
+def _check_backend(backend: str):
+    if backend not in CPU_BACKENDS:
+        raise ValueError(f"Unknown CPU backend '{backend}', expected one of {CPU_BACKENDS}")
+
+
+def quantize_linear_int8(model: torch.nn.Module) -> torch.nn.Module:
+    """Swap every nn.Linear for a dynamically quantised int8 version (weights
+    are quantised once, activations per call), in place"""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def export_path(model_name: str, backend: str, export_dir: str = MODEL_EXPORT_DIR) -> str:
+    return os.path.join(export_dir, f"{model_name.replace('/', '--')}-{backend}")
+
+
+def _export_once(path: str, export_fn):
+    """Run export_fn(tmp_dir) and move the result to path, unless path exists.
+
+    The export is written to a temporary directory next to path and renamed
+    into place, so a crashed export never leaves a half-written model that
+    later loads would pick up.
+    """
+    if os.path.isdir(path):
+        return
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".export-", dir=parent)
+    try:
+        export_fn(tmp_dir)
+        try:
+            os.rename(tmp_dir, path)
+        except OSError:
+            # Another worker finished the same export first
+            if not os.path.isdir(path):
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def embedding_model_id(model_name: str, backend: str) -> str:
+    """Identifier for cached embeddings; backends differ slightly in their outputs"""
+    return model_name if backend == "float32" else f"{model_name}@{backend}"
+
+
+class HashingEmbedder:
+    """Deterministic stand-in for the sentence embedder (``CDSS_EMBEDDING_MODEL=hash``).
+
+    Each token is hashed to a signed bucket and the counts are normalised,
+    so texts sharing words are similar. Needs no download and little CPU,
+    which makes offline benchmarks possible; it is not a semantic model.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, sentences: List[str], batch_size: int = 32, convert_to_numpy: bool = True,
+               convert_to_tensor: bool = False, **kwargs):
+        if isinstance(sentences, str):
+            return self.encode([sentences], batch_size, convert_to_numpy, convert_to_tensor)[0]
+        vectors = np.zeros((len(sentences), self.dim), dtype=np.float32)
+        for row, text in enumerate(sentences):
+            for token in tokenize(text):
+                h = zlib.crc32(token.encode("utf-8"))
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms > 0, norms, 1.0)
+        return torch.from_numpy(vectors) if convert_to_tensor else vectors
+
+
+def load_embedding_model(model_name: str, backend: str = "float32") -> SentenceTransformer:
+    """Load the sentence-transformers embedder with the given CPU backend"""
+    if model_name == HASH_EMBEDDING_MODEL:
+        return HashingEmbedder()
+    _check_backend(backend)
+    if backend == "float32":
+        return SentenceTransformer(model_name)
+
+    if backend == "int8":
+        model = SentenceTransformer(model_name, device="cpu")
+        quantize_linear_int8(model)
+        print(f"Embedding model {model_name} quantised to int8")
+        return model
+
+    # sentence-transformers exports through optimum when the model has no ONNX
+    # file yet; saving the result avoids repeating that on every start
+    path = export_path(model_name, backend)
+    _export_once(path, lambda tmp_dir: SentenceTransformer(model_name, backend="onnx").save(tmp_dir))
+    print(f"Embedding model {model_name} loaded as ONNX from {path}")
+    return SentenceTransformer(path, backend="onnx", device="cpu")
+
+
+def load_causal_lm(model_name: str, backend: str = "float32", trust_remote_code: bool = False) -> Tuple[object, object]:
+    """Load a causal LM and its tokenizer for CPU inference with the given backend.
+
+    The returned model works with ``transformers.pipeline("text-generation")``
+    and ``generate`` (including streamers) for every backend.
+    """
+    _check_backend(backend)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    if backend in ("float32", "int8"):
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            trust_remote_code=trust_remote_code,
+            torch_dtype=torch.float32,  # Use float32 for CPU
+            low_cpu_mem_usage=True,
+        )
+        if backend == "int8":
+            # Roughly a quarter of the float32 footprint for the linear layers
+            quantize_linear_int8(model)
+        model.eval()
+        return model, tokenizer
+
+    try:
+        from optimum.onnxruntime import ORTModelForCausalLM
+    except ImportError as e:
+        raise ImportError("The onnx backend needs optimum with onnxruntime: "
+                          "pip install 'optimum[onnxruntime]'") from e
+
+    def export(tmp_dir):
+        print(f"Exporting {model_name} to ONNX (one-off, this takes a while)...")
+        ORTModelForCausalLM.from_pretrained(model_name, export=True, use_cache=True).save_pretrained(tmp_dir)
+
+    path = export_path(model_name, backend)
+    _export_once(path, export)
+    model = ORTModelForCausalLM.from_pretrained(path, use_cache=True)
+    print(f"Language model {model_name} loaded as ONNX from {path}")
+    return model, tokenizer
@@ -0,0 +1,148 @@
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, List
+
+import numpy as np
+
+
+class EmbeddingService:
+    """Shared query encoder that micro-batches and deduplicates concurrent calls.
+
+    ``encode`` can be called from any number of threads. Each distinct
+    string is encoded at most once at a time: strings in the LRU cache are
+    returned straight away, strings already being encoded for another caller
+    wait on that encoding, and the rest are queued. A worker thread takes
+    whatever is queued (up to ``max_batch_size`` strings, waiting at most
+    ``max_wait_ms`` for more to arrive) and encodes it in one forward pass.
+    """
+
+    def __init__(self, encode_batch: Callable[[List[str]], np.ndarray], max_batch_size: int = 64,
+                 max_wait_ms: int = 2, cache_size: int = 4096):
+        self.encode_batch = encode_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._queue: "queue.Queue" = queue.Queue()
+        self._batch_sizes = Counter()
+        self._counters = {"texts": 0, "cache_hits": 0, "inflight_hits": 0, "encoded": 0, "failed_batches": 0}
+        self._encode_seconds = 0.0
+        self._worker = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+        self._worker.start()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Embeddings for texts as a float32 array, one row per text (in order)"""
+        found: Dict[str, np.ndarray] = {}
+        waiting: Dict[str, Future] = {}
+        with self._lock:
+            self._counters["texts"] += len(texts)
+            for text in dict.fromkeys(texts):
+                if text in self._cache:
+                    self._cache.move_to_end(text)
+                    found[text] = self._cache[text]
+                    self._counters["cache_hits"] += 1
+                elif text in self._inflight:
+                    waiting[text] = self._inflight[text]
+                    self._counters["inflight_hits"] += 1
+                else:
+                    future = Future()
+                    self._inflight[text] = future
+                    waiting[text] = future
+                    self._queue.put(text)
+        for text, future in waiting.items():
+            found[text] = future.result()
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([found[text] for text in texts])
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stop(self):
+        self._queue.put(None)
+        self._worker.join()
+
+    def reset_after_fork(self):
+        """Start a fresh worker in a forked child; threads do not survive fork().
+
+        The LRU cache is kept. Must be called before the child encodes anything.
+        """
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+        self._worker.start()
+
+    def stats(self):
+        with self._lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                **self._counters,
+                "cache_entries": len(self._cache),
+                "queue_depth": self._queue.qsize(),
+                "batches": batches,
+                "mean_batch_size": self._counters["encoded"] / batches if batches else 0.0,
+                "batch_size_counts": dict(sorted(self._batch_sizes.items())),
+                "encode_seconds": round(self._encode_seconds, 3),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "cache_size": self.cache_size,
+            }
+
+    def _collect_batch(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Past the deadline, still take anything that is already queued
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Stop after this batch; put the sentinel back for the loop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect_batch(first)
+
+            start = time.perf_counter()
+            try:
+                vectors = np.asarray(self.encode_batch(batch), dtype=np.float32)
+            except Exception as e:
+                with self._lock:
+                    futures = [self._inflight.pop(text) for text in batch]
+                    self._counters["failed_batches"] += 1
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                futures = []
+                for text, vector in zip(batch, vectors):
+                    # Shared between callers and the cache, so keep it read-only
+                    vector.flags.writeable = False
+                    if self.cache_size > 0:
+                        self._cache[text] = vector
+                    futures.append(self._inflight.pop(text))
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                self._batch_sizes[len(batch)] += 1
+                self._counters["encoded"] += len(batch)
+                self._encode_seconds += elapsed
+            for future, vector in zip(futures, vectors):
+                future.set_result(vector)
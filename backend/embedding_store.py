@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+from typing import Callable, List, Optional
+
+import numpy as np
+
+SUPPORTED_DTYPES = ("float32", "float16")
+
+
+def content_hash(model_name: str, text: str) -> str:
+    """Hash of a text together with the model that embeds it"""
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """Persistent, memory-mapped embedding store keyed by content hash.
+
+    Each distinct, ordered set of texts is written once to an immutable
+    ``.npy`` file whose name is derived from the hashes of its rows. Loading
+    memory-maps that file copy-on-write, so every worker process reading the
+    same store shares the same page-cache pages instead of holding a private
+    tensor. A small manifest points at the most recent file so that rows for
+    unchanged texts are reused and only new or edited texts are re-encoded.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, dim: int, dtype: str = "float32"):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype '{dtype}', expected one of {SUPPORTED_DTYPES}")
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.dim = dim
+        self.dtype = dtype
+        self.prefix = f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name)}-{dtype}"
+        self.manifest_path = os.path.join(cache_dir, f"{self.prefix}.manifest.json")
+
+    def load_or_encode(self, texts: List[str], encode_fn: Callable[[List[str]], np.ndarray],
+                       batch_size: Optional[int] = None) -> np.ndarray:
+        """Return an array of embeddings aligned with ``texts``.
+
+        ``encode_fn`` is only called for texts whose hash is not already in
+        the store, at most ``batch_size`` texts at a time; each batch is
+        written straight to the new file, so memory stays bounded however
+        many texts are new. The returned array is a copy-on-write memory map.
+        """
+        hashes = [content_hash(self.model_name, text) for text in texts]
+        data_path = self._data_path(hashes)
+
+        # Fast path: this exact set of texts has already been stored
+        if os.path.exists(data_path):
+            vectors = self._open(data_path)
+            if vectors is not None and vectors.shape == (len(texts), self.dim):
+                return vectors
+
+        previous_rows = {}
+        previous = self._load_manifest()
+        if previous is not None:
+            previous_vectors = self._open(os.path.join(self.cache_dir, previous["file"]))
+            if previous_vectors is not None and previous_vectors.shape == (len(previous["hashes"]), self.dim):
+                previous_rows = {h: previous_vectors[i] for i, h in enumerate(previous["hashes"])}
+
+        # Encode each new or edited text once, even if it appears several times
+        missing = {}
+        for text, h in zip(texts, hashes):
+            if h not in previous_rows and h not in missing:
+                missing[h] = text
+        if missing:
+            print(f"Encoding {len(missing)} new or changed knowledge entries "
+                  f"({len(texts) - len(missing)} reused from {self.cache_dir})")
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._write(data_path, hashes, previous_rows, missing, encode_fn, batch_size or max(1, len(missing)))
+        self._write_manifest(os.path.basename(data_path), hashes)
+        self._prune(keep=os.path.basename(data_path))
+
+        return self._open(data_path)
+
+    def _data_path(self, hashes: List[str]) -> str:
+        digest = hashlib.sha256("\n".join(hashes).encode("ascii")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{self.prefix}-{digest}.npy")
+
+    def _open(self, path: str) -> Optional[np.ndarray]:
+        try:
+            # Copy-on-write keeps the pages shared between processes while
+            # still giving torch a writable buffer to wrap
+            return np.load(path, mmap_mode="c")
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable embedding file {path}: {e}")
+            return None
+
+    def _write(self, data_path, hashes, previous_rows, missing, encode_fn, batch_size):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".npy.tmp")
+        os.close(fd)
+        try:
+            out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=self.dtype, shape=(len(hashes), self.dim))
+            rows_by_hash = {}
+            for i, h in enumerate(hashes):
+                if h in previous_rows:
+                    out[i] = previous_rows[h]
+                else:
+                    rows_by_hash.setdefault(h, []).append(i)
+            pending = list(missing.items())
+            for start in range(0, len(pending), batch_size):
+                batch = pending[start:start + batch_size]
+                vectors = np.asarray(encode_fn([text for _, text in batch]), dtype=np.float32)
+                for (h, _), vector in zip(batch, vectors):
+                    out[rows_by_hash[h]] = vector
+            out.flush()
+            del out
+            # Files are immutable and named by content, so concurrent writers
+            # racing on the same name produce identical files
+            os.replace(tmp_path, data_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return None
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if manifest.get("model") != self.model_name or manifest.get("dim") != self.dim:
+            return None
+        return manifest
+
+    def _write_manifest(self, file_name: str, hashes: List[str]):
+        manifest = {
+            "model": self.model_name,
+            "dtype": self.dtype,
+            "dim": self.dim,
+            "file": file_name,
+            "hashes": hashes,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".json.tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _prune(self, keep: str):
+        """Remove superseded embedding files (best effort)"""
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(f"{self.prefix}-") and name.endswith(".npy") and name != keep:
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    # Still mapped by another process on platforms that forbid this
+                    pass
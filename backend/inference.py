@@ -0,0 +1,340 @@
+import asyncio
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from multiprocessing import Pipe
+from multiprocessing.connection import Connection, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class BatchInferenceScheduler:
+    """Runs blocking LLM generation on a worker thread with dynamic batching.
+
+    Requests are queued from any thread or event loop. The worker takes the
+    first waiting request, then keeps collecting until either
+    ``max_batch_size`` prompts are gathered or ``max_wait_ms`` has passed,
+    and runs them through ``generate_batch`` as one batch. Each caller gets
+    back exactly the output for its own prompt.
+    """
+
+    def __init__(self, generate_batch: Callable[[List[str]], List[Any]],
+                 max_batch_size: int = 8, max_wait_ms: int = 20):
+        self.generate_batch = generate_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._requests = 0
+        self._failed_batches = 0
+        self._generation_seconds = 0.0
+        self._max_queue_depth = 0
+        self._worker = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+        self._worker.start()
+
+    def submit_nowait(self, prompt: str) -> Future:
+        """Queue a prompt and return a concurrent Future for its output"""
+        future = Future()
+        self._queue.put((prompt, future))
+        with self._stats_lock:
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return future
+
+    async def submit(self, prompt: str) -> Any:
+        """Queue a prompt and wait for its output without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit_nowait(prompt))
+
+    def stop(self):
+        self._queue.put(None)
+        self._worker.join()
+
+    def stats(self):
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "requests": self._requests,
+                "batches": batches,
+                "failed_batches": self._failed_batches,
+                "mean_batch_size": self._requests / batches if batches else 0.0,
+                "batch_size_counts": dict(sorted(self._batch_sizes.items())),
+                "generation_seconds": round(self._generation_seconds, 3),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+    def _collect_batch(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Stop after this batch; put the sentinel back for the loop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            # Drop requests whose callers have already given up
+            batch = [(prompt, future) for prompt, future in self._collect_batch(first)
+                     if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            try:
+                outputs = self.generate_batch([prompt for prompt, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                with self._stats_lock:
+                    self._failed_batches += 1
+                continue
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._stats_lock:
+                    self._batch_sizes[len(batch)] += 1
+                    self._requests += len(batch)
+                    self._generation_seconds += elapsed
+
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
+
+
+
+class StreamSlots:
+    """Caps the streamed generations running at once in this process.
+
+    Streaming runs ``model.generate`` in its own thread, outside the
+    batching scheduler, so each stream costs a full generation. Callers
+    wait for a slot in arrival order; ``release`` (from any thread) hands
+    it straight to the next waiter.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters: "deque[Future]" = deque()
+
+    async def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Wait up to ``timeout`` seconds for a slot; False if none came free"""
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                return True
+            waiter = Future()
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(waiter), timeout)
+            return True
+        except asyncio.TimeoutError:
+            with self._lock:
+                # The slot may have been handed over just as the wait timed out
+                return waiter.done() and not waiter.cancelled()
+        except asyncio.CancelledError:
+            with self._lock:
+                handed_over = waiter.done() and not waiter.cancelled()
+            # The caller will never release a slot handed over as it was cancelled
+            if handed_over:
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                # Skip waiters that timed out
+                if waiter.set_running_or_notify_cancel():
+                    waiter.set_result(None)
+                    return
+            self._active -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"active": self._active, "waiting": len(self._waiters), "limit": self.limit}
+
+
+class InferenceClient:
+    """BatchInferenceScheduler interface for a process without its own LLM worker.
+
+    Prompts are sent to dedicated inference processes over ``connections``
+    (one pipe per inference process, used by this process alone), each to
+    the one with the fewest outstanding prompts. Cancelling a future only
+    discards its output, since the prompt may already be in a batch.
+
+    Every inference process announces when it started. A prompt still
+    pending on that pipe from before then was sent to a process that has
+    since died, so it is failed; so are the prompts pending on a connection
+    that is closed. ``submit`` also gives up after ``timeout_s`` in case a
+    reply is lost some other way.
+    """
+
+    def __init__(self, connections: List[Connection], timeout_s: Optional[float] = None):
+        self.connections = list(connections)
+        self.timeout = timeout_s
+        self._pid = os.getpid()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._send_locks = [threading.Lock() for _ in self.connections]
+        # Per inference process: request id -> (time sent, future)
+        self._pending: List[Dict[int, Tuple[float, Future]]] = [{} for _ in self.connections]
+        self._connected = [True] * len(self.connections)
+        self._requests = 0
+        self._failed = 0
+        self._timeouts = 0
+        self._wakeup_reader, self._wakeup_writer = Pipe(duplex=False)
+        self._reader = threading.Thread(target=self._read, name="inference-client", daemon=True)
+        self._reader.start()
+
+    def submit_nowait(self, prompt: str) -> Future:
+        future = Future()
+        with self._lock:
+            targets = [i for i, connected in enumerate(self._connected) if connected]
+            if not targets:
+                raise RuntimeError("No inference process is reachable")
+            target = min(targets, key=lambda i: len(self._pending[i]))
+            request_id = next(self._ids)
+            self._pending[target][request_id] = (time.time(), future)
+            self._requests += 1
+        # Forget the request once it is answered, failed or cancelled (e.g. by a timeout)
+        future.add_done_callback(lambda f: self._forget(target, request_id))
+        try:
+            with self._send_locks[target]:
+                self.connections[target].send(((self._pid, request_id), prompt))
+        except (OSError, ValueError) as e:
+            future.set_exception(RuntimeError(f"Sending to the inference process failed: {e}"))
+        return future
+
+    async def submit(self, prompt: str) -> Any:
+        future = asyncio.wrap_future(self.submit_nowait(prompt))
+        if self.timeout is None:
+            return await future
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._timeouts += 1
+            raise TimeoutError(f"No reply from the inference process within {self.timeout:g}s") from None
+
+    def stop(self):
+        self._wakeup_writer.send(None)
+        self._reader.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "remote": True,
+                "inference_processes": len(self.connections),
+                "outstanding": [len(pending) for pending in self._pending],
+                "requests": self._requests,
+                "failed_requests": self._failed,
+                "timeouts": self._timeouts,
+            }
+
+    def _forget(self, target: int, request_id: int):
+        with self._lock:
+            self._pending[target].pop(request_id, None)
+
+    def _fail_pending(self, target: int, reason: str, sent_before: float = float("inf")):
+        with self._lock:
+            pending = self._pending[target]
+            failed = [request_id for request_id, (sent_at, _) in pending.items() if sent_at < sent_before]
+            futures = [pending.pop(request_id)[1] for request_id in failed]
+            self._failed += len(futures)
+        for future in futures:
+            if not future.done():
+                future.set_exception(RuntimeError(reason))
+
+    def _read(self):
+        readable = self.connections + [self._wakeup_reader]
+        while True:
+            for connection in wait(readable):
+                if connection is self._wakeup_reader:
+                    return
+                target = self.connections.index(connection)
+                try:
+                    key, ok, payload = connection.recv()
+                except (EOFError, OSError) as e:
+                    print(f"Lost connection to an inference process: {e}")
+                    readable.remove(connection)
+                    with self._lock:
+                        self._connected[target] = False
+                    self._fail_pending(target, f"Lost connection to the inference process: {e}")
+                    continue
+                if key is None:
+                    # An inference process (re)started on this pipe; payload is its start time
+                    self._fail_pending(target, "The inference process restarted before replying", payload)
+                    continue
+                pid, request_id = key
+                if pid != self._pid:
+                    # Left over from a previous worker on this pipe
+                    continue
+                with self._lock:
+                    _, future = self._pending[target].pop(request_id, (None, None))
+                    if future is None:
+                        continue
+                    self._failed += not ok
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(payload)
+                else:
+                    future.set_exception(RuntimeError(payload))
+
+
+def serve_inference_requests(generate_batch: Callable[[List[str]], List[Any]], connections: List[Connection],
+                             max_batch_size: int = 8, max_wait_ms: int = 20, started_at: Optional[float] = None):
+    """Main loop of a dedicated inference process (one connection per HTTP worker).
+
+    Prompts from all workers are batched on a local BatchInferenceScheduler.
+    At most two batches are read ahead, so the workers send the rest of
+    their prompts to less busy inference processes. ``started_at`` is the
+    (wall clock) time the process was forked: prompts sent before then were
+    meant for a previous process on these pipes.
+    """
+    scheduler = BatchInferenceScheduler(generate_batch, max_batch_size, max_wait_ms)
+    slots = threading.BoundedSemaphore(2 * scheduler.max_batch_size)
+    send_lock = threading.Lock()
+    readable = list(connections)
+    # Lets the workers fail whatever a previous process on these pipes left unanswered
+    started_at = time.time() if started_at is None else started_at
+    for connection in connections:
+        connection.send((None, True, started_at))
+
+    def reply(connection, request_id, future):
+        try:
+            message = (request_id, True, future.result())
+        except Exception as e:
+            message = (request_id, False, f"{type(e).__name__}: {e}")
+        with send_lock:
+            connection.send(message)
+        slots.release()
+
+    while readable:
+        for connection in wait(readable):
+            try:
+                request_id, prompt = connection.recv()
+            except (EOFError, OSError):
+                readable.remove(connection)
+                continue
+            slots.acquire()
+            future = scheduler.submit_nowait(prompt)
+            future.add_done_callback(lambda f, c=connection, r=request_id: reply(c, r, f))
+    scheduler.stop()
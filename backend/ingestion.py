@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from config import KNOWLEDGE_FILE, KNOWLEDGE_DOCS_DIR, CHUNK_WORDS, CHUNK_OVERLAP_WORDS
+from lexical_index import BM25Index
+from vector_index import VectorIndex
+
+# Guideline documents are read as plain text; markdown headings are kept as text
+DOCUMENT_EXTENSIONS = (".txt", ".md")
+
+
+class KnowledgeSnapshot(NamedTuple):
+    """Knowledge chunks and the dense and lexical indexes over them, swapped as one unit.
+
+    ``items`` and ``texts`` are indexed by index id (shared by both indexes). Ids of chunks
+    removed by an incremental update hold None until the next full rebuild;
+    ``ids`` maps the content hash of every live chunk to its id.
+    """
+    items: List[Optional[Dict[str, Any]]]
+    texts: List[Optional[str]]
+    index: VectorIndex
+    ids: Dict[str, int]
+    lexical: BM25Index
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def iter_paragraphs(lines: Iterable[str]) -> Iterator[str]:
+    """Join consecutive non-blank lines into paragraphs"""
+    paragraph = []
+    for line in lines:
+        line = line.strip()
+        if line:
+            paragraph.append(line)
+        elif paragraph:
+            yield " ".join(paragraph)
+            paragraph = []
+    if paragraph:
+        yield " ".join(paragraph)
+
+
+def chunk_paragraphs(paragraphs: Iterable[str], chunk_words: int = CHUNK_WORDS,
+                     overlap_words: int = CHUNK_OVERLAP_WORDS) -> Iterator[str]:
+    """Pack paragraphs into chunks of at most ``chunk_words`` words.
+
+    Chunks break at paragraph boundaries where possible, and each chunk
+    starts with the last ``overlap_words`` words of the previous one so that
+    a sentence split across chunks is still retrievable. Paragraphs longer
+    than a chunk are split into windows. Only one chunk is held in memory.
+    """
+    if not 0 <= overlap_words < chunk_words:
+        raise ValueError(f"Chunk overlap ({overlap_words}) must be smaller than the chunk size ({chunk_words})")
+    window: List[str] = []
+    fresh = 0  # words in the window that were not carried over as overlap
+    for paragraph in paragraphs:
+        words = paragraph.split()
+        while words:
+            room = chunk_words - len(window)
+            if len(words) <= room:
+                window.extend(words)
+                fresh += len(words)
+                break
+            if fresh:
+                yield " ".join(window)
+                window = window[len(window) - overlap_words:] if overlap_words else []
+                fresh = 0
+                continue
+            window.extend(words[:room])
+            fresh += room
+            words = words[room:]
+    if fresh:
+        yield " ".join(window)
+
+
+def iter_document_chunks(path: str, chunk_words: int = CHUNK_WORDS,
+                         overlap_words: int = CHUNK_OVERLAP_WORDS) -> Iterator[Dict[str, Any]]:
+    """Stream a guideline document as ``{text, source}`` chunks.
+
+    The source is the document's first markdown heading, or its file name.
+    """
+    source = os.path.splitext(os.path.basename(path))[0]
+    with open(path, "r", encoding="utf-8") as f:
+        first = f.readline()
+        if first.startswith("# "):
+            source = first[2:].strip()
+            lines = f
+        else:
+            lines = _prepend(first, f)
+        for text in chunk_paragraphs(iter_paragraphs(lines), chunk_words, overlap_words):
+            yield {"text": text, "source": source}
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+def iter_knowledge_chunks(knowledge_file: str = KNOWLEDGE_FILE, docs_dir: str = KNOWLEDGE_DOCS_DIR,
+                          chunk_words: int = CHUNK_WORDS,
+                          overlap_words: int = CHUNK_OVERLAP_WORDS) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield ``(hash, item)`` for every distinct chunk of the knowledge base.
+
+    Sources are the curated items in ``knowledge_file`` (short items stay
+    one chunk each) followed by every document under ``docs_dir`` in path
+    order. A chunk whose text was already seen is skipped.
+    """
+    seen = set()
+
+    def distinct(items):
+        for item in items:
+            h = chunk_hash(item["text"])
+            if h not in seen:
+                seen.add(h)
+                yield h, item
+
+    if os.path.exists(knowledge_file):
+        with open(knowledge_file, "r") as f:
+            for entry in json.load(f):
+                yield from distinct(
+                    {**entry, "text": text}
+                    for text in chunk_paragraphs([entry["text"]], chunk_words, overlap_words)
+                )
+
+    if docs_dir and os.path.isdir(docs_dir):
+        paths = []
+        for root, _, files in os.walk(docs_dir):
+            paths.extend(os.path.join(root, name) for name in files if name.endswith(DOCUMENT_EXTENSIONS))
+        for path in sorted(paths):
+            yield from distinct(iter_document_chunks(path, chunk_words, overlap_words))
+
+
+def build_snapshot(chunks: List[Tuple[str, Dict[str, Any]]], vectors: np.ndarray,
+                   build_index: Callable[[np.ndarray], VectorIndex]) -> KnowledgeSnapshot:
+    """Full build: ids are positions in ``chunks``"""
+    items = [item for _, item in chunks]
+    texts = [item["text"] for item in items]
+    lexical = BM25Index()
+    for i, text in enumerate(texts):
+        lexical.add(i, text)
+    return KnowledgeSnapshot(
+        items,
+        texts,
+        build_index(vectors),
+        {h: i for i, (h, _) in enumerate(chunks)},
+        lexical,
+    )
+
+
+def update_snapshot(snapshot: KnowledgeSnapshot, chunks: List[Tuple[str, Dict[str, Any]]], vectors: np.ndarray,
+                    build_index: Callable[[np.ndarray], VectorIndex], batch_size: int = 256,
+                    max_tombstone_ratio: float = 0.25) -> Tuple[KnowledgeSnapshot, Dict[str, Any]]:
+    """Apply the difference between ``snapshot`` and ``chunks`` to copies of its indexes.
+
+    ``vectors`` is aligned with ``chunks``. Only removed chunks are deleted
+    from the indexes and only added chunks are inserted; the snapshot passed
+    in is left untouched, so queries running against it are unaffected.
+    Falls back to a full rebuild once removed ids would make up more than
+    ``max_tombstone_ratio`` of the id space, or when the vector index says
+    its training no longer fits the new size (e.g. IVF-PQ lists trained on
+    a much smaller corpus).
+    """
+    positions = {h: i for i, (h, _) in enumerate(chunks)}
+    removed = {h: i for h, i in snapshot.ids.items() if h not in positions}
+    added = [i for h, i in positions.items() if h not in snapshot.ids]
+    stats = {"entries": len(chunks), "added": len(added), "removed": len(removed), "rebuilt": False}
+
+    # Sources can change without the text changing; pick those up as well
+    if not removed and not added and all(snapshot.items[snapshot.ids[h]] == item for h, item in chunks):
+        return snapshot, stats
+
+    tombstones = len(snapshot.items) - len(snapshot.ids) + len(removed)
+    if (tombstones > max_tombstone_ratio * (len(snapshot.items) + len(added))
+            or snapshot.index.needs_retraining(len(snapshot.ids) - len(removed) + len(added))):
+        stats["rebuilt"] = True
+        return build_snapshot(chunks, vectors, build_index), stats
+
+    index = snapshot.index.copy()
+    index.remove(list(removed.values()))
+    lexical = snapshot.lexical.copy()
+    items, texts, ids = list(snapshot.items), list(snapshot.texts), dict(snapshot.ids)
+    for h, vector_id in removed.items():
+        lexical.remove(vector_id, texts[vector_id])
+        items[vector_id] = texts[vector_id] = None
+        del ids[h]
+    for h, vector_id in ids.items():
+        items[vector_id] = chunks[positions[h]][1]
+
+    # Insert in batches so only one batch of vectors is copied out of the store at a time
+    for start in range(0, len(added), batch_size):
+        batch = added[start:start + batch_size]
+        new_ids = np.arange(len(items), len(items) + len(batch))
+        index.add(new_ids, np.asarray(vectors[batch], dtype=np.float32))
+        for vector_id, position in zip(new_ids.tolist(), batch):
+            h, item = chunks[position]
+            items.append(item)
+            texts.append(item["text"])
+            ids[h] = vector_id
+            lexical.add(vector_id, item["text"])
+    return KnowledgeSnapshot(items, texts, index, ids, lexical), stats
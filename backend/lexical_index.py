@@ -0,0 +1,176 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Function words that carry no retrieval signal. Clinical words such as
+# "dose" or "pain" are deliberately not listed.
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between both
+but by can could did do does doing down during each few for from further had has have having he her here hers
+him his how i if in into is it its itself just me more most my no nor not now of off on once only or other our
+out over own same she should so some such than that the their them then there these they this those through to
+too under until up very was we were what when where which while who whom why will with would you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase alphanumeric tokens, in order"""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def content_tokens(text: str) -> Set[str]:
+    """Distinct tokens of a text without stopwords, for term matching"""
+    return {token for token in tokenize(text) if token not in STOPWORDS}
+
+
+class TermDictionary:
+    """Exact, token-level lookup of names such as conditions or drugs.
+
+    A name matches a text when its tokens appear contiguously in the text's
+    tokens, so "Type 2 Diabetes" matches "type 2 diabetes management" but
+    not "diabetes type". Lookups are dictionary probes on the first token,
+    not substring scans.
+    """
+
+    def __init__(self, names: Iterable[str] = ()):
+        self._by_first: Dict[str, List[Tuple[Tuple[str, ...], str]]] = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name: str):
+        tokens = tuple(tokenize(name))
+        if tokens:
+            self._by_first.setdefault(tokens[0], []).append((tokens, name))
+
+    def find(self, tokens: Sequence[str]) -> List[str]:
+        """Names occurring in ``tokens``, in order of first occurrence"""
+        found = {}
+        for i, token in enumerate(tokens):
+            for name_tokens, name in self._by_first.get(token, ()):
+                if name not in found and tuple(tokens[i:i + len(name_tokens)]) == name_tokens:
+                    found[name] = None
+        return list(found)
+
+
+class BM25Index:
+    """Okapi BM25 inverted index over integer document ids.
+
+    Postings are kept per term as ``{doc_id: term_frequency}`` so documents
+    can be added and removed incrementally. ``copy`` is copy-on-write per
+    term: a clone shares every posting list until one side modifies it.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._owned: Set[str] = set()
+        self._doc_lengths: Dict[int, int] = {}
+        self._total_length = 0
+        # Per-term (ids, tfs) arrays and the length table, rebuilt after modifications
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._length_table: Optional[np.ndarray] = None
+
+    def __len__(self):
+        return len(self._doc_lengths)
+
+    def add(self, doc_id: int, text: str):
+        doc_id = int(doc_id)
+        if doc_id in self._doc_lengths:
+            raise ValueError(f"Document {doc_id} already present in the lexical index")
+        tokens = [token for token in tokenize(text) if token not in STOPWORDS]
+        for term, tf in Counter(tokens).items():
+            self._writable_postings(term)[doc_id] = tf
+        self._doc_lengths[doc_id] = len(tokens)
+        self._total_length += len(tokens)
+        self._length_table = None
+
+    def remove(self, doc_id: int, text: str):
+        """Remove a document; ``text`` must be the text it was added with"""
+        doc_id = int(doc_id)
+        length = self._doc_lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self._total_length -= length
+        for term in set(tokenize(text)) - STOPWORDS:
+            postings = self._writable_postings(term)
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+        self._length_table = None
+
+    def copy(self) -> "BM25Index":
+        clone = BM25Index(self.k1, self.b)
+        clone._postings = dict(self._postings)
+        clone._doc_lengths = dict(self._doc_lengths)
+        clone._total_length = self._total_length
+        # Neither side may modify a shared posting list in place any more
+        self._owned = set()
+        return clone
+
+    def search(self, query: str, k: int, weights: Optional[Dict[str, float]] = None) -> List[Tuple[int, float]]:
+        """Top-k ``(doc_id, score)`` pairs, best first; only documents sharing a term score.
+
+        ``weights`` scales the contribution of individual query terms
+        (e.g. to boost recognised drug or condition names).
+        """
+        n_docs = len(self._doc_lengths)
+        terms = Counter(token for token in tokenize(query) if token not in STOPWORDS and token in self._postings)
+        if n_docs == 0 or not terms or k <= 0:
+            return []
+        lengths = self._lengths()
+        average_length = self._total_length / n_docs or 1.0
+
+        all_ids, all_scores = [], []
+        for term, query_tf in terms.items():
+            ids, tfs = self._term_arrays(term)
+            idf = math.log(1 + (n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[ids] / average_length)
+            weight = idf * query_tf * (weights.get(term, 1.0) if weights else 1.0)
+            all_ids.append(ids)
+            all_scores.append(weight * tfs * (self.k1 + 1) / (tfs + norm))
+        doc_ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        top = np.argsort(-scores, kind="stable")[:k]
+        return [(int(doc_ids[i]), float(scores[i])) for i in top]
+
+    def _writable_postings(self, term: str) -> Dict[int, int]:
+        postings = self._postings.get(term)
+        if postings is None:
+            postings = self._postings[term] = {}
+        elif term not in self._owned:
+            postings = self._postings[term] = dict(postings)
+        self._owned.add(term)
+        self._arrays.pop(term, None)
+        return postings
+
+    def _term_arrays(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            postings = self._postings[term]
+            arrays = (np.fromiter(postings.keys(), dtype=np.int64, count=len(postings)),
+                      np.fromiter(postings.values(), dtype=np.float64, count=len(postings)))
+            self._arrays[term] = arrays
+        return arrays
+
+    def _lengths(self) -> np.ndarray:
+        if self._length_table is None:
+            table = np.zeros(max(self._doc_lengths, default=-1) + 1, dtype=np.float64)
+            for doc_id, length in self._doc_lengths.items():
+                table[doc_id] = length
+            self._length_table = table
+        return self._length_table
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """Fuse ranked id lists: score(id) = sum over lists of 1 / (k + rank)"""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
@@ -1,15 +1,45 @@
-from fastapi import FastAPI, HTTPException, Query as FastAPIQuery
+from fastapi import FastAPI, HTTPException, Query as FastAPIQuery, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
 from typing import List, Optional
+import asyncio
 import json
 import os
+import signal
+import time
 import uvicorn
-import datetime
 from rag import RAGSystem
+from patient_store import AsyncPatientRepository, create_patient_repository
+from patient_index import PATIENT_FIELDS, PatientIndex, project
+from chat_store import ChatHistoryStore
+from model_loader import BackgroundModelLoader, ModelsNotReady
+from cohort import CohortRegistry, run_cohort
+from metrics import HTTP_REQUEST_SECONDS, REGISTRY, Gauge, server_timing, span, start_trace
+from profiling import SamplingProfiler
+from config import (
+    MODEL_LOADING, MODEL_READY_TIMEOUT_S, COHORT_MAX_PATIENTS, COHORT_MAX_IN_FLIGHT, STREAM_QUEUE_TIMEOUT_S,
+    PROFILING_ENABLED, PROFILE_DIR, PROFILE_INTERVAL_MS,
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if MODEL_LOADING == "eager":
+        # Do not accept connections until the models are loaded
+        await run_in_threadpool(model_loader.wait)
+    elif MODEL_LOADING == "background":
+        model_loader.start()
+    # "lazy" starts loading on the first request that needs the models
+    yield
+    # Commit any buffered chat history before the process exits
+    chat_history.close()
+    cohort_jobs.close()
+    patient_repository.close()
 
 # Initialize FastAPI app
-app = FastAPI(title="Clinical Decision Support System API")
+app = FastAPI(title="Clinical Decision Support System API", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -20,6 +50,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # Time each request by route template and report its stages in a Server-Timing header
+    trace = start_trace()
+    profiler = None
+    if PROFILING_ENABLED and request.headers.get("X-CDSS-Profile") == "1":
+        profiler = SamplingProfiler(PROFILE_INTERVAL_MS).start()
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Streamed responses are timed until their first byte
+    elapsed = time.perf_counter() - start
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(
+        elapsed, route=route.path if route is not None else "unmatched",
+        method=request.method, status=response.status_code,
+    )
+    response.headers["Server-Timing"] = ", ".join(filter(None, [server_timing(trace), f"total;dur={elapsed * 1000:.2f}"]))
+    if profiler is not None:
+        label = f"{request.method} {request.url.path}"
+        response.headers["X-CDSS-Profile"] = profiler.output_path(PROFILE_DIR, label)
+        response.body_iterator = _profile_body(response.body_iterator, profiler, label)
+    return response
+
+async def _profile_body(body_iterator, profiler: SamplingProfiler, label: str):
+    # The profile covers the whole response, streamed bodies included
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        profiler.stop()
+        profiler.save(PROFILE_DIR, label)
+
 # Define data models
 class Patient(BaseModel):
     id: Optional[int] = None
@@ -34,155 +96,178 @@ class QueryModel(BaseModel):
     patientId: int
     query: str
 
-# Initialize RAG system
-rag_system = RAGSystem()
+class CohortQueryModel(BaseModel):
+    query: str
+    # Explicit patient IDs and/or filters (both: the IDs that match); neither means every patient
+    patientIds: Optional[List[int]] = None
+    name: Optional[str] = None
+    condition: Optional[str] = None
+    medication: Optional[str] = None
 
-# Data paths
-PATIENTS_FILE = "../data/patients.json"
-KNOWLEDGE_FILE = "../data/knowledge.json"
-CHAT_HISTORY_FILE = "../data/chat_history.json"
+# The RAG system (embedding model, knowledge index and LLM) loads in the
+# background so patient routes can serve while the models are loading
+model_loader = BackgroundModelLoader(RAGSystem)
+# Set by serve.py in its workers: knowledge reloads then go through the master,
+# which re-ingests once and replaces every worker (and its response cache)
+supervisor_pid: Optional[int] = None
 
-# Helper functions
-def load_patients():
-    if not os.path.exists(PATIENTS_FILE):
-        return []
-    with open(PATIENTS_FILE, "r") as f:
-        return json.load(f)
-
-def save_patients(patients):
-    with open(PATIENTS_FILE, "w") as f:
-        json.dump(patients, f, indent=2)
-
-def load_chat_history():
-    """Load chat history from JSON file"""
-    if not os.path.exists(CHAT_HISTORY_FILE):
-        # Create an empty chat history file if it doesn't exist
-        with open(CHAT_HISTORY_FILE, "w") as f:
-            json.dump({}, f, indent=2)
-        return {}
-    
-    with open(CHAT_HISTORY_FILE, "r") as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            # If the file is empty or invalid, return an empty dict
-            return {}
-
-def save_chat_history(chat_history):
-    """Save chat history to JSON file"""
-    with open(CHAT_HISTORY_FILE, "w") as f:
-        json.dump(chat_history, f, indent=2)
+# Patient store (SQLite by default, migrated from patients.json on first start)
+patient_repository = create_patient_repository()
+# What the async handlers use, so store I/O never blocks the event loop
+patients = AsyncPatientRepository(patient_repository)
+
+# Name trigram, condition, medication and age index for patient search (built on first search)
+patient_index = PatientIndex(patient_repository)
+
+# Append-only chat history log (migrated from chat_history.json on first start)
+chat_history = ChatHistoryStore()
 
+# Cohort query jobs, for progress and cancellation from any serve.py worker
+cohort_jobs = CohortRegistry()
+
+def _scheduler_queue_depth():
+    rag_system = model_loader.get_nowait()
+    if rag_system is None or rag_system.inference_scheduler is None:
+        return None
+    stats = rag_system.inference_scheduler.stats()
+    # Prompts sent to the inference processes and not yet answered, under serve.py
+    return stats["queue_depth"] if "queue_depth" in stats else sum(stats["outstanding"])
+
+def _active_streams():
+    rag_system = model_loader.get_nowait()
+    return rag_system.stream_slots.stats()["active"] if rag_system is not None else None
+
+def _embedding_cache_entries():
+    rag_system = model_loader.get_nowait()
+    return rag_system.embedding_service.stats()["cache_entries"] if rag_system is not None else None
+
+def _response_cache_entries():
+    rag_system = model_loader.get_nowait()
+    if rag_system is None or rag_system.response_cache is None:
+        return None
+    return rag_system.response_cache.stats()["entries"]
+
+# Gauges read from the loaded models at scrape time
+Gauge("cdss_inference_queue_depth", "Prompts waiting for the LLM scheduler", _scheduler_queue_depth)
+Gauge("cdss_llm_streams_active", "Streamed generations running in this process", _active_streams)
+Gauge("cdss_embedding_cache_entries", "Query embeddings in the LRU cache", _embedding_cache_entries)
+Gauge("cdss_response_cache_entries", "Responses in the semantic response cache", _response_cache_entries)
+
+# Helper functions
 def add_to_chat_history(patient_id, query, response):
     """Add a new entry to the chat history for a specific patient"""
-    chat_history = load_chat_history()
-    
-    # Convert patient_id to string for JSON key
-    patient_id_str = str(patient_id)
-    
-    # Create entry for patient if it doesn't exist
-    if patient_id_str not in chat_history:
-        chat_history[patient_id_str] = []
-    
-    # Create a new chat entry
-    timestamp = datetime.datetime.now().isoformat()
-    chat_entry = {
-        "timestamp": timestamp,
-        "query": query,
-        "response": response
-    }
-    
-    # Add to patient's history
-    chat_history[patient_id_str].append(chat_entry)
-    
-    # Save updated history
-    save_chat_history(chat_history)
+    with span("chat_history"):
+        chat_history.append(patient_id, query, response)
+
+async def get_rag_system() -> RAGSystem:
+    """The loaded RAG system; waits up to MODEL_READY_TIMEOUT_S, then answers 503"""
+    try:
+        return await model_loader.wait_ready(MODEL_READY_TIMEOUT_S)
+    except ModelsNotReady as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
+
+async def refresh_patient_profile(patient):
+    """Rebuild a written patient's retrieval profile (if the models are loaded yet)"""
+    rag_system = model_loader.get_nowait()
+    if rag_system is not None:
+        await run_in_threadpool(rag_system.refresh_patient, patient)
 
 # Routes
 @app.get("/")
 async def root():
     return {"message": "Clinical Decision Support System API"}
 
+@app.get("/healthz")
+async def healthz():
+    # Liveness: the process is up and serving requests
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    # Readiness: the models are loaded and queries can be answered
+    status = model_loader.status()
+    return JSONResponse(status, status_code=200 if status["status"] == "ready" else 503)
+
 @app.get("/api/patients")
-async def get_patients(name: Optional[str] = FastAPIQuery(None)):
-    patients = load_patients()
+async def get_patients(
+    name: Optional[str] = FastAPIQuery(None),
+    condition: Optional[str] = FastAPIQuery(None),
+    medication: Optional[str] = FastAPIQuery(None),
+    min_age: Optional[int] = FastAPIQuery(None, alias="minAge", ge=0),
+    max_age: Optional[int] = FastAPIQuery(None, alias="maxAge", ge=0),
+    fields: Optional[str] = FastAPIQuery(None),
+    cursor: Optional[int] = FastAPIQuery(None),
+    limit: Optional[int] = FastAPIQuery(None, ge=1, le=1000),
+):
+    # Comma-separated subset of the patient fields to return
+    selected = fields.split(",") if fields else None
+    if selected and not set(selected) <= set(PATIENT_FIELDS):
+        raise HTTPException(
+            status_code=400, detail=f"Unknown fields; choose from {', '.join(PATIENT_FIELDS)}",
+        )
     
-    if name:
-        filtered_patients = [p for p in patients if name.lower() in p["name"].lower()]
-        if not filtered_patients:
-            raise HTTPException(status_code=404, detail="No patients found with that name")
-        return filtered_patients
+    paginated = limit is not None or cursor is not None
+    if not (name or condition or medication or min_age is not None or max_age is not None or paginated):
+        # The whole registry, as before
+        return [project(patient, selected) for patient in await patients.list()]
     
-    return patients
+    # The first search builds the index, and later ones may catch up with other workers' writes
+    ids, next_cursor = await run_in_threadpool(
+        patient_index.search, name=name, condition=condition, medication=medication,
+        min_age=min_age, max_age=max_age, cursor=cursor, limit=limit,
+    )
+    matches = [project(patient, selected) for patient in await patients.get_many(ids)]
+    if paginated:
+        return {"patients": matches, "nextCursor": next_cursor}
+    if name and not matches:
+        raise HTTPException(status_code=404, detail="No patients found with that name")
+    return matches
 
 @app.get("/api/patients/{patient_id}")
 async def get_patient(patient_id: int):
-    patients = load_patients()
-    for patient in patients:
-        if patient["id"] == patient_id:
-            return patient
-    raise HTTPException(status_code=404, detail="Patient not found")
+    patient = await patients.get(patient_id)
+    if patient is None:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    return patient
 
 @app.post("/api/patients")
 async def create_patient(patient: Patient):
-    patients = load_patients()
-    
-    # Auto-increment ID
-    max_id = 0
-    for p in patients:
-        if p["id"] > max_id:
-            max_id = p["id"]
-    
-    new_patient = patient.dict()
-    new_patient["id"] = max_id + 1
-    
-    patients.append(new_patient)
-    save_patients(patients)
-    
-    return new_patient
+    # The repository assigns the next ID
+    new_patient = patient.dict(exclude={"id"})
+    created_patient = await patients.create(new_patient)
+    await run_in_threadpool(patient_index.upsert, created_patient)
+    await refresh_patient_profile(created_patient)
+    return created_patient
 
 @app.put("/api/patients/{patient_id}")
 async def update_patient(patient_id: int, patient_update: Patient):
-    patients = load_patients()
-    
-    # Find the patient to update
-    patient_index = None
-    for i, p in enumerate(patients):
-        if p["id"] == patient_id:
-            patient_index = i
-            break
-    
-    if patient_index is None:
-        raise HTTPException(status_code=404, detail="Patient not found")
-    
     # Update patient data while preserving the ID
     update_data = patient_update.dict(exclude_unset=True)
-    update_data["id"] = patient_id  # Ensure ID remains the same
+    update_data.pop("id", None)
     
-    # Update the patient in the list
-    patients[patient_index] = update_data
+    updated_patient = await patients.update(patient_id, update_data)
+    if updated_patient is None:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    await run_in_threadpool(patient_index.upsert, updated_patient)
     
-    # Save updated patients list
-    save_patients(patients)
+    # Cached responses and the patient's profile were built from the old record
+    await refresh_patient_profile(updated_patient)
     
-    print(f"Updated patient {patient_id}: {update_data['name']}")
+    print(f"Updated patient {patient_id}: {updated_patient['name']}")
     
-    return update_data
+    return updated_patient
 
 @app.post("/api/query")
 async def process_query(query_data: QueryModel):
     # Get patient data
-    patients = load_patients()
-    patient = None
-    
-    for p in patients:
-        if p["id"] == query_data.patientId:
-            patient = p
-            break
+    with span("load_patient"):
+        patient = await patients.get(query_data.patientId)
     
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
     
+    rag_system = await get_rag_system()
+    
     try:
         # Process query through RAG system
         print(f"Processing query: '{query_data.query}' for patient: {patient['name']} (ID: {patient['id']})")
@@ -191,11 +276,11 @@ async def process_query(query_data: QueryModel):
         print(f"Patient medical history: {', '.join(patient['medicalHistory'])}")
         print(f"Patient medications: {', '.join(patient['medications'])}")
         
-        # Generate response with patient-specific context
-        response = rag_system.generate_response(query_data.query, patient)
+        # Generate response with patient-specific context; generation is batched off the event loop
+        response = await rag_system.generate_response_async(query_data.query, patient)
         
         # Add to chat history
-        add_to_chat_history(patient['id'], query_data.query, response)
+        await run_in_threadpool(add_to_chat_history, patient['id'], query_data.query, response)
         
         # Log successful query processing
         print(f"Successfully processed query for patient {patient['id']}")
@@ -205,17 +290,194 @@ async def process_query(query_data: QueryModel):
         print(f"Error processing query: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
 
-# Add a new endpoint to get chat history for a specific patient
-@app.get("/api/patients/{patient_id}/history")
-async def get_patient_chat_history(patient_id: int):
-    # Load chat history
-    chat_history = load_chat_history()
+def stream_query_events(rag_system: RAGSystem, query: str, patient):
+    """NDJSON events for a streamed query: token chunks, then the full response"""
+    chunks = []
+    try:
+        for chunk in rag_system.stream_response(query, patient):
+            chunks.append(chunk)
+            yield json.dumps({"type": "token", "text": chunk}) + "\n"
+    except Exception as e:
+        print(f"Error streaming query: {e}")
+        yield json.dumps({"type": "error", "detail": f"Error processing query: {str(e)}"}) + "\n"
+        return
+    
+    # Persist the complete text once the stream has finished
+    response = "".join(chunks)
+    add_to_chat_history(patient['id'], query, response)
+    print(f"Successfully streamed query for patient {patient['id']}")
+    yield json.dumps({"type": "done", "response": response}) + "\n"
+
+def close_stream(events, slots):
+    """Stop a stream's generation (waiting briefly for its thread), then free its slot"""
+    try:
+        events.close()
+    finally:
+        slots.release()
+
+async def release_when_done(events, slots):
+    """Iterate a sync event generator in the threadpool, releasing its stream slot when it ends.
+
+    The first item is None: the caller takes it before responding, so the
+    generator has started and its cleanup runs even if the client is gone
+    before the body is read.
+    """
+    try:
+        yield None
+        async for event in iterate_in_threadpool(events):
+            yield event
+    finally:
+        # Stops the generation if the client disconnected mid-stream. Closing
+        # blocks until the generation thread stops, so it runs in a worker
+        # thread; shielded so it completes even when this task is cancelled
+        await asyncio.shield(run_in_threadpool(close_stream, events, slots))
+
+@app.post("/api/query/stream")
+async def process_query_stream(query_data: QueryModel):
+    with span("load_patient"):
+        patient = await patients.get(query_data.patientId)
+    
+    if not patient:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    
+    rag_system = await get_rag_system()
+    
+    # Every stream runs its own generation, so only a few may run at once
+    if not await rag_system.stream_slots.acquire(STREAM_QUEUE_TIMEOUT_S):
+        raise HTTPException(status_code=503, detail="Too many streamed queries in progress",
+                            headers={"Retry-After": "5"})
     
-    # Convert patient_id to string for JSON key
-    patient_id_str = str(patient_id)
+    print(f"Streaming query: '{query_data.query}' for patient: {patient['name']} (ID: {patient['id']})")
     
-    # Return patient's chat history or empty list if none exists
-    return {"history": chat_history.get(patient_id_str, [])}
+    # The sync generator is iterated in the threadpool, so the blocking
+    # token iterator never runs on the event loop
+    body = release_when_done(stream_query_events(rag_system, query_data.query, patient), rag_system.stream_slots)
+    await body.__anext__()
+    return StreamingResponse(body, media_type="application/x-ndjson")
+
+def check_cohort_size(count: int):
+    if count > COHORT_MAX_PATIENTS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Cohort has {count} patients; at most {COHORT_MAX_PATIENTS} per query",
+        )
+
+async def select_cohort(cohort_query: CohortQueryModel):
+    """Patients a cohort query applies to, in ID (or the requested) order"""
+    filters = {"name": cohort_query.name, "condition": cohort_query.condition, "medication": cohort_query.medication}
+    if cohort_query.patientIds is not None:
+        patient_ids = list(dict.fromkeys(cohort_query.patientIds))
+        found = await patients.get_many(patient_ids)
+        if len(found) < len(patient_ids):
+            missing = next(i for i in patient_ids if i not in {patient["id"] for patient in found})
+            raise HTTPException(status_code=404, detail=f"Patient {missing} not found")
+        if any(filters.values()):
+            # The filters narrow the listed patients, with the same matching as without IDs
+            ids, _ = await run_in_threadpool(patient_index.search, **filters)
+            matching = set(ids)
+            found = [patient for patient in found if patient["id"] in matching]
+        check_cohort_size(len(found))
+        return found
+    ids, _ = await run_in_threadpool(patient_index.search, **filters)
+    # Checked before any record is read
+    check_cohort_size(len(ids))
+    return await patients.get_many(ids)
+
+async def stream_cohort_events(rag_system: RAGSystem, query: str, cohort, job):
+    """NDJSON events for a cohort query; each answer is also added to its patient's history"""
+    async for event in run_cohort(rag_system, query, cohort, job, COHORT_MAX_IN_FLIGHT):
+        if event["type"] == "result":
+            await run_in_threadpool(add_to_chat_history, event["patientId"], query, event["response"])
+        yield json.dumps(event) + "\n"
+    print(f"Cohort query {job.id} finished: {job.completed}/{job.total} answered, {job.failed} failed")
+
+@app.post("/api/cohort/query")
+async def process_cohort_query(cohort_query: CohortQueryModel):
+    with span("load_patient"):
+        cohort = await select_cohort(cohort_query)
+    if not cohort:
+        raise HTTPException(status_code=404, detail="No patients match the cohort")
+    
+    rag_system = await get_rag_system()
+    
+    job = await run_in_threadpool(cohort_jobs.create, cohort_query.query, len(cohort))
+    print(f"Cohort query {job.id}: '{cohort_query.query}' for {len(cohort)} patients")
+    
+    # Results stream back as they complete; a client disconnect stops the job
+    return StreamingResponse(
+        stream_cohort_events(rag_system, cohort_query.query, cohort, job),
+        media_type="application/x-ndjson",
+        headers={"X-Cohort-Job-Id": job.id},
+    )
+
+@app.get("/api/cohort/{job_id}")
+async def get_cohort_status(job_id: str):
+    status = await run_in_threadpool(cohort_jobs.status, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Cohort job not found")
+    return status
+
+@app.delete("/api/cohort/{job_id}")
+async def cancel_cohort(job_id: str):
+    status = await run_in_threadpool(cohort_jobs.cancel, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Cohort job not found")
+    return status
+
+@app.get("/api/inference/stats")
+async def get_inference_stats():
+    # Queue depth and batch-size metrics for the LLM scheduler
+    rag_system = model_loader.get_nowait()
+    if rag_system is None or rag_system.inference_scheduler is None:
+        return {"enabled": False}
+    return {"enabled": True, **rag_system.inference_scheduler.stats()}
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    # Hit/miss counters and size of the semantic response cache
+    rag_system = model_loader.get_nowait()
+    if rag_system is None or rag_system.response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **rag_system.response_cache.stats()}
+
+@app.get("/api/embedding/stats")
+async def get_embedding_stats():
+    # Micro-batch sizes and LRU hits of the query embedding service
+    rag_system = model_loader.get_nowait()
+    if rag_system is None:
+        return {"enabled": False}
+    return {"enabled": True, **rag_system.embedding_service.stats()}
+
+@app.get("/metrics")
+async def get_metrics():
+    # Stage latencies, token counts and cache counters of this process, for Prometheus
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/api/knowledge/reload")
+async def reload_knowledge():
+    # Re-ingest knowledge.json and the guideline documents; only added, edited
+    # or deleted chunks are re-embedded and re-indexed, and queries keep running
+    if supervisor_pid is not None:
+        # Reloading only this worker would leave the others on the old index
+        os.kill(supervisor_pid, signal.SIGHUP)
+        return JSONResponse(
+            {"status": "reloading", "detail": "The server re-ingests the knowledge base and replaces its workers"},
+            status_code=202,
+        )
+    rag_system = await get_rag_system()
+    return await run_in_threadpool(rag_system.reload_knowledge)
+
+# Add a new endpoint to get chat history for a specific patient
+@app.get("/api/patients/{patient_id}/history")
+async def get_patient_chat_history(
+    patient_id: int,
+    cursor: Optional[int] = FastAPIQuery(None),
+    limit: Optional[int] = FastAPIQuery(None, ge=1, le=500),
+):
+    # Without a limit the whole history is returned, as before
+    # Reading may first commit buffered appends
+    history, next_cursor = await run_in_threadpool(chat_history.read, patient_id, cursor=cursor, limit=limit)
+    return {"history": history, "nextCursor": next_cursor}
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
@@ -0,0 +1,204 @@
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds; spans from a cache hit (~100us) to a long CPU generation
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                   30.0, 60.0, 120.0)
+# Counts such as prompt lengths in characters or tokens
+SIZE_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Registry:
+    """Metrics rendered together in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: List["_Metric"] = []
+
+    def register(self, metric: "_Metric"):
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[Tuple[str, List[Tuple[str, str]], float]]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonic count; the name should end in ``_total``"""
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, list(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    """Cumulative bucket counts plus sum and count per label set"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional[Registry] = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: counts per bucket (the last one is +Inf), sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total[0]) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", labels + [("le", _format_value(bound))], cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Gauge(_Metric):
+    """Value read from a callback at scrape time; the callback returns a
+    number, or ``{label values tuple: number}`` for labelled gauges"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], object], labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.read = read
+
+    def samples(self):
+        try:
+            value = self.read()
+        except Exception:
+            return
+        if value is None:
+            return
+        if not isinstance(value, dict):
+            value = {(): value}
+        for key, number in sorted(value.items()):
+            yield self.name, list(zip(self.labelnames, key)), number
+
+
+# Pipeline metrics
+STAGE_SECONDS = Histogram("cdss_stage_seconds", "Time spent in each stage of request handling", ["stage"])
+HTTP_REQUEST_SECONDS = Histogram(
+    "cdss_http_request_seconds", "Time until the response starts, by route", ["route", "method", "status"],
+)
+PROMPT_CHARS = Histogram("cdss_prompt_chars", "Length of LLM prompts in characters", buckets=SIZE_BUCKETS)
+PROMPT_TOKENS = Histogram("cdss_prompt_tokens", "Length of LLM prompts in tokens", buckets=SIZE_BUCKETS)
+GENERATED_TOKENS = Histogram("cdss_generated_tokens", "Tokens generated per response", buckets=SIZE_BUCKETS)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "cdss_response_cache_lookups_total", "Semantic response cache lookups by result", ["result"],
+)
+LLM_FALLBACKS = Counter(
+    "cdss_llm_fallbacks_total", "Responses that fell back to mock generation after an LLM error", ["path"],
+)
+
+_trace: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "cdss_trace", default=None)
+
+
+def start_trace() -> List[Tuple[str, float]]:
+    """Collect the spans of the current request (and the threads it hands work to)"""
+    trace: List[Tuple[str, float]] = []
+    _trace.set(trace)
+    return trace
+
+
+@contextlib.contextmanager
+def span(stage: str):
+    """Time a block into cdss_stage_seconds and the current request's trace"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((stage, elapsed))
+
+
+def server_timing(trace: List[Tuple[str, float]]) -> str:
+    """A Server-Timing header value; repeated stages are summed"""
+    totals: Dict[str, float] = {}
+    for stage, elapsed in trace:
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    return ", ".join(f"{stage};dur={elapsed * 1000:.2f}" for stage, elapsed in totals.items())
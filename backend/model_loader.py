@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class ModelsNotReady(Exception):
+    """Raised when the models are still loading (or failed to load)"""
+
+
+class BackgroundModelLoader(Generic[T]):
+    """Builds an expensive object (the RAG system) on a background thread.
+
+    The API starts serving immediately; routes that need the models either
+    await ``wait_ready`` or check ``get_nowait``. ``start`` is idempotent, so
+    a lazily started loader begins loading on the first request that needs it.
+    """
+
+    def __init__(self, factory: Callable[[], T], name: str = "model-loader"):
+        self.factory = factory
+        self.name = name
+        self._future: Future = Future()
+        self._start_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            # A running future cannot be cancelled by a waiter that times out
+            self._future.set_running_or_notify_cancel()
+            self.started_at = time.monotonic()
+            self._thread = threading.Thread(target=self._load, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _load(self):
+        print("Loading models in the background...")
+        try:
+            value = self.factory()
+        except BaseException as e:
+            self.finished_at = time.monotonic()
+            print(f"Model loading failed: {e}")
+            self._future.set_exception(e)
+            return
+        self.finished_at = time.monotonic()
+        print(f"Models ready after {self.finished_at - self.started_at:.1f}s")
+        self._future.set_result(value)
+
+    @property
+    def ready(self) -> bool:
+        return self._future.done() and self._future.exception() is None
+
+    def get_nowait(self) -> Optional[T]:
+        """The loaded object, or None while loading (or after a failure)"""
+        return self._future.result() if self.ready else None
+
+    def wait(self, timeout: Optional[float] = None) -> T:
+        """Block until loaded; raises ModelsNotReady on timeout or failure"""
+        self.start()
+        try:
+            return self._future.result(timeout=timeout)
+        except FutureTimeoutError as e:
+            raise ModelsNotReady("Models are still loading") from e
+        except Exception as e:
+            raise ModelsNotReady(f"Model loading failed: {e}") from e
+
+    async def wait_ready(self, timeout: Optional[float] = None) -> T:
+        """Await the loaded object without blocking the event loop"""
+        self.start()
+        if not self._future.done():
+            if timeout is not None and timeout <= 0:
+                raise ModelsNotReady("Models are still loading")
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self._future)), timeout)
+            except asyncio.TimeoutError as e:
+                raise ModelsNotReady("Models are still loading") from e
+            except Exception:
+                pass
+        if self._future.exception() is not None:
+            raise ModelsNotReady(f"Model loading failed: {self._future.exception()}")
+        return self._future.result()
+
+    def status(self):
+        if self._thread is None:
+            state = "not_started"
+        elif not self._future.done():
+            state = "loading"
+        elif self._future.exception() is not None:
+            state = "failed"
+        else:
+            state = "ready"
+        status = {"status": state}
+        if self.started_at is not None:
+            end = self.finished_at or time.monotonic()
+            status["loading_seconds"] = round(end - self.started_at, 2)
+        if state == "failed":
+            status["error"] = str(self._future.exception())
+        return status
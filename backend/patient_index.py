@@ -0,0 +1,197 @@
+import bisect
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from lexical_index import content_tokens
+from patient_store import PatientRepository
+
+# Fields a projection can ask for, in response order
+PATIENT_FIELDS = ("id", "name", "age", "gender", "bloodGroup", "medicalHistory", "medications")
+
+
+class _Entry(NamedTuple):
+    name: str  # lowercased
+    age: int
+    conditions: Tuple[frozenset, ...]  # content tokens of each condition
+    medications: Tuple[frozenset, ...]
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _matches_terms(term_sets: Tuple[frozenset, ...], terms: Set[str]) -> bool:
+    # Same rule as cohort.matches_filters: one name holds all of the filter's terms
+    return any(terms <= names for names in term_sets)
+
+
+def project(patient: Dict[str, Any], fields: Optional[List[str]]) -> Dict[str, Any]:
+    if not fields:
+        return patient
+    return {field: patient[field] for field in PATIENT_FIELDS if field in fields}
+
+
+class PatientIndex:
+    """In-memory search index over the patient store.
+
+    Names are indexed by trigram, so a case-insensitive substring search
+    of three or more characters only checks the patients sharing the
+    query's trigrams; shorter queries scan the in-memory names. Condition
+    and medication terms map to patient ids, and ages are kept per
+    patient, so filters never read the store. Only matching ids are
+    looked up in the repository, one page at a time.
+
+    ``upsert`` keeps the index current for writes made by this process.
+    Writes made by other processes (serve.py workers) are picked up from the
+    repository's change feed before each search. The index is built on
+    first use.
+    """
+
+    def __init__(self, repository: PatientRepository):
+        self.repository = repository
+        self._lock = threading.Lock()
+        self._built = False
+        self._seq = 0
+        self._entries: Dict[int, _Entry] = {}
+        self._ids: List[int] = []  # sorted
+        self._name_trigrams: Dict[str, Set[int]] = defaultdict(set)
+        self._condition_terms: Dict[str, Set[int]] = defaultdict(set)
+        self._medication_terms: Dict[str, Set[int]] = defaultdict(set)
+        # Condition and medication names repeat across patients; their term sets are shared
+        self._term_sets: Dict[str, frozenset] = {}
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._ensure_current()
+            return len(self._entries)
+
+    def upsert(self, patient: Dict[str, Any]):
+        """Index a created or updated patient"""
+        with self._lock:
+            if self._built:
+                self._add(patient)
+
+    def search(self, name: Optional[str] = None, condition: Optional[str] = None,
+               medication: Optional[str] = None, min_age: Optional[int] = None, max_age: Optional[int] = None,
+               cursor: Optional[int] = None, limit: Optional[int] = None) -> Tuple[List[int], Optional[int]]:
+        """Ids of matching patients in id order, after ``cursor``, at most ``limit`` of them.
+
+        Returns the ids and the cursor for the next page (None once the
+        results are exhausted), as for the chat history.
+        """
+        with self._lock:
+            self._ensure_current()
+            candidates = self._candidates(name, condition, medication)
+            if candidates is None:
+                ids = self._ids
+                ordered = (ids[i] for i in range(bisect.bisect_right(ids, cursor or 0), len(ids)))
+            else:
+                ordered = sorted(i for i in candidates if i > (cursor or 0))
+            name = name.lower() if name else None
+            condition_terms = content_tokens(condition) if condition else None
+            medication_terms = content_tokens(medication) if medication else None
+            matches = []
+            for patient_id in ordered:
+                entry = self._entries[patient_id]
+                if name and name not in entry.name:
+                    continue
+                if min_age is not None and entry.age < min_age:
+                    continue
+                if max_age is not None and entry.age > max_age:
+                    continue
+                if condition_terms and not _matches_terms(entry.conditions, condition_terms):
+                    continue
+                if medication_terms and not _matches_terms(entry.medications, medication_terms):
+                    continue
+                matches.append(patient_id)
+                # One extra match tells whether another page exists
+                if limit is not None and len(matches) > limit:
+                    return matches[:limit], matches[limit - 1]
+            return matches, None
+
+    def _candidates(self, name, condition, medication) -> Optional[Set[int]]:
+        """Ids that may match, from the posting lists; None means every patient"""
+        postings = []
+        if name and len(name) >= 3:
+            postings += [self._name_trigrams.get(gram, set()) for gram in _trigrams(name.lower())]
+        if condition:
+            postings += [self._condition_terms.get(term, set()) for term in content_tokens(condition)]
+        if medication:
+            postings += [self._medication_terms.get(term, set()) for term in content_tokens(medication)]
+        if not postings:
+            return None
+        postings.sort(key=len)
+        return set(postings[0]).intersection(*postings[1:])
+
+    def _ensure_current(self):
+        if not self._built:
+            self._build()
+            return
+        seq, changed = self.repository.changes_since(self._seq)
+        if changed is None:
+            # This process fell too far behind the change feed
+            self._build()
+            return
+        if changed:
+            found = {patient["id"]: patient for patient in self.repository.get_many(changed)}
+            for patient_id in changed:
+                if patient_id in found:
+                    self._add(found[patient_id])
+                else:
+                    self._remove(patient_id)
+        self._seq = seq
+
+    def _build(self):
+        for postings in (self._entries, self._name_trigrams, self._condition_terms, self._medication_terms):
+            postings.clear()
+        self._ids = []
+        # Changes made while building are replayed on the next search
+        self._seq, _ = self.repository.changes_since(None)
+        for patient in self.repository.iter_all():
+            self._add(patient)
+        self._built = True
+        print(f"Indexed {len(self._entries)} patients for search")
+
+    def _add(self, patient: Dict[str, Any]):
+        patient_id = patient["id"]
+        if patient_id in self._entries:
+            self._remove(patient_id)
+        entry = _Entry(
+            name=patient["name"].lower(),
+            age=patient["age"],
+            conditions=tuple(self._terms(c) for c in patient["medicalHistory"]),
+            medications=tuple(self._terms(m) for m in patient["medications"]),
+        )
+        self._entries[patient_id] = entry
+        if not self._ids or patient_id > self._ids[-1]:
+            self._ids.append(patient_id)
+        else:
+            bisect.insort(self._ids, patient_id)
+        for gram in _trigrams(entry.name):
+            self._name_trigrams[gram].add(patient_id)
+        for term in set().union(*entry.conditions):
+            self._condition_terms[term].add(patient_id)
+        for term in set().union(*entry.medications):
+            self._medication_terms[term].add(patient_id)
+
+    def _terms(self, name: str) -> frozenset:
+        terms = self._term_sets.get(name)
+        if terms is None:
+            terms = self._term_sets[name] = frozenset(content_tokens(name))
+        return terms
+
+    def _remove(self, patient_id: int):
+        entry = self._entries.pop(patient_id, None)
+        if entry is None:
+            return
+        del self._ids[bisect.bisect_left(self._ids, patient_id)]
+        for postings, keys in ((self._name_trigrams, _trigrams(entry.name)),
+                               (self._condition_terms, set().union(*entry.conditions)),
+                               (self._medication_terms, set().union(*entry.medications))):
+            for key in keys:
+                ids = postings.get(key)
+                if ids is not None:
+                    ids.discard(patient_id)
+                    if not ids:
+                        del postings[key]
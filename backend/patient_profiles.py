@@ -0,0 +1,147 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from lexical_index import TermDictionary, content_tokens, tokenize
+from response_cache import patient_fingerprint
+
+
+class PatientProfile(NamedTuple):
+    """Query-independent parts of a patient's context, computed once per record version"""
+    fingerprint: str
+    # "Patient Information:" section of the prompt context
+    header: str
+    # Text and unit-length embedding of the clinical profile used for retrieval
+    profile_text: str
+    embedding: np.ndarray
+    # (name, content tokens) for related-condition/medication notes
+    condition_terms: Tuple[Tuple[str, FrozenSet[str]], ...]
+    medication_terms: Tuple[Tuple[str, FrozenSet[str]], ...]
+    # Exact name lookups for the query and knowledge texts
+    conditions: TermDictionary
+    medications: TermDictionary
+    names: TermDictionary
+
+    def query_vector(self, query_embedding: np.ndarray, query_weight: float) -> np.ndarray:
+        """Blend a query embedding with the profile embedding (both normalised)"""
+        query_embedding = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(query_embedding)
+        if norm > 0:
+            query_embedding = query_embedding / norm
+        combined = query_weight * query_embedding + (1 - query_weight) * self.embedding
+        norm = np.linalg.norm(combined)
+        return combined / norm if norm > 0 else combined
+
+    def term_weights(self, query_tokens: List[str], boost: float = 2.0) -> Dict[str, float]:
+        """BM25 weights boosting query terms that name one of the patient's conditions or medications"""
+        return {token: boost for name in self.names.find(query_tokens) for token in tokenize(name)}
+
+
+def format_patient_header(patient: Dict[str, Any]) -> str:
+    return f"""Patient Information:
+- Name: {patient['name']}
+- Age: {patient['age']} years
+- Gender: {patient['gender']}
+- Blood Group: {patient['bloodGroup']}
+- Medical History: {', '.join(patient['medicalHistory'])}
+- Current Medications: {', '.join(patient['medications'])}
+"""
+
+
+def format_clinical_profile(patient: Dict[str, Any]) -> str:
+    """The patient part of the original augmented retrieval query"""
+    return (f"a {patient['age']} year old {patient['gender']} with medical history of "
+            f"{', '.join(patient['medicalHistory'])} taking {', '.join(patient['medications'])}")
+
+
+class PatientProfileCache:
+    """LRU cache of PatientProfile objects keyed by patient id.
+
+    A cached profile is only used while its fingerprint matches the record
+    passed in, so a stale profile (e.g. after another worker updated the
+    patient) is rebuilt on the next query. Writers call ``refresh`` so the
+    rebuild happens on the write instead.
+    """
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], max_entries: int = 10000):
+        self.encode = encode
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._profiles: "OrderedDict[Any, PatientProfile]" = OrderedDict()
+        self._counters = {"hits": 0, "builds": 0}
+
+    def get(self, patient: Dict[str, Any]) -> PatientProfile:
+        fingerprint = patient_fingerprint(patient)
+        with self._lock:
+            profile = self._profiles.get(patient.get("id"))
+            if profile is not None and profile.fingerprint == fingerprint:
+                self._profiles.move_to_end(patient.get("id"))
+                self._counters["hits"] += 1
+                return profile
+        return self.refresh(patient, fingerprint)
+
+    def get_many(self, patients: List[Dict[str, Any]]) -> List[PatientProfile]:
+        """Profiles for several patients; missing ones are embedded in one batch"""
+        fingerprints = [patient_fingerprint(patient) for patient in patients]
+        profiles: List[Optional[PatientProfile]] = []
+        with self._lock:
+            for patient, fingerprint in zip(patients, fingerprints):
+                profile = self._profiles.get(patient.get("id"))
+                if profile is not None and profile.fingerprint == fingerprint:
+                    self._profiles.move_to_end(patient.get("id"))
+                    self._counters["hits"] += 1
+                    profiles.append(profile)
+                else:
+                    profiles.append(None)
+        missing = [i for i, profile in enumerate(profiles) if profile is None]
+        if missing:
+            embeddings = self.encode([format_clinical_profile(patients[i]) for i in missing])
+            for i, embedding in zip(missing, embeddings):
+                profiles[i] = self._store(patients[i], self._build(patients[i], fingerprints[i], embedding))
+        return profiles
+
+    def refresh(self, patient: Dict[str, Any], fingerprint: Optional[str] = None) -> PatientProfile:
+        """(Re)build and cache the profile for a patient record"""
+        return self._store(patient, self._build(patient, fingerprint or patient_fingerprint(patient)))
+
+    def _store(self, patient: Dict[str, Any], profile: PatientProfile) -> PatientProfile:
+        with self._lock:
+            self._counters["builds"] += 1
+            if patient.get("id") is not None and self.max_entries > 0:
+                self._profiles[patient["id"]] = profile
+                self._profiles.move_to_end(patient["id"])
+                while len(self._profiles) > self.max_entries:
+                    self._profiles.popitem(last=False)
+        return profile
+
+    def invalidate(self, patient_id):
+        with self._lock:
+            self._profiles.pop(patient_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, "entries": len(self._profiles), "max_entries": self.max_entries}
+
+    def _build(self, patient: Dict[str, Any], fingerprint: str, embedding: Optional[np.ndarray] = None) -> PatientProfile:
+        profile_text = format_clinical_profile(patient)
+        if embedding is None:
+            embedding = self.encode([profile_text])[0]
+        embedding = np.array(embedding, dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        if norm > 0:
+            embedding = embedding / norm
+        embedding.flags.writeable = False
+        conditions, medications = list(patient["medicalHistory"]), list(patient["medications"])
+        return PatientProfile(
+            fingerprint=fingerprint,
+            header=format_patient_header(patient),
+            profile_text=profile_text,
+            embedding=embedding,
+            condition_terms=tuple((name, frozenset(content_tokens(name))) for name in conditions),
+            medication_terms=tuple((name, frozenset(content_tokens(name))) for name in medications),
+            conditions=TermDictionary(conditions),
+            medications=TermDictionary(medications),
+            names=TermDictionary(conditions + medications),
+        )
@@ -0,0 +1,459 @@
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config import DATABASE_FILE, PATIENTS_FILE, PATIENT_STORE, PATIENT_FLUSH_INTERVAL_MS
+
+
+class PatientRepository:
+    """Storage interface for patient records.
+
+    Records are plain dicts in the shape the API returns: ``id``, ``name``,
+    ``age``, ``gender``, ``bloodGroup``, ``medicalHistory``, ``medications``.
+    """
+
+    # True when reads are answered from memory and never wait on disk
+    reads_from_memory = False
+
+    def get(self, patient_id: int) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def list(self, name: Optional[str] = None) -> List[Dict[str, Any]]:
+        """All patients ordered by id, optionally filtered by a case-insensitive name substring"""
+        raise NotImplementedError
+
+    def create(self, patient: Dict[str, Any]) -> Dict[str, Any]:
+        """Insert a patient, assigning the next id"""
+        raise NotImplementedError
+
+    def update(self, patient_id: int, patient: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Replace a patient's fields, returning None if the id does not exist"""
+        raise NotImplementedError
+
+    def get_many(self, patient_ids: Iterable[int]) -> List[Dict[str, Any]]:
+        """Patients in the order of ``patient_ids``, skipping ids that do not exist"""
+        patients = (self.get(patient_id) for patient_id in patient_ids)
+        return [patient for patient in patients if patient is not None]
+
+    def iter_all(self) -> Iterator[Dict[str, Any]]:
+        """All patients ordered by id, without necessarily holding them in memory at once"""
+        return iter(self.list())
+
+    def changes_since(self, seq: Optional[int]) -> Tuple[int, Optional[List[int]]]:
+        """Ids of patients written (by any process) after change ``seq``, and the new seq.
+
+        ``seq=None`` only reads the current seq. The id list is None when
+        changes after ``seq`` are no longer recorded. Stores used by a
+        single process report no changes.
+        """
+        return 0, []
+
+    def close(self):
+        """Write out anything buffered; the repository stays usable"""
+
+
+class JsonPatientRepository(PatientRepository):
+    """The original single-file store, with a write-through in-memory copy.
+
+    The file is read once. Reads are served from memory; writes update the
+    in-memory copy and mark it dirty, and a background thread writes the
+    whole list out at most every ``flush_interval_ms``, so a burst of
+    writes costs one file write. Each flush goes to a temporary file that
+    is fsynced and renamed over the original, so the file is never left
+    truncated. A crash can lose the writes of the last flush interval.
+    Only one process may use the file.
+    """
+
+    reads_from_memory = True
+
+    def __init__(self, path: str = PATIENTS_FILE, flush_interval_ms: int = PATIENT_FLUSH_INTERVAL_MS):
+        self.path = path
+        self.flush_interval = flush_interval_ms / 1000
+        self._lock = threading.Lock()
+        # Serializes flushes, so an older snapshot never replaces a newer one
+        self._flush_lock = threading.Lock()
+        # Stored dicts are replaced on update, never modified, so a snapshot can be written without the lock
+        self._patients: Dict[int, Dict[str, Any]] = {patient["id"]: patient for patient in self.load_all()}
+        self._next_id = max(self._patients, default=0) + 1
+        self._version = self._flushed_version = 0
+        self._dirty = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="patient-store-flush", daemon=True)
+        self._flusher.start()
+
+    def load_all(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def save_all(self, patients: List[Dict[str, Any]]):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(patients, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+    def get(self, patient_id):
+        with self._lock:
+            patient = self._patients.get(patient_id)
+        return dict(patient) if patient is not None else None
+
+    def get_many(self, patient_ids):
+        with self._lock:
+            patients = [self._patients.get(patient_id) for patient_id in patient_ids]
+        return [dict(patient) for patient in patients if patient is not None]
+
+    def list(self, name=None):
+        with self._lock:
+            patients = list(self._patients.values())
+        if name:
+            patients = [p for p in patients if name.lower() in p["name"].lower()]
+        return [dict(patient) for patient in patients]
+
+    def create(self, patient):
+        with self._lock:
+            new_patient = {"id": self._next_id, **patient}
+            self._next_id += 1
+            self._patients[new_patient["id"]] = new_patient
+            self._mark_dirty()
+        return dict(new_patient)
+
+    def update(self, patient_id, patient):
+        with self._lock:
+            if patient_id not in self._patients:
+                return None
+            updated = {"id": patient_id, **patient}
+            self._patients[patient_id] = updated
+            self._mark_dirty()
+        return dict(updated)
+
+    def _mark_dirty(self):
+        # Caller holds _lock
+        self._version += 1
+        self._dirty.set()
+
+    def flush(self):
+        """Write the current records to the file if they changed since the last flush"""
+        with self._flush_lock:
+            with self._lock:
+                version = self._version
+                patients = list(self._patients.values())
+            if version == self._flushed_version:
+                return
+            self.save_all(patients)
+            self._flushed_version = version
+
+    def _flush_loop(self):
+        while True:
+            self._dirty.wait()
+            # Let the rest of a burst of writes arrive before writing the file
+            time.sleep(self.flush_interval)
+            self._dirty.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Writing {self.path} failed, will retry: {e}")
+                self._dirty.set()
+
+    def close(self):
+        self.flush()
+
+
+class SQLitePatientRepository(PatientRepository):
+    """Patient store backed by SQLite in WAL mode.
+
+    ``id`` is the INTEGER PRIMARY KEY (the rowid), so lookups and id
+    assignment are B-tree operations rather than scans. Names are indexed
+    case-insensitively, and through an FTS5 trigram index when the SQLite
+    build supports it, so substring search does not scan the table. WAL lets
+    readers in any number of worker processes proceed while one writer
+    commits; each thread gets its own connection.
+    """
+
+    COLUMNS = "id, name, age, gender, blood_group, medical_history, medications"
+    # Entries kept in the patient_changes feed; an index further behind rebuilds
+    CHANGES_RETAINED = 10000
+
+    def __init__(self, path: str = DATABASE_FILE, json_path: Optional[str] = PATIENTS_FILE):
+        self.path = path
+        self._local = threading.local()
+        self.has_trigram_index = False
+        self._initialize_schema()
+        if json_path:
+            self.migrate_from_json(json_path)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; write paths open explicit transactions
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _initialize_schema(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS patients (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    age INTEGER NOT NULL,
+                    gender TEXT NOT NULL,
+                    blood_group TEXT NOT NULL,
+                    medical_history TEXT NOT NULL,
+                    medications TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_patients_name ON patients (name COLLATE NOCASE)")
+            conn.execute("CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            # Feed of written patient ids, so in-memory indexes in every worker process can catch up
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS patient_changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    patient_id INTEGER NOT NULL
+                )
+            """)
+            for event, row in (("INSERT", "new"), ("UPDATE", "new"), ("DELETE", "old")):
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS patients_changes_{event.lower()} AFTER {event} ON patients BEGIN
+                        INSERT INTO patient_changes (patient_id) VALUES ({row}.id);
+                        DELETE FROM patient_changes WHERE seq <= last_insert_rowid() - {self.CHANGES_RETAINED};
+                    END
+                """)
+            try:
+                fts_exists = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'patients_name_fts'"
+                ).fetchone()
+                conn.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS patients_name_fts
+                    USING fts5(name, content='patients', content_rowid='id', tokenize='trigram')
+                """)
+                conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS patients_name_fts_insert AFTER INSERT ON patients BEGIN
+                        INSERT INTO patients_name_fts (rowid, name) VALUES (new.id, new.name);
+                    END
+                """)
+                conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS patients_name_fts_update AFTER UPDATE OF name ON patients BEGIN
+                        INSERT INTO patients_name_fts (patients_name_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                        INSERT INTO patients_name_fts (rowid, name) VALUES (new.id, new.name);
+                    END
+                """)
+                conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS patients_name_fts_delete AFTER DELETE ON patients BEGIN
+                        INSERT INTO patients_name_fts (patients_name_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                    END
+                """)
+                if not fts_exists:
+                    # Index rows written before the trigram table existed
+                    conn.execute("INSERT INTO patients_name_fts (patients_name_fts) VALUES ('rebuild')")
+                self.has_trigram_index = True
+            except sqlite3.OperationalError as e:
+                # FTS5 or the trigram tokenizer (SQLite >= 3.34) is unavailable
+                print(f"Name trigram index unavailable, using the NOCASE index only: {e}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _row_to_patient(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "id": row["id"],
+            "name": row["name"],
+            "age": row["age"],
+            "gender": row["gender"],
+            "bloodGroup": row["blood_group"],
+            "medicalHistory": json.loads(row["medical_history"]),
+            "medications": json.loads(row["medications"]),
+        }
+
+    @staticmethod
+    def _patient_values(patient: Dict[str, Any]) -> tuple:
+        return (
+            patient["name"],
+            patient["age"],
+            patient["gender"],
+            patient["bloodGroup"],
+            json.dumps(patient["medicalHistory"]),
+            json.dumps(patient["medications"]),
+        )
+
+    def get(self, patient_id):
+        row = self._connect().execute(
+            f"SELECT {self.COLUMNS} FROM patients WHERE id = ?", (patient_id,)
+        ).fetchone()
+        return self._row_to_patient(row) if row else None
+
+    def get_many(self, patient_ids):
+        patient_ids = list(patient_ids)
+        by_id = {}
+        conn = self._connect()
+        # Stay below SQLite's limit on bound parameters
+        for start in range(0, len(patient_ids), 500):
+            chunk = patient_ids[start:start + 500]
+            rows = conn.execute(
+                f"SELECT {self.COLUMNS} FROM patients WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            )
+            by_id.update((row["id"], self._row_to_patient(row)) for row in rows)
+        return [by_id[patient_id] for patient_id in patient_ids if patient_id in by_id]
+
+    def iter_all(self):
+        for row in self._connect().execute(f"SELECT {self.COLUMNS} FROM patients ORDER BY id"):
+            yield self._row_to_patient(row)
+
+    def changes_since(self, seq):
+        conn = self._connect()
+        if seq is None:
+            row = conn.execute("SELECT max(seq) FROM patient_changes").fetchone()
+            return row[0] or 0, []
+        rows = conn.execute(
+            "SELECT seq, patient_id FROM patient_changes WHERE seq > ? ORDER BY seq", (seq,)
+        ).fetchall()
+        if not rows:
+            return seq, []
+        if rows[0]["seq"] > seq + 1:
+            # Seqs have no gaps, so the entries right after seq were pruned
+            return rows[-1]["seq"], None
+        return rows[-1]["seq"], list(dict.fromkeys(row["patient_id"] for row in rows))
+
+    def list(self, name=None):
+        conn = self._connect()
+        if not name:
+            rows = conn.execute(f"SELECT {self.COLUMNS} FROM patients ORDER BY id")
+        elif self.has_trigram_index and len(name) >= 3 and not any(c in name for c in "%_\\"):
+            # The trigram index serves LIKE only without an ESCAPE clause
+            rows = conn.execute(
+                f"SELECT {self.COLUMNS} FROM patients WHERE id IN "
+                f"(SELECT rowid FROM patients_name_fts WHERE name LIKE ?) ORDER BY id",
+                (f"%{name}%",),
+            )
+        else:
+            rows = conn.execute(
+                f"SELECT {self.COLUMNS} FROM patients WHERE name LIKE ? ESCAPE '\\' ORDER BY id",
+                (self._like_pattern(name),),
+            )
+        return [self._row_to_patient(row) for row in rows]
+
+    @staticmethod
+    def _like_pattern(name: str) -> str:
+        escaped = name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return f"%{escaped}%"
+
+    def create(self, patient):
+        cursor = self._connect().execute(
+            "INSERT INTO patients (name, age, gender, blood_group, medical_history, medications) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            self._patient_values(patient),
+        )
+        return {"id": cursor.lastrowid, **patient}
+
+    def update(self, patient_id, patient):
+        # A single UPDATE statement is atomic on its own
+        cursor = self._connect().execute(
+            "UPDATE patients SET name = ?, age = ?, gender = ?, blood_group = ?, "
+            "medical_history = ?, medications = ? WHERE id = ?",
+            self._patient_values(patient) + (patient_id,),
+        )
+        if cursor.rowcount == 0:
+            return None
+        return {"id": patient_id, **patient}
+
+    def migrate_from_json(self, json_path: str) -> int:
+        """Import patients from the legacy JSON file once, keeping their ids.
+
+        The migration is recorded in ``store_meta`` so it never runs twice,
+        even when several workers start at the same time.
+        """
+        if not os.path.exists(json_path):
+            return 0
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            done = conn.execute("SELECT value FROM store_meta WHERE key = 'patients_migrated_from'").fetchone()
+            if done:
+                conn.execute("COMMIT")
+                return 0
+            with open(json_path, "r") as f:
+                patients = json.load(f)
+            conn.executemany(
+                "INSERT OR IGNORE INTO patients (id, name, age, gender, blood_group, medical_history, medications) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(p["id"],) + self._patient_values(p) for p in patients],
+            )
+            conn.execute(
+                "INSERT INTO store_meta (key, value) VALUES ('patients_migrated_from', ?)",
+                (os.path.abspath(json_path),),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        print(f"Migrated {len(patients)} patients from {json_path} to {self.path}")
+        return len(patients)
+
+
+class AsyncPatientRepository:
+    """Awaitable access to a PatientRepository for async request handlers.
+
+    Calls that may wait on disk or on another process's write lock run in a
+    worker thread, so the event loop keeps serving other requests. Reads
+    from a store that answers them from memory run inline, where a thread
+    hop would cost more than the read itself.
+    """
+
+    def __init__(self, repository: PatientRepository):
+        self.repository = repository
+
+    async def _read(self, method, *args):
+        if self.repository.reads_from_memory:
+            return method(*args)
+        return await asyncio.to_thread(method, *args)
+
+    async def get(self, patient_id: int) -> Optional[Dict[str, Any]]:
+        return await self._read(self.repository.get, patient_id)
+
+    async def get_many(self, patient_ids: Iterable[int]) -> List[Dict[str, Any]]:
+        return await self._read(self.repository.get_many, list(patient_ids))
+
+    async def list(self, name: Optional[str] = None) -> List[Dict[str, Any]]:
+        return await self._read(self.repository.list, name)
+
+    async def create(self, patient: Dict[str, Any]) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.repository.create, patient)
+
+    async def update(self, patient_id: int, patient: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.repository.update, patient_id, patient)
+
+
+def create_patient_repository() -> PatientRepository:
+    """Create the repository selected by CDSS_PATIENT_STORE ("sqlite" or "json")"""
+    if PATIENT_STORE == "json":
+        return JsonPatientRepository(PATIENTS_FILE)
+    if PATIENT_STORE == "sqlite":
+        return SQLitePatientRepository(DATABASE_FILE, json_path=PATIENTS_FILE)
+    raise ValueError(f"Unknown patient store '{PATIENT_STORE}', expected 'sqlite' or 'json'")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate patients from the JSON file into the SQLite store")
+    parser.add_argument("--json", default=PATIENTS_FILE, help="legacy patients.json to import")
+    parser.add_argument("--db", default=DATABASE_FILE, help="SQLite database to create or update")
+    args = parser.parse_args()
+    repository = SQLitePatientRepository(args.db, json_path=None)
+    count = repository.migrate_from_json(args.json)
+    print(f"Imported {count} patients" if count else "Nothing to import (already migrated or file missing)")
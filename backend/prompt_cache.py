@@ -0,0 +1,72 @@
+import copy
+import threading
+from typing import Any, Dict, List
+
+import torch
+
+
+class PrefixKVCache:
+    """Key/value state of a fixed prompt prefix, computed once per model.
+
+    Every prompt that starts with ``prefix`` only needs the prefill forward
+    pass over the rest of its tokens: the cached state is copied, expanded
+    to the batch and handed to ``generate`` along with the full input ids.
+    The prefix and the rest are tokenized separately, so the ids at the
+    seam are the same for every prompt. In a batch the rest is left-padded
+    *after* the prefix; the padding is masked out and position ids follow
+    the attention mask, so each row sees an unpadded prompt.
+
+    Only PyTorch models are supported (``supports`` is False for e.g. the
+    ONNX backend).
+    """
+
+    def __init__(self, model, tokenizer, prefix: str):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.prefix = prefix
+        self.prefix_ids = tokenizer(prefix, return_tensors="pt", add_special_tokens=False)["input_ids"]
+        self._past = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def supports(model) -> bool:
+        return isinstance(model, torch.nn.Module) and getattr(model.config, "use_cache", False)
+
+    @property
+    def prefix_tokens(self) -> int:
+        return self.prefix_ids.shape[1]
+
+    def _prefix_past(self):
+        # Computed on first use, in the process that generates
+        with self._lock:
+            if self._past is None:
+                with torch.no_grad():
+                    output = self.model(self.prefix_ids.to(self.model.device), use_cache=True)
+                self._past = output.past_key_values
+            return self._past
+
+    def generate_inputs(self, suffixes: List[str]) -> Dict[str, Any]:
+        """``generate`` keyword arguments for ``prefix + suffix`` prompts"""
+        past = copy.deepcopy(self._prefix_past())
+        if len(suffixes) > 1:
+            past.batch_repeat_interleave(len(suffixes))
+        rest = self.tokenizer(suffixes, return_tensors="pt", padding=True, add_special_tokens=False)
+        batch = len(suffixes)
+        input_ids = torch.cat([self.prefix_ids.expand(batch, -1), rest["input_ids"]], dim=1)
+        attention_mask = torch.cat(
+            [torch.ones(batch, self.prefix_tokens, dtype=rest["attention_mask"].dtype), rest["attention_mask"]], dim=1,
+        )
+        device = self.model.device
+        return {
+            "input_ids": input_ids.to(device),
+            "attention_mask": attention_mask.to(device),
+            "past_key_values": past,
+        }
+
+    def generate(self, suffixes: List[str], **generation_kwargs) -> List[str]:
+        """Generated text (without the prompt) for each ``prefix + suffix`` prompt"""
+        inputs = self.generate_inputs(suffixes)
+        with torch.no_grad():
+            output = self.model.generate(**inputs, **generation_kwargs)
+        prompt_length = inputs["input_ids"].shape[1]
+        return self.tokenizer.batch_decode(output[:, prompt_length:], skip_special_tokens=True)
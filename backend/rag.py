@@ -1,27 +1,203 @@
-import json
-import os
-from typing import Dict, List, Any
-from sentence_transformers import SentenceTransformer, util
+import asyncio
+import threading
+from typing import Any, Dict, Iterator, List, NamedTuple
+import numpy as np
 import torch
-from transformers import pipeline, AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+from transformers import (
+    pipeline, AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig,
+    StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer,
+)
+from config import (
+    EMBEDDING_MODEL_NAME, EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_DTYPE,
+    VECTOR_INDEX_BACKEND, IVF_NLIST, IVF_NPROBE, PQ_SUBVECTORS, IVF_RERANK,
+    INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_MS, STREAM_MAX_CONCURRENT, STREAM_STOP_TIMEOUT_S,
+    RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_SIMILARITY, RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_MAX_MB, RESPONSE_CACHE_TTL_S, EMBEDDING_BACKEND, LLM_CPU_BACKEND,
+    EMBEDDING_MAX_BATCH_SIZE, EMBEDDING_MAX_WAIT_MS, EMBEDDING_LRU_SIZE, INGEST_BATCH_SIZE,
+    PATIENT_PROFILE_CACHE_SIZE, PROFILE_QUERY_WEIGHT, LLM_MODE, PROMPT_MAX_TOKENS, PROMPT_PREFIX_CACHE_ENABLED,
+)
+from cpu_backends import embedding_model_id, load_causal_lm, load_embedding_model
+from embedding_service import EmbeddingService
+from embedding_store import EmbeddingStore
+from inference import BatchInferenceScheduler, StreamSlots
+from ingestion import KnowledgeSnapshot, build_snapshot, iter_knowledge_chunks, update_snapshot
+from lexical_index import content_tokens, reciprocal_rank_fusion, tokenize
+from metrics import GENERATED_TOKENS, LLM_FALLBACKS, PROMPT_CHARS, PROMPT_TOKENS, RESPONSE_CACHE_LOOKUPS, span
+from patient_profiles import PatientProfileCache
+from prompt_cache import PrefixKVCache
+from response_cache import SemanticResponseCache, patient_fingerprint
+from vector_index import VectorIndex, create_index
+
+DISCLAIMER = ("\n\nDisclaimer: This is an AI-generated response for educational purposes. "
+              "Always verify information with current medical literature and clinical judgment.")
+
+# Instructions shared by every prompt. They come first so that the model's
+# key/value state for them can be computed once and reused (PrefixKVCache).
+STATIC_PROMPT_PREFIX = """You are an AI clinical decision support system designed to help healthcare professionals.
+Based on the patient information and medical knowledge below, provide a concise and evidence-based response to the clinical query.
+
+Instructions:
+1. Directly address the clinical query in relation to this specific patient.
+2. Consider the patient's specific medical history, medications, and other factors that may influence your recommendations.
+3. Highlight any potential interactions between the query and the patient's existing conditions or medications.
+4. Reference the medical knowledge provided and explain its relevance to this specific patient.
+5. Structure your response with clear, actionable recommendations where appropriate.
+6. Avoid generic responses that could apply to any patient.
+
+"""
+
+# Snippets that would be cut to fewer tokens than this are dropped instead
+MIN_SNIPPET_TOKENS = 16
+
+
+class Generation(NamedTuple):
+    """One generate_batch result: the post-processed response and its token counts"""
+    text: str
+    prompt_tokens: int
+    generated_tokens: int
+
+
+class _ResponseStreamFilter:
+    """Applies the "Response:" split and strip() of _postprocess_response to streamed text.
+
+    Leading whitespace is dropped, trailing whitespace and anything that may
+    be the start of another "Response:" marker are held back, and the stream
+    ends at the next marker, matching split("Response:")[1].strip().
+    """
+    MARKER = "Response:"
+    
+    def __init__(self):
+        self.buffer = ""
+        self.started = False
+        self.stopped = False
+    
+    def feed(self, text: str) -> str:
+        if self.stopped:
+            return ""
+        self.buffer += text
+        if not self.started:
+            self.buffer = self.buffer.lstrip()
+            self.started = bool(self.buffer)
+        marker_at = self.buffer.find(self.MARKER)
+        if marker_at >= 0:
+            self.stopped = True
+            out, self.buffer = self.buffer[:marker_at].rstrip(), ""
+            return out
+        held = next((n for n in range(len(self.MARKER) - 1, 0, -1) if self.buffer.endswith(self.MARKER[:n])), 0)
+        ready = self.buffer[:len(self.buffer) - held]
+        out = ready.rstrip()
+        self.buffer = ready[len(out):] + self.buffer[len(ready):]
+        return out
+    
+    def finish(self) -> str:
+        out = "" if self.stopped else self.buffer.rstrip()
+        self.buffer = ""
+        return out
+
+
+class _StopOnEvent(StoppingCriteria):
+    """Stops generation once the streaming client has gone away"""
+    def __init__(self, event: threading.Event):
+        self.event = event
+    
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.event.is_set()
+
 
 class RAGSystem:
+    # Sampling settings for the language model
+    GENERATION_CONFIG = {
+        "max_new_tokens": 512,
+        "temperature": 0.3,
+        "top_p": 0.9,
+        "do_sample": True,
+        "num_return_sequences": 1,
+    }
+    
+    # Candidates taken from each of the dense and lexical searches before fusion
+    RETRIEVAL_CANDIDATES = 20
+    
     def __init__(self):
-        # Initialize the embedding model for retrieval
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        # Initialize the embedding model for retrieval (float32, int8 or ONNX)
+        self.embedding_model = load_embedding_model(EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND)
+        
+        # Query encoder shared by concurrent requests (micro-batched, LRU-cached)
+        self.embedding_service = EmbeddingService(
+            lambda batch: self.embedding_model.encode(batch, batch_size=len(batch), convert_to_numpy=True),
+            max_batch_size=EMBEDDING_MAX_BATCH_SIZE,
+            max_wait_ms=EMBEDDING_MAX_WAIT_MS,
+            cache_size=EMBEDDING_LRU_SIZE,
+        )
         
-        # Load knowledge base from JSON file
-        self.knowledge_base = self.load_knowledge()
+        # Per-patient header, term sets and profile embedding, rebuilt when a record changes
+        self.patient_profiles = PatientProfileCache(
+            self.embedding_service.encode,
+            max_entries=PATIENT_PROFILE_CACHE_SIZE,
+        )
+        
+        # Persistent embedding store shared by all worker processes
+        self.embedding_store = EmbeddingStore(
+            EMBEDDING_CACHE_DIR,
+            embedding_model_id(EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND),
+            dim=self.embedding_model.get_sentence_embedding_dimension(),
+            dtype=EMBEDDING_CACHE_DTYPE,
+        )
         
-        # Create embeddings for the knowledge base
-        self.knowledge_texts = [item["text"] for item in self.knowledge_base]
-        self.knowledge_embeddings = self.embed_texts(self.knowledge_texts)
+        # Load the knowledge base, its embeddings (encoding only new or edited
+        # chunks) and the similarity index over them
+        self._reload_lock = threading.Lock()
+        self.knowledge = self.load_knowledge_snapshot()
+        
+        # Cache of generated responses, keyed on patient state and query similarity
+        self.response_cache = None
+        if RESPONSE_CACHE_ENABLED:
+            self.response_cache = SemanticResponseCache(
+                similarity_threshold=RESPONSE_CACHE_SIMILARITY,
+                max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                max_bytes=RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+                ttl_seconds=RESPONSE_CACHE_TTL_S,
+            )
         
         # Initialize the LLM for generation
         self.initialize_llm()
         
+        # Batches concurrent generations off the event loop (async callers only)
+        self.inference_scheduler = None
+        if self.llm is not None:
+            self.inference_scheduler = BatchInferenceScheduler(
+                self.generate_batch,
+                max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+                max_wait_ms=INFERENCE_MAX_WAIT_MS,
+            )
+        # Streamed generations bypass the scheduler; callers hold one of these slots
+        self.stream_slots = StreamSlots(STREAM_MAX_CONCURRENT)
+        
+    def after_fork(self, inference_scheduler=None):
+        """Restart background threads in a process forked from the one that loaded the models.
+
+        ``inference_scheduler`` replaces the local batching scheduler, e.g.
+        with a client of dedicated inference processes.
+        """
+        self._reload_lock = threading.Lock()
+        self.stream_slots = StreamSlots(STREAM_MAX_CONCURRENT)
+        self.embedding_service.reset_after_fork()
+        if inference_scheduler is not None:
+            self.inference_scheduler = inference_scheduler
+        elif self.llm is not None:
+            self.inference_scheduler = BatchInferenceScheduler(
+                self.generate_batch,
+                max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+                max_wait_ms=INFERENCE_MAX_WAIT_MS,
+            )
+    
     def initialize_llm(self):
         """Initialize the language model for generation"""
+        self.prefix_cache = None
+        if LLM_MODE == "stub":
+            # Deterministic mock responses, e.g. for offline benchmarks
+            print("Language model disabled (CDSS_LLM=stub), using mock response generation")
+            self.llm = None
+            return
         try:
             print("Loading language model...")
             # Use a smaller model that can run on CPU or limited GPU memory
@@ -33,137 +209,437 @@ class RAGSystem:
                 bnb_4bit_compute_dtype=torch.float16
             )
             
-            # First try to load with quantization for GPU
-            try:
-                model = AutoModelForCausalLM.from_pretrained(
-                    model_name,
-                    device_map="auto",
-                    quantization_config=quantization_config,
-                )
-                tokenizer = AutoTokenizer.from_pretrained(model_name)
-                self.llm = pipeline(
-                    "text-generation",
-                    model=model,
-                    tokenizer=tokenizer
-                )
-                print("Language model loaded with GPU acceleration")
-            except Exception as e:
-                print(f"GPU loading failed, falling back to CPU: {e}")
-                # If GPU loading fails, fall back to CPU with smaller model
-                model = AutoModelForCausalLM.from_pretrained(
-                    "microsoft/phi-2", 
+            self.llm = None
+            
+            # First try to load with quantization for GPU. Without a GPU this
+            # would fail after reading the weights, so skip straight to CPU.
+            if torch.cuda.is_available():
+                try:
+                    model = AutoModelForCausalLM.from_pretrained(
+                        model_name,
+                        device_map="auto",
+                        quantization_config=quantization_config,
+                    )
+                    tokenizer = AutoTokenizer.from_pretrained(model_name)
+                    self.llm = pipeline(
+                        "text-generation",
+                        model=model,
+                        tokenizer=tokenizer
+                    )
+                    print("Language model loaded with GPU acceleration")
+                except Exception as e:
+                    print(f"GPU loading failed, falling back to CPU: {e}")
+            else:
+                print("No GPU available, loading language model on CPU")
+            
+            if self.llm is None:
+                # If GPU loading fails, fall back to CPU with the selected backend
+                model, tokenizer = load_causal_lm(
+                    "microsoft/phi-2",
+                    backend=LLM_CPU_BACKEND,
                     trust_remote_code=True,
-                    torch_dtype=torch.float32,  # Use float32 for CPU
                 )
-                tokenizer = AutoTokenizer.from_pretrained("microsoft/phi-2")
                 self.llm = pipeline(
                     "text-generation",
                     model=model,
                     tokenizer=tokenizer
                 )
-                print("Language model loaded on CPU")
+                print(f"Language model loaded on CPU ({LLM_CPU_BACKEND})")
+            
+            # Batched generation needs a pad token; pad on the left for a decoder-only model
+            if self.llm.tokenizer.pad_token is None:
+                self.llm.tokenizer.pad_token = self.llm.tokenizer.eos_token
+            self.llm.tokenizer.padding_side = "left"
+            
+            # The instruction block's key/value state is computed on first use and shared by all prompts
+            if PROMPT_PREFIX_CACHE_ENABLED and PrefixKVCache.supports(self.llm.model):
+                self.prefix_cache = PrefixKVCache(self.llm.model, self.llm.tokenizer, STATIC_PROMPT_PREFIX)
         except Exception as e:
             print(f"Error loading language model: {e}")
             print("Using fallback mock response generation")
             self.llm = None
     
+    # The current snapshot's live chunks, for callers that predate snapshots
+    @property
+    def knowledge_base(self) -> List[Dict[str, Any]]:
+        return [item for item in self.knowledge.items if item is not None]
+    
+    @property
+    def knowledge_texts(self) -> List[str]:
+        return [text for text in self.knowledge.texts if text is not None]
+    
+    @property
+    def vector_index(self) -> VectorIndex:
+        return self.knowledge.index
+    
+    def load_knowledge_snapshot(self) -> KnowledgeSnapshot:
+        """Chunk knowledge.json and the guideline documents, embed them and index them"""
+        chunks = self.load_knowledge()
+        embeddings = self.load_knowledge_embeddings([item["text"] for _, item in chunks])
+        return build_snapshot(chunks, embeddings.numpy(), self.build_vector_index)
+    
+    def reload_knowledge(self) -> Dict[str, Any]:
+        """Re-ingest the knowledge base without a restart.
+
+        Only new or edited chunks are embedded, and only added and removed
+        chunks are applied to a copy of the current index. The new snapshot
+        replaces the old one in a single assignment, so in-flight queries
+        finish against the snapshot they started with. Cached responses are
+        dropped if anything changed, because they were built from the old
+        knowledge.
+        """
+        with self._reload_lock:
+            chunks = self.load_knowledge()
+            embeddings = self.load_knowledge_embeddings([item["text"] for _, item in chunks])
+            snapshot, stats = update_snapshot(
+                self.knowledge, chunks, embeddings.numpy(), self.build_vector_index,
+                batch_size=INGEST_BATCH_SIZE,
+            )
+            if snapshot is not self.knowledge:
+                self.knowledge = snapshot
+                if self.response_cache is not None:
+                    self.response_cache.clear()
+        print(f"Knowledge reloaded: {stats['entries']} chunks, {stats['added']} added, "
+              f"{stats['removed']} removed{' (index rebuilt)' if stats['rebuilt'] else ''}")
+        return stats
+    
     def load_knowledge(self):
-        knowledge_file = "../data/knowledge.json"
-        if not os.path.exists(knowledge_file):
-            return []
-        
-        with open(knowledge_file, "r") as f:
-            return json.load(f)
+        """Distinct (hash, item) chunks of knowledge.json and the guideline documents"""
+        return list(iter_knowledge_chunks())
+    
+    def load_knowledge_embeddings(self, texts: List[str]) -> torch.Tensor:
+        """Load knowledge embeddings from the memory-mapped store, encoding only unseen texts"""
+        vectors = self.embedding_store.load_or_encode(
+            texts,
+            lambda batch: self.embedding_model.encode(batch, convert_to_numpy=True),
+            batch_size=INGEST_BATCH_SIZE,
+        )
+        # Wraps the memory map without copying, so the pages stay shared
+        return torch.from_numpy(vectors)
+    
+    def build_vector_index(self, embeddings: np.ndarray) -> VectorIndex:
+        """Build the configured vector index over the knowledge embeddings"""
+        params = {}
+        if VECTOR_INDEX_BACKEND == "ivfpq":
+            params = {"nlist": IVF_NLIST, "nprobe": IVF_NPROBE, "m": PQ_SUBVECTORS, "rerank": IVF_RERANK}
+        dim = embeddings.shape[1] if len(embeddings) else self.embedding_model.get_sentence_embedding_dimension()
+        index = create_index(VECTOR_INDEX_BACKEND, dim, **params)
+        index.add(np.arange(len(embeddings)), embeddings)
+        return index
     
-    def embed_texts(self, texts: List[str]):
-        return self.embedding_model.encode(texts, convert_to_tensor=True)
+    def embed_texts(self, texts: List[str]) -> torch.Tensor:
+        return torch.from_numpy(self.embedding_service.encode(texts))
+    
+    def search_knowledge(self, query_embedding: np.ndarray, top_k: int) -> List[Dict[str, Any]]:
+        """Return the top_k knowledge items for a single query embedding"""
+        knowledge = self.knowledge
+        scores, ids = knowledge.index.search(query_embedding, top_k)
+        return [
+            {
+                "text": knowledge.texts[idx],
+                "source": knowledge.items[idx]["source"],
+                "score": float(score),
+            }
+            for score, idx in zip(scores[0], ids[0])
+            if idx >= 0
+        ]
     
     def retrieve_relevant_knowledge(self, query: str, patient: Dict[str, Any], top_k=3):
-        """Retrieve relevant knowledge based on query and patient data"""
-        # Create an enhanced query that includes patient-specific information
-        patient_info = f"{query} for a {patient['age']} year old {patient['gender']} with medical history of {', '.join(patient['medicalHistory'])} taking {', '.join(patient['medications'])}"
-        
-        # Embed the enhanced query
-        query_embedding = self.embed_texts([patient_info])
-        
-        # Calculate cosine similarities between query and knowledge base
-        cos_scores = util.cos_sim(query_embedding, self.knowledge_embeddings)[0]
-        
-        # Get top-k most similar knowledge items
-        top_results = torch.topk(cos_scores, k=min(top_k, len(cos_scores)))
-        
-        retrieved_knowledge = []
-        for score, idx in zip(top_results[0], top_results[1]):
-            retrieved_knowledge.append({
-                "text": self.knowledge_texts[idx],
-                "source": self.knowledge_base[idx]["source"],
-                "score": score.item()
-            })
-        
-        # Filter for relevance - ensure at least one knowledge item is related to the query or patient condition
-        if query.lower() not in ' '.join([k['text'].lower() for k in retrieved_knowledge]):
-            # Try to find additional knowledge related specifically to the query
-            query_specific = self.embed_texts([query])
-            query_scores = util.cos_sim(query_specific, self.knowledge_embeddings)[0]
-            query_results = torch.topk(query_scores, k=min(2, len(query_scores)))
-            
-            for score, idx in zip(query_results[0], query_results[1]):
-                # Only add if it's not already in the list
-                if not any(k['text'] == self.knowledge_texts[idx] for k in retrieved_knowledge):
-                    retrieved_knowledge.append({
-                        "text": self.knowledge_texts[idx],
-                        "source": self.knowledge_base[idx]["source"],
-                        "score": score.item()
-                    })
-        
-        return retrieved_knowledge
+        """Retrieve relevant knowledge based on query and patient data.
+
+        Dense search for the query blended with the patient's profile and
+        BM25 over the query itself are fused with reciprocal rank fusion, so knowledge that
+        shares the query's terms is found without a second embedding search.
+        """
+        return self.retrieve_cohort_knowledge(query, [patient], top_k)[0]
     
-    def generate_response(self, query: str, patient: Dict[str, Any]) -> str:
+    def retrieve_cohort_knowledge(self, query: str, patients: List[Dict[str, Any]], top_k=3) -> List[List[Dict[str, Any]]]:
+        """retrieve_relevant_knowledge for many patients at once.
+
+        The query is embedded once and the dense search for every patient
+        runs as a single matrix search; BM25 is only re-run for patients
+        whose own conditions or medications are named in the query.
+        """
+        knowledge = self.knowledge
+        candidates = max(top_k, self.RETRIEVAL_CANDIDATES)
+        
+        # Dense candidates: the query vector blended with the cached patient profile
+        # vector stands in for embedding "<query> for a <age> year old ..." each time
+        with span("embed_query"):
+            query_embedding = self.embedding_service.encode([query])[0]
+        with span("patient_profile"):
+            profiles = self.patient_profiles.get_many(patients)
+        with span("dense_search"):
+            query_vectors = np.stack([profile.query_vector(query_embedding, PROFILE_QUERY_WEIGHT) for profile in profiles])
+            scores, ids = knowledge.index.search(query_vectors, candidates)
+        
+        query_tokens = tokenize(query)
+        shared_lexical = None
+        lexical_lists = []
+        with span("lexical_search"):
+            for profile in profiles:
+                # Lexical candidates for the query, weighting the patient's own conditions and medications
+                weights = profile.term_weights(query_tokens)
+                if weights:
+                    lexical_lists.append([idx for idx, _ in knowledge.lexical.search(query, candidates, weights)])
+                else:
+                    if shared_lexical is None:
+                        shared_lexical = [idx for idx, _ in knowledge.lexical.search(query, candidates)]
+                    lexical_lists.append(shared_lexical)
+        
+        results = []
+        with span("fuse"):
+            for i, lexical in enumerate(lexical_lists):
+                dense = {int(idx): float(score) for score, idx in zip(scores[i], ids[i]) if idx >= 0}
+                results.append(self._fuse_results(knowledge, query_vectors[i], dense, lexical, top_k))
+        return results
+    
+    def _fuse_results(self, knowledge: KnowledgeSnapshot, query_vector: np.ndarray, dense: Dict[int, float],
+                      lexical: List[int], top_k: int) -> List[Dict[str, Any]]:
+        selected = [idx for idx, _ in reciprocal_rank_fusion([list(dense), lexical])[:top_k]]
+        
+        # Filter for relevance - ensure at least one knowledge item shares the query's terms
+        if lexical and not set(selected) & set(lexical):
+            selected += [idx for idx in lexical[:2] if idx not in selected]
+        
+        # Items found only lexically get their cosine similarity for the relevance display
+        lexical_only = [idx for idx in selected if idx not in dense]
+        if lexical_only:
+            vectors = knowledge.index.reconstruct(lexical_only)
+            norms = np.linalg.norm(vectors, axis=1)
+            norms[norms == 0] = 1.0
+            dense = {**dense, **dict(zip(lexical_only, (vectors @ query_vector / norms).tolist()))}
+        
+        return [
+            {
+                "text": knowledge.texts[idx],
+                "source": knowledge.items[idx]["source"],
+                "score": dense[idx],
+            }
+            for idx in selected
+        ]
+    
+    def prepare_context(self, query: str, patient: Dict[str, Any]):
+        """Retrieve knowledge and build the prompt context; returns (relevant_knowledge, context)"""
         # Retrieve relevant medical knowledge based on both query and patient data
         relevant_knowledge = self.retrieve_relevant_knowledge(query, patient)
         
         # Format the context for the response
-        context = self._build_context(query, patient, relevant_knowledge)
+        with span("build_context"):
+            context = self._build_context(query, patient, relevant_knowledge)
+        return relevant_knowledge, context
+    
+    def prepare_cohort(self, query: str, patients: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Cache lookups, retrieval and prompts for one query across many patients.
+
+        Returns one dict per patient with ``patient``, ``cached`` (a cached
+        response or None), ``cache_key``, ``relevant_knowledge`` and
+        ``prompt`` (None when the response is cached).
+        """
+        prepared = []
+        for patient in patients:
+            cached, cache_key = self.check_response_cache(query, patient)
+            prepared.append({"patient": patient, "cached": cached, "cache_key": cache_key,
+                             "relevant_knowledge": None, "prompt": None})
+        
+        uncached = [item for item in prepared if item["cached"] is None]
+        if uncached:
+            knowledge_lists = self.retrieve_cohort_knowledge(query, [item["patient"] for item in uncached])
+            with span("build_context"):
+                for item, relevant_knowledge in zip(uncached, knowledge_lists):
+                    context = self._build_context(query, item["patient"], relevant_knowledge)
+                    item["relevant_knowledge"] = relevant_knowledge
+                    item["prompt"] = self._build_prompt(context, query, item["patient"])
+        return prepared
+    
+    def check_response_cache(self, query: str, patient: Dict[str, Any]):
+        """Look a query up in the response cache; returns (cached_response, cache_key)"""
+        if self.response_cache is None:
+            return None, None
+        with span("cache_lookup"):
+            query_embedding = self.embedding_service.encode([query])[0]
+            fingerprint = patient_fingerprint(patient)
+            # Read the generation first so a reload during generation discards the result
+            cache_key = (patient.get("id"), fingerprint, query_embedding, self.response_cache.generation)
+            cached = self.response_cache.lookup(patient.get("id"), fingerprint, query_embedding)
+        RESPONSE_CACHE_LOOKUPS.inc(result="miss" if cached is None else "hit")
+        return cached, cache_key
+    
+    def store_cached_response(self, cache_key, query: str, response: str):
+        if cache_key is None:
+            return
+        patient_id, fingerprint, query_embedding, generation = cache_key
+        self.response_cache.store(patient_id, fingerprint, query, query_embedding, response, generation)
+    
+    def invalidate_patient(self, patient_id: int):
+        """Forget cached responses and the profile of a patient whose record changed"""
+        self.patient_profiles.invalidate(patient_id)
+        if self.response_cache is not None:
+            self.response_cache.invalidate_patient(patient_id)
+    
+    def refresh_patient(self, patient: Dict[str, Any]):
+        """Rebuild a created or updated patient's profile and drop its cached responses"""
+        self.invalidate_patient(patient["id"])
+        self.patient_profiles.refresh(patient)
+    
+    def generate_response(self, query: str, patient: Dict[str, Any]) -> str:
+        cached, cache_key = self.check_response_cache(query, patient)
+        if cached is not None:
+            return cached
+        
+        relevant_knowledge, context = self.prepare_context(query, patient)
         
         # Generate response using LLM or fallback to mock response
         if self.llm is not None:
             try:
-                response = self._generate_llm_response(context, query, patient)
+                with span("generate"):
+                    response = self.record_generation(self._generate_llm_response(context, query, patient))
+                self.store_cached_response(cache_key, query, response)
+                return response
+            except Exception as e:
+                print(f"Error generating LLM response: {e}")
+                print("Falling back to mock response")
+                LLM_FALLBACKS.inc(path="sync")
+                return self._generate_mock_response(query, patient, relevant_knowledge)
+        else:
+            with span("mock_response"):
+                response = self._generate_mock_response(query, patient, relevant_knowledge)
+            self.store_cached_response(cache_key, query, response)
+            return response
+    
+    async def generate_response_async(self, query: str, patient: Dict[str, Any]) -> str:
+        """Same as generate_response, without blocking the event loop.
+
+        Retrieval runs in a worker thread and generation is queued on the
+        batching scheduler, so concurrent requests share forward passes.
+        """
+        cached, cache_key = await asyncio.to_thread(self.check_response_cache, query, patient)
+        if cached is not None:
+            return cached
+        
+        relevant_knowledge, context = await asyncio.to_thread(self.prepare_context, query, patient)
+        
+        if self.inference_scheduler is not None:
+            try:
+                prompt = self._build_prompt(context, query, patient)
+                # Includes the time spent queued for a batch
+                with span("generate"):
+                    response = self.record_generation(await self.inference_scheduler.submit(prompt))
+                self.store_cached_response(cache_key, query, response)
                 return response
             except Exception as e:
                 print(f"Error generating LLM response: {e}")
                 print("Falling back to mock response")
+                LLM_FALLBACKS.inc(path="async")
                 return self._generate_mock_response(query, patient, relevant_knowledge)
+        with span("mock_response"):
+            response = self._generate_mock_response(query, patient, relevant_knowledge)
+        self.store_cached_response(cache_key, query, response)
+        return response
+    
+    def stream_response(self, query: str, patient: Dict[str, Any]) -> Iterator[str]:
+        """Yield the response text in chunks as the model produces them.
+
+        The chunks concatenate to the same text generate_response would
+        return, including the disclaimer. Closing the iterator early stops
+        the generation. Each stream runs its own generation, so callers
+        serving many users hold a ``stream_slots`` slot while iterating.
+        """
+        cached, cache_key = self.check_response_cache(query, patient)
+        if cached is not None:
+            yield cached
+            return
+        
+        relevant_knowledge, context = self.prepare_context(query, patient)
+        if self.llm is None:
+            with span("mock_response"):
+                response = self._generate_mock_response(query, patient, relevant_knowledge)
+            self.store_cached_response(cache_key, query, response)
+            yield response
+            return
+        
+        prompt = self._build_prompt(context, query, patient)
+        tokenizer = self.llm.tokenizer
+        model = self.llm.model
+        if self.prefix_cache is not None and prompt.startswith(self.prefix_cache.prefix):
+            inputs = self.prefix_cache.generate_inputs([prompt[len(self.prefix_cache.prefix):]])
         else:
-            return self._generate_mock_response(query, patient, relevant_knowledge)
+            inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+        PROMPT_TOKENS.observe(inputs["input_ids"].shape[1])
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        cancelled = threading.Event()
+        generation_kwargs = {k: v for k, v in self.GENERATION_CONFIG.items() if k != "num_return_sequences"}
+        errors = []
+        outputs = []
+        
+        def generate():
+            try:
+                outputs.append(model.generate(
+                    **inputs,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([_StopOnEvent(cancelled)]),
+                    pad_token_id=tokenizer.pad_token_id,
+                    **generation_kwargs,
+                ))
+            except Exception as e:
+                errors.append(e)
+                # Unblock the consumer
+                streamer.on_finalized_text("", stream_end=True)
+        
+        thread = threading.Thread(target=generate, name="llm-stream", daemon=True)
+        thread.start()
+        
+        response_filter = _ResponseStreamFilter()
+        chunks = []
+        try:
+            for text in streamer:
+                chunk = response_filter.feed(text)
+                if chunk:
+                    chunks.append(chunk)
+                    yield chunk
+        finally:
+            cancelled.set()
+            # The model stops at its next token; wait for that, so the caller's
+            # stream slot is not freed while this generation still runs
+            thread.join(STREAM_STOP_TIMEOUT_S)
+        thread.join()
+        if outputs:
+            GENERATED_TOKENS.observe(outputs[0].shape[1] - inputs["input_ids"].shape[1])
+        
+        if errors:
+            if chunks:
+                raise errors[0]
+            print(f"Error generating LLM response: {errors[0]}")
+            print("Falling back to mock response")
+            LLM_FALLBACKS.inc(path="stream")
+            yield self._generate_mock_response(query, patient, relevant_knowledge)
+            return
+        
+        tail = response_filter.finish()
+        if tail:
+            chunks.append(tail)
+            yield tail
+        yield DISCLAIMER
+        self.store_cached_response(cache_key, query, "".join(chunks) + DISCLAIMER)
     
     def _build_context(self, query: str, patient: Dict[str, Any], relevant_knowledge: List[Dict[str, Any]]) -> str:
         """Build the context for the LLM prompt with detailed patient information"""
-        # Patient information section with detailed format
-        context = f"""Patient Information:
-- Name: {patient['name']}
-- Age: {patient['age']} years
-- Gender: {patient['gender']}
-- Blood Group: {patient['bloodGroup']}
-- Medical History: {', '.join(patient['medicalHistory'])}
-- Current Medications: {', '.join(patient['medications'])}
-
+        # Patient information section, formatted once per patient record
+        profile = self.patient_profiles.get(patient)
+        context = f"""{profile.header}
 Current Query: "{query}"
 
 """
         
-        # Check if any medical history items are related to the query
-        query_lower = query.lower()
-        related_conditions = [condition for condition in patient['medicalHistory'] 
-                             if query_lower in condition.lower() or any(word in condition.lower() 
-                                                                       for word in query_lower.split())]
+        # Check if any medical history items share a term with the query
+        query_terms = content_tokens(query)
+        related_conditions = [condition for condition, terms in profile.condition_terms if terms & query_terms]
         
         if related_conditions:
             context += f"Note: Patient has relevant medical history of: {', '.join(related_conditions)}\n\n"
         
         # Check if any medications might be related to the query
-        related_meds = [med for med in patient['medications'] 
-                        if any(word in med.lower() for word in query_lower.split())]
+        related_meds = [med for med, terms in profile.medication_terms if terms & query_terms]
         
         if related_meds:
             context += f"Note: Patient is taking medications that may be relevant: {', '.join(related_meds)}\n\n"
@@ -174,57 +650,110 @@ Current Query: "{query}"
         # Sort knowledge by relevance score
         sorted_knowledge = sorted(relevant_knowledge, key=lambda x: x['score'], reverse=True)
         
+        # Snippets are added in relevance order while the prompt stays within PROMPT_MAX_TOKENS;
+        # the first one that does not fit is shortened, the rest are dropped
+        budget = (PROMPT_MAX_TOKENS - self._count_tokens(STATIC_PROMPT_PREFIX)
+                  - self._count_tokens(self._prompt_body(context, query, patient)))
         for i, knowledge in enumerate(sorted_knowledge, 1):
             relevance = int(knowledge['score'] * 100)
-            context += f"{i}. {knowledge['text']} (Relevance: {relevance}%, Source: {knowledge['source']})\n"
+            line = f"{i}. {knowledge['text']} (Relevance: {relevance}%, Source: {knowledge['source']})\n"
+            tokens = self._count_tokens(line)
+            if tokens > budget:
+                overhead = tokens - self._count_tokens(knowledge['text'])
+                if budget - overhead >= MIN_SNIPPET_TOKENS:
+                    text = self._truncate_tokens(knowledge['text'], budget - overhead - 1)
+                    context += f"{i}. {text}... (Relevance: {relevance}%, Source: {knowledge['source']})\n"
+                break
+            context += line
+            budget -= tokens
         
         return context
     
-    def _generate_llm_response(self, context: str, query: str, patient: Dict[str, Any]) -> str:
-        """Generate a response using the language model with patient-specific guidance"""
-        
-        # Construct the prompt with specific instructions for patient-centered response
-        prompt = f"""You are an AI clinical decision support system designed to help healthcare professionals.
-Based on the following patient information and medical knowledge, provide a concise and evidence-based response to the clinical query.
-
-{context}
-
+    def _count_tokens(self, text: str) -> int:
+        if self.llm is None:
+            # No tokenizer without the LLM; about four characters per token in English
+            return len(text) // 4 + 1
+        return len(self.llm.tokenizer(text, add_special_tokens=False)["input_ids"])
+    
+    def _truncate_tokens(self, text: str, max_tokens: int) -> str:
+        """The start of ``text``, at most ``max_tokens`` long and cut at a word boundary"""
+        if self.llm is None:
+            truncated = text[:max_tokens * 4]
+        else:
+            ids = self.llm.tokenizer(text, add_special_tokens=False)["input_ids"][:max_tokens]
+            truncated = self.llm.tokenizer.decode(ids)
+        if len(truncated) < len(text) and " " in truncated:
+            truncated = truncated.rsplit(" ", 1)[0]
+        return truncated.rstrip(" ,;:")
+    
+    def _build_prompt(self, context: str, query: str, patient: Dict[str, Any]) -> str:
+        """Construct the prompt with specific instructions for patient-centered response"""
+        prompt = STATIC_PROMPT_PREFIX + self._prompt_body(context, query, patient)
+        PROMPT_CHARS.observe(len(prompt))
+        return prompt
+    
+    def _prompt_body(self, context: str, query: str, patient: Dict[str, Any]) -> str:
+        """The part of the prompt after STATIC_PROMPT_PREFIX"""
+        return f"""{context}
 Clinical Query: {query}
-
-Instructions:
-1. Directly address the query "{query}" in relation to this specific patient ({patient['name']}, {patient['age']}y, {patient['gender']}).
-2. Consider the patient's specific medical history, medications, and other factors that may influence your recommendations.
-3. Highlight any potential interactions between the query and the patient's existing conditions or medications.
-4. Reference the medical knowledge provided and explain its relevance to this specific patient.
-5. Structure your response with clear, actionable recommendations where appropriate.
-6. Avoid generic responses that could apply to any patient.
+Address "{query}" for this specific patient ({patient['name']}, {patient['age']}y, {patient['gender']}).
 
 Response:"""
-        
-        # Generate response
-        generation_config = {
-            "max_new_tokens": 512,
-            "temperature": 0.3,
-            "top_p": 0.9,
-            "do_sample": True,
-            "num_return_sequences": 1,
-        }
-        
-        generated_texts = self.llm(
-            prompt,
-            **generation_config
-        )
-        
-        # Extract generated text
-        response_text = generated_texts[0]["generated_text"]
-        
+    
+    def _generate_llm_response(self, context: str, query: str, patient: Dict[str, Any]) -> Generation:
+        """Generate a response using the language model with patient-specific guidance"""
+        prompt = self._build_prompt(context, query, patient)
+        return self.generate_batch([prompt])[0]
+    
+    def generate_batch(self, prompts: List[str]) -> List[Generation]:
+        """Generate responses for several prompts in one batched forward pass.
+
+        Under serve.py this runs in the inference processes, which are not
+        scraped, so token counts are returned with each response and
+        recorded by the caller (record_generation).
+        """
+        tokenizer = self.llm.tokenizer
+        model = self.llm.model
+        prefix_cache = self.prefix_cache
+        if prefix_cache is not None and all(prompt.startswith(prefix_cache.prefix) for prompt in prompts):
+            # Only the tokens after the shared instruction block are prefilled
+            inputs = prefix_cache.generate_inputs([prompt[len(prefix_cache.prefix):] for prompt in prompts])
+        else:
+            encoded = tokenizer(prompts, return_tensors="pt", padding=True)
+            inputs = {
+                "input_ids": encoded["input_ids"].to(model.device),
+                "attention_mask": encoded["attention_mask"].to(model.device),
+            }
+        with torch.no_grad():
+            output = model.generate(**inputs, pad_token_id=tokenizer.pad_token_id, **self.GENERATION_CONFIG)
+        
+        new_tokens = output[:, inputs["input_ids"].shape[1]:]
+        continuations = tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+        # Counted from the tensors at hand: padding is masked out of the prompts
+        # and fills the rows that finished early
+        prompt_tokens = inputs["attention_mask"].sum(dim=1).tolist()
+        generated_tokens = (new_tokens != tokenizer.pad_token_id).sum(dim=1).tolist()
+        return [
+            Generation(self._postprocess_response(prompt + continuation), prompt_length, generated)
+            for prompt, continuation, prompt_length, generated
+            in zip(prompts, continuations, prompt_tokens, generated_tokens)
+        ]
+    
+    @staticmethod
+    def record_generation(generation: Generation) -> str:
+        """Record a generation's token counts in this process's metrics and return its text"""
+        PROMPT_TOKENS.observe(generation.prompt_tokens)
+        GENERATED_TOKENS.observe(generation.generated_tokens)
+        return generation.text
+    
+    def _postprocess_response(self, response_text: str) -> str:
+        """Keep only the answer after "Response:" and append the disclaimer"""
         # Extract only the part after "Response:"
         if "Response:" in response_text:
             response_text = response_text.split("Response:")[1].strip()
         
         # Add disclaimer
-        response_text += "\n\nDisclaimer: This is an AI-generated response for educational purposes. "
-        response_text += "Always verify information with current medical literature and clinical judgment."
+        response_text += DISCLAIMER
         
         return response_text
     
@@ -239,13 +768,16 @@ Response:"""
         
         # Check if the query contains certain keywords and match to knowledge
         query_lower = query.lower()
+        profile = self.patient_profiles.get(patient)
+        conditions = profile.conditions
+        mentioned_conditions = conditions.find(tokenize(query))
         
-        if any(condition.lower() in query_lower for condition in patient['medicalHistory']):
+        if mentioned_conditions:
             # Query is about the patient's existing conditions
-            condition = next((c for c in patient['medicalHistory'] if c.lower() in query_lower), None)
+            condition = mentioned_conditions[0]
             if condition:
                 relevant_info = next((k for k in relevant_knowledge 
-                                     if condition.lower() in k['text'].lower()), None)
+                                     if condition in conditions.find(tokenize(k['text']))), None)
                 if relevant_info:
                     response += f", regarding their {condition}:\n\n{relevant_info['text']}\n\n"
                     response += f"Reference: {relevant_info['source']}"
@@ -262,8 +794,7 @@ Response:"""
                 response += f"The patient is currently taking: {', '.join(patient['medications'])}.\n\n"
                 
                 med_info = next((k for k in relevant_knowledge 
-                                if any(med.lower() in k['text'].lower() 
-                                      for med in patient['medications'])), None)
+                                if profile.medications.find(tokenize(k['text']))), None)
                 
                 if med_info:
                     response += f"Relevant information: {med_info['text']}\n\n"
@@ -297,7 +828,6 @@ Response:"""
                 response += "Consider consulting the latest clinical guidelines or providing more details."
         
         # Add disclaimer
-        response += "\n\nDisclaimer: This is an AI-generated response for educational purposes. "
-        response += "Always verify information with current medical literature and clinical judgment."
+        response += DISCLAIMER
         
         return response 
\ No newline at end of file
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+# Patient fields that _build_context puts into the prompt
+CONTEXT_FIELDS = ("name", "age", "gender", "bloodGroup", "medicalHistory", "medications")
+
+
+def patient_fingerprint(patient: Dict[str, Any]) -> str:
+    """Stable hash of the patient fields that shape a response"""
+    state = {field: patient.get(field) for field in CONTEXT_FIELDS}
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("key", "query", "embedding", "response", "expires_at", "size")
+
+    def __init__(self, key, query, embedding, response, expires_at):
+        self.key = key
+        self.query = query
+        self.embedding = embedding
+        self.response = response
+        self.expires_at = expires_at
+        # Rough footprint: text, vector and per-entry bookkeeping
+        self.size = len(query.encode("utf-8")) + len(response.encode("utf-8")) + embedding.nbytes + 256
+
+
+class SemanticResponseCache:
+    """LRU/TTL cache of generated responses, matched by query similarity.
+
+    Entries are grouped by ``(patient_id, patient_fingerprint)``. A lookup is
+    a hit when a cached query for the same patient state has a cosine
+    similarity of at least ``similarity_threshold`` with the new query, so
+    "metformin dosing" and "dose of metformin?" can share one generation.
+
+    Memory is bounded by ``max_entries`` and ``max_bytes`` (least recently
+    used entries go first) and entries expire after ``ttl_seconds``.
+    ``generation`` is bumped by ``clear()``; responses computed against an
+    older generation (e.g. before a knowledge reload) are not stored.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.92, max_entries: int = 2048,
+                 max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 3600):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: Dict[tuple, Dict[int, _Entry]] = {}
+        self._next_id = 0
+        self._bytes = 0
+        self._counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    @staticmethod
+    def _normalise(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, patient_id: int, fingerprint: str, query_embedding) -> Optional[str]:
+        """Return the cached response for the most similar query, if similar enough"""
+        query_vector = self._normalise(query_embedding)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get((patient_id, fingerprint))
+            best, best_score = None, self.similarity_threshold
+            if bucket:
+                for entry_id, entry in list(bucket.items()):
+                    if entry.expires_at <= now:
+                        self._remove(entry_id)
+                        self._counters["expirations"] += 1
+                        continue
+                    score = float(entry.embedding @ query_vector)
+                    if score >= best_score:
+                        best, best_score = entry_id, score
+            if best is None:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(best)
+            self._counters["hits"] += 1
+            return self._entries[best].response
+
+    def store(self, patient_id: int, fingerprint: str, query: str, query_embedding,
+              response: str, generation: Optional[int] = None):
+        """Cache a response unless the cache was cleared since ``generation`` was read"""
+        entry = _Entry((patient_id, fingerprint), query, self._normalise(query_embedding), response,
+                       time.monotonic() + self.ttl_seconds)
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            self._buckets.setdefault(entry.key, {})[entry_id] = entry
+            self._bytes += entry.size
+            self._counters["stores"] += 1
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._counters["evictions"] += 1
+
+    def invalidate_patient(self, patient_id: int):
+        """Drop every cached response for a patient, whatever its fingerprint"""
+        with self._lock:
+            for key in [key for key in self._buckets if key[0] == patient_id]:
+                for entry_id in list(self._buckets[key]):
+                    self._remove(entry_id)
+                    self._counters["invalidations"] += 1
+
+    def clear(self):
+        """Drop everything, e.g. after the knowledge base is reloaded"""
+        with self._lock:
+            self._counters["invalidations"] += len(self._entries)
+            self._entries.clear()
+            self._buckets.clear()
+            self._bytes = 0
+            self.generation += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "hit_rate": self._counters["hits"] / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "similarity_threshold": self.similarity_threshold,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+    def _remove(self, entry_id: int):
+        # Caller holds _lock
+        entry = self._entries.pop(entry_id)
+        bucket = self._buckets[entry.key]
+        del bucket[entry_id]
+        if not bucket:
+            del self._buckets[entry.key]
+        self._bytes -= entry.size
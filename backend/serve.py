@@ -0,0 +1,293 @@
+"""Production server: load the models once and fork workers that share them.
+
+    python serve.py --workers 4 --threads 1 --inference-procs 1
+
+The master process builds the RAG system (embedding model, knowledge index
+and LLM) and then forks:
+
+- ``--inference-procs`` dedicated LLM processes. Every HTTP worker sends its
+  prompts to them, so batches fill up across workers instead of each worker
+  batching only its own requests. With 0 each worker generates by itself.
+- ``--workers`` HTTP workers accepting on one shared socket.
+
+Children get the weights and the knowledge index copy-on-write, so they stay
+shared as long as nobody writes to them; ``gc.freeze`` keeps the garbage
+collector from touching (and so copying) the objects loaded before the fork.
+
+Signals to the master: SIGHUP re-ingests the knowledge base and replaces the
+HTTP workers one at a time (each old worker finishes its open requests);
+SIGTERM or SIGINT stops everything. Workers that die are restarted.
+
+The forked children cannot use CUDA, so this is for CPU serving; on a GPU
+host run ``python main.py``.
+"""
+import argparse
+import asyncio
+import gc
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from multiprocessing.connection import wait
+
+import torch
+import uvicorn
+
+from config import (
+    SERVE_HOST, SERVE_PORT, SERVE_WORKERS, SERVE_THREADS, INFERENCE_PROCESSES, INFERENCE_THREADS, INFERENCE_TIMEOUT_S,
+    SERVE_GRACEFUL_TIMEOUT_S, INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_MS,
+)
+from inference import InferenceClient, serve_inference_requests
+from rag import RAGSystem
+
+# Seconds a new worker gets to start accepting before a reload gives up on it
+WORKER_START_TIMEOUT_S = 60
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_inference_process(rag_system: RAGSystem, threads: int, connections, started_at: float):
+    # Replace the master's handlers; the master coordinates shutdown
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    torch.set_num_threads(threads)
+    serve_inference_requests(rag_system.generate_batch, connections,
+                             INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_MS, started_at)
+
+
+def run_worker(rag_system: RAGSystem, sock: socket.socket, threads: int, graceful_timeout: int,
+               connections, ready):
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    torch.set_num_threads(threads)
+    client = InferenceClient(connections, INFERENCE_TIMEOUT_S) if connections else None
+    rag_system.after_fork(client)
+
+    # Imported after the fork: the patient and chat stores open their
+    # database connections and threads per process
+    import main
+    main.model_loader.factory = lambda: rag_system
+    main.supervisor_pid = os.getppid()
+    main.model_loader.wait()
+
+    config = uvicorn.Config(main.app, timeout_graceful_shutdown=graceful_timeout)
+    server = uvicorn.Server(config)
+
+    async def serve():
+        task = asyncio.create_task(server.serve(sockets=[sock]))
+        while not server.started and not task.done():
+            await asyncio.sleep(0.05)
+        ready.set()
+        await task
+
+    asyncio.run(serve())
+
+
+class Supervisor:
+    """Forks and watches the inference processes and HTTP workers"""
+
+    def __init__(self, rag_system: RAGSystem, sock: socket.socket, workers: int, threads: int,
+                 inference_procs: int, inference_threads: int, graceful_timeout: int):
+        self.rag_system = rag_system
+        self.sock = sock
+        self.n_workers = workers
+        self.threads = threads
+        self.inference_threads = inference_threads
+        self.graceful_timeout = graceful_timeout
+        self.ctx = multiprocessing.get_context("fork")
+
+        # Without an LLM there is nothing to generate remotely
+        self.n_inference = inference_procs if rag_system.llm is not None else 0
+        # A pipe between every inference process and worker slot, so each end is only
+        # ever read by one process. A slot is reused only once its previous worker has
+        # exited, and a reload retires every worker while its replacement starts, so
+        # there are two slots per worker.
+        self.n_slots = 2 * workers
+        self.pipes = [[self.ctx.Pipe() for _ in range(self.n_slots)] for _ in range(self.n_inference)]
+
+        self.inference = {}  # index -> process
+        self.workers = {}  # slot -> process
+        self.retiring = {}  # slot -> process finishing its open requests
+        self.stopping = False
+        self.reload_requested = False
+
+    def spawn_inference(self, index: int):
+        process = self.ctx.Process(
+            target=run_inference_process,
+            args=(self.rag_system, self.inference_threads, [inference_end for _, inference_end in self.pipes[index]],
+                  time.time()),
+            name=f"cdss-inference-{index}", daemon=False,
+        )
+        process.start()
+        process.started_at = time.monotonic()
+        self.inference[index] = process
+        print(f"Started inference process {index} (pid {process.pid})")
+
+    def spawn_worker(self, slot: int):
+        ready = self.ctx.Event()
+        process = self.ctx.Process(
+            target=run_worker,
+            args=(self.rag_system, self.sock, self.threads, self.graceful_timeout,
+                  [pipes[slot][0] for pipes in self.pipes], ready),
+            name=f"cdss-worker-{slot}", daemon=False,
+        )
+        process.start()
+        process.started_at = time.monotonic()
+        self.workers[slot] = process
+        print(f"Started worker {slot} (pid {process.pid})")
+        return process, ready
+
+    def free_slot(self) -> int:
+        """A slot with no live or retiring worker, waiting for a retiring worker to exit if needed"""
+        while True:
+            self.reap_retiring()
+            for slot in range(self.n_slots):
+                if slot not in self.workers and slot not in self.retiring:
+                    return slot
+            wait([p.sentinel for p in self.retiring.values()], timeout=1.0)
+
+    def retire(self, slot: int):
+        """Stop the worker in ``slot``; the slot stays taken until it has exited"""
+        process = self.workers.pop(slot)
+        process.terminate()
+        process.retire_deadline = time.monotonic() + self.graceful_timeout + 5
+        self.retiring[slot] = process
+
+    def reap_retiring(self):
+        for slot, process in list(self.retiring.items()):
+            if process.is_alive() and time.monotonic() > process.retire_deadline:
+                print(f"Retiring worker {slot} (pid {process.pid}) did not stop; killing it")
+                process.kill()
+            if not process.is_alive():
+                process.join()
+                del self.retiring[slot]
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        signal.signal(signal.SIGHUP, self._request_reload)
+
+        for index in range(self.n_inference):
+            self.spawn_inference(index)
+        for slot in range(self.n_workers):
+            self.spawn_worker(slot)
+
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+            processes = list(self.inference.values()) + list(self.workers.values()) + list(self.retiring.values())
+            wait([p.sentinel for p in processes], timeout=1.0)
+            self.reap()
+        self.shutdown()
+
+    def reap(self):
+        self.reap_retiring()
+        for table, spawn, kind in ((self.inference, self.spawn_inference, "Inference process"),
+                                   (self.workers, self.spawn_worker, "Worker")):
+            for key, process in list(table.items()):
+                if process.is_alive() or self.stopping:
+                    continue
+                print(f"{kind} {key} (pid {process.pid}) exited with code {process.exitcode}; restarting")
+                del table[key]
+                # Do not spin if it dies straight away
+                if time.monotonic() - process.started_at < 1.0:
+                    time.sleep(1.0)
+                spawn(key)
+
+    def reload(self):
+        """Pick up knowledge changes and replace the HTTP workers one at a time"""
+        print("Reloading: re-ingesting the knowledge base")
+        try:
+            print(f"Knowledge reloaded: {self.rag_system.reload_knowledge()}")
+        except Exception as e:
+            print(f"Knowledge reload failed, keeping the current workers: {e}")
+            return
+        # New workers are forked from the updated master; freeze what the reload allocated
+        gc.collect()
+        gc.freeze()
+        for slot in list(self.workers):
+            if self.stopping:
+                return
+            new_slot = self.free_slot()
+            process, ready = self.spawn_worker(new_slot)
+            if not ready.wait(WORKER_START_TIMEOUT_S):
+                print(f"Replacement worker (pid {process.pid}) did not start; keeping worker {slot}")
+                self.retire(new_slot)
+                continue
+            # The old worker stops accepting and finishes its open requests
+            self.retire(slot)
+        print("Reload complete")
+
+    def shutdown(self):
+        print("Shutting down workers...")
+        children = list(self.workers.values()) + list(self.retiring.values())
+        for process in children:
+            process.terminate()
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        for process in children:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+        # Inference processes hold no state worth waiting for
+        for process in self.inference.values():
+            process.terminate()
+            process.join(10)
+            if process.is_alive():
+                process.kill()
+        print("Stopped")
+
+    def _request_stop(self, signum, frame):
+        self.stopping = True
+
+    def _request_reload(self, signum, frame):
+        self.reload_requested = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=SERVE_HOST)
+    parser.add_argument("--port", type=int, default=SERVE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS, help="HTTP worker processes")
+    parser.add_argument("--threads", type=int, default=SERVE_THREADS, help="torch threads per HTTP worker")
+    parser.add_argument("--inference-procs", type=int, default=INFERENCE_PROCESSES,
+                        help="dedicated LLM processes (0 generates in each worker)")
+    parser.add_argument("--inference-threads", type=int, default=INFERENCE_THREADS,
+                        help="torch threads per inference process")
+    parser.add_argument("--graceful-timeout", type=int, default=SERVE_GRACEFUL_TIMEOUT_S,
+                        help="seconds a stopping worker gets to finish open requests")
+    args = parser.parse_args()
+
+    if torch.cuda.is_available():
+        raise SystemExit("serve.py forks after loading the models, which CUDA does not support. "
+                         "Use `python main.py` on GPU hosts, or set CUDA_VISIBLE_DEVICES= to serve on CPU.")
+
+    # A forked child hangs in its first parallel op if the parent has started
+    # an OpenMP thread pool, so the master loads with a single thread and each
+    # child sets its own thread count. Same for the tokenizers' thread pool.
+    torch.set_num_threads(1)
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+    start = time.monotonic()
+    rag_system = RAGSystem()
+    print(f"Models loaded in {time.monotonic() - start:.1f}s; forking workers")
+    gc.collect()
+    gc.freeze()
+
+    sock = bind_socket(args.host, args.port)
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} workers")
+    Supervisor(rag_system, sock, args.workers, args.threads, args.inference_procs,
+               args.inference_threads, args.graceful_timeout).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+import copy
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+def _as_matrix(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    return vectors
+
+
+def _inverse_norms(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(np.asarray(vectors, dtype=np.float32), axis=1)
+    with np.errstate(divide="ignore"):
+        inverse = np.where(norms > 0, 1.0 / norms, 0.0)
+    return inverse.astype(np.float32)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k largest scores, best first"""
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def _kmeans(data: np.ndarray, n_clusters: int, n_iter: int, seed: int, spherical: bool) -> np.ndarray:
+    """Plain Lloyd's k-means; spherical mode clusters unit vectors by inner product"""
+    rng = np.random.default_rng(seed)
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    centroids = data[rng.choice(len(data), size=n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        if spherical:
+            assignment = np.argmax(data @ centroids.T, axis=1)
+        else:
+            assignment = np.argmax(data @ centroids.T - 0.5 * (centroids ** 2).sum(axis=1), axis=1)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        filled = counts > 0
+        order = np.argsort(assignment, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        centroids[filled] = np.add.reduceat(data[order], starts, axis=0) / counts[filled, None]
+        # Re-seed empty clusters from random points so every centroid stays useful
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), size=len(empty), replace=False)]
+        if spherical:
+            centroids *= _inverse_norms(centroids)[:, None]
+    return centroids.astype(np.float32)
+
+
+# Rows converted to float32 at a time when searching float16 vectors
+BLOCK_ROWS = 8192
+
+
+def _float32_blocks(vectors: np.ndarray, block_rows: int = BLOCK_ROWS) -> Iterator[Tuple[int, np.ndarray]]:
+    """(start, float32 block) pairs covering ``vectors``, without copying float32 input"""
+    if vectors.dtype == np.float32:
+        yield 0, vectors
+        return
+    for start in range(0, len(vectors), block_rows):
+        yield start, vectors[start:start + block_rows].astype(np.float32)
+
+
+class _VectorStorage:
+    """Growable id -> vector table with O(1) swap-remove.
+
+    The first batch of float32 or float16 vectors is referenced rather than
+    copied, so a memory-mapped embedding file stays shared until the index
+    is modified. Vectors are stored in the dtype of that batch (float32 for
+    anything else); ``dot`` and ``gather`` always compute in float32,
+    converting float16 rows a block at a time.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.size = 0
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.inverse_norms = np.zeros(0, dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.rows: Dict[int, int] = {}
+        # False while ``vectors`` is a caller-owned array we must not write to
+        self.owned = True
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        duplicates = [int(i) for i in ids if int(i) in self.rows]
+        if duplicates or len(set(ids.tolist())) != len(ids):
+            raise ValueError(f"Ids already present in index: {duplicates[:10]}")
+        start = self.size
+        end = start + len(ids)
+        if start == 0 and vectors.dtype in (np.float32, np.float16):
+            self.vectors = vectors
+            self.inverse_norms = np.empty(len(vectors), dtype=np.float32)
+            for offset, block in _float32_blocks(vectors):
+                self.inverse_norms[offset:offset + len(block)] = _inverse_norms(block)
+            self.ids = ids.astype(np.int64).copy()
+            self.owned = False
+        else:
+            self._reserve(end)
+            self.vectors[start:end] = vectors
+            self.inverse_norms[start:end] = _inverse_norms(vectors)
+            self.ids[start:end] = ids
+        for offset, vector_id in enumerate(ids):
+            self.rows[int(vector_id)] = start + offset
+        self.size = end
+        return np.arange(start, end)
+
+    def get(self, ids: Iterable[int]) -> np.ndarray:
+        return self.gather([self.rows[int(vector_id)] for vector_id in ids]).reshape(-1, self.dim)
+
+    def gather(self, rows) -> np.ndarray:
+        """The vectors in ``rows``, as float32"""
+        return self.vectors[rows].astype(np.float32, copy=False)
+
+    def dot(self, queries: np.ndarray) -> np.ndarray:
+        """``queries @ vectors.T`` over the stored rows, in float32"""
+        n = self.size
+        scores = np.empty((len(queries), n), dtype=np.float32)
+        for start, block in _float32_blocks(self.vectors[:n]):
+            scores[:, start:start + len(block)] = queries @ block.T
+        return scores
+
+    def remove(self, ids: Iterable[int]) -> List[Tuple[int, int]]:
+        """Remove ids, returning the (from_row, to_row) moves that were made"""
+        moves = []
+        for vector_id in ids:
+            row = self.rows.pop(int(vector_id), None)
+            if row is None:
+                continue
+            last = self.size - 1
+            if row != last:
+                self._make_writable()
+                self.vectors[row] = self.vectors[last]
+                self.inverse_norms[row] = self.inverse_norms[last]
+                self.ids[row] = self.ids[last]
+                self.rows[int(self.ids[row])] = row
+                moves.append((last, row))
+            self.size = last
+        return moves
+
+    def copy(self) -> "_VectorStorage":
+        """Copy-on-write clone: the arrays stay shared until either side modifies them"""
+        clone = _VectorStorage.__new__(_VectorStorage)
+        clone.__dict__.update(self.__dict__)
+        clone.rows = dict(self.rows)
+        clone.owned = self.owned = False
+        return clone
+
+    def _reserve(self, capacity: int):
+        if capacity <= len(self.vectors) and self.owned:
+            return
+        if capacity <= len(self.vectors):
+            # Only taking ownership of shared arrays, no need to grow
+            new_capacity = len(self.vectors)
+        else:
+            new_capacity = max(capacity, 2 * len(self.vectors), 16)
+        vectors = np.zeros((new_capacity, self.dim), dtype=self.vectors.dtype)
+        vectors[:self.size] = self.vectors[:self.size]
+        inverse_norms = np.zeros(new_capacity, dtype=np.float32)
+        inverse_norms[:self.size] = self.inverse_norms[:self.size]
+        ids = np.zeros(new_capacity, dtype=np.int64)
+        ids[:self.size] = self.ids[:self.size]
+        self.vectors, self.inverse_norms, self.ids = vectors, inverse_norms, ids
+        self.owned = True
+
+    def _make_writable(self):
+        self._reserve(self.size)
+
+
+class VectorIndex:
+    """Cosine-similarity index mapping integer ids to embedding vectors.
+
+    ``search`` returns ``(scores, ids)`` arrays of shape ``(n_queries, k)``;
+    slots with no result carry id ``-1`` and score ``-inf``.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def add(self, ids, vectors):
+        raise NotImplementedError
+
+    def remove(self, ids):
+        raise NotImplementedError
+
+    def search(self, queries, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        raise NotImplementedError
+
+    def reconstruct(self, ids) -> np.ndarray:
+        """The stored (un-normalised) vectors for ids; raises KeyError for unknown ids"""
+        raise NotImplementedError
+
+    def copy(self) -> "VectorIndex":
+        """An independent index with the same contents; modifying one never affects the other"""
+        raise NotImplementedError
+
+    def needs_retraining(self, size: int) -> bool:
+        """Whether this index, grown or shrunk to ``size`` vectors, should be rebuilt from scratch"""
+        return False
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def _empty_result(self, n_queries: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return np.full((n_queries, k), -np.inf, dtype=np.float32), np.full((n_queries, k), -1, dtype=np.int64)
+
+
+class FlatIndex(VectorIndex):
+    """Exact brute-force search; the reference backend for recall measurements"""
+
+    def __init__(self, dim: int):
+        super().__init__(dim)
+        self.storage = _VectorStorage(dim)
+
+    def add(self, ids, vectors):
+        self.storage.add(np.asarray(ids, dtype=np.int64), _as_matrix(vectors))
+
+    def remove(self, ids):
+        self.storage.remove(ids)
+
+    def search(self, queries, k: int):
+        queries = _as_matrix(queries).astype(np.float32, copy=False)
+        scores_out, ids_out = self._empty_result(len(queries), k)
+        n = self.storage.size
+        if n == 0 or k <= 0:
+            return scores_out, ids_out
+        query_norms = _inverse_norms(queries)
+        scores = self.storage.dot(queries) * self.storage.inverse_norms[:n] * query_norms[:, None]
+        for i, row_scores in enumerate(scores):
+            top = _top_k(row_scores, k)
+            scores_out[i, :len(top)] = row_scores[top]
+            ids_out[i, :len(top)] = self.storage.ids[top]
+        return scores_out, ids_out
+
+    def reconstruct(self, ids):
+        return self.storage.get(ids)
+
+    def copy(self):
+        clone = FlatIndex(self.dim)
+        clone.storage = self.storage.copy()
+        return clone
+
+    def __len__(self):
+        return self.storage.size
+
+
+class IVFPQIndex(VectorIndex):
+    """Inverted-file index with product-quantised residuals (pure NumPy, CPU).
+
+    Vectors are L2-normalised and assigned to the nearest of ``nlist`` coarse
+    centroids; residuals are compressed into ``m`` one-byte PQ codes. A query
+    scans only the ``nprobe`` closest lists using asymmetric distance tables,
+    then re-scores the best ``k * rerank`` candidates exactly.
+
+    Knobs: raise ``nprobe`` (or ``rerank``) for recall, lower it for latency.
+    The index trains itself on the first batch added; later batches are
+    encoded against the existing codebooks. ``needs_retraining`` reports
+    when that training no longer fits the data: the index has more than
+    doubled since, or it would now get at least twice as many lists.
+    """
+
+    def __init__(self, dim: int, nlist: int = 256, nprobe: int = 16, m: int = 32,
+                 rerank: int = 8, train_iterations: int = 20, max_train_points: int = 65536, seed: int = 0):
+        super().__init__(dim)
+        if dim % m != 0:
+            raise ValueError(f"Dimension {dim} is not divisible by the number of PQ subvectors {m}")
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.m = m
+        self.rerank = rerank
+        self.train_iterations = train_iterations
+        self.max_train_points = max_train_points
+        self.seed = seed
+        self.storage = _VectorStorage(dim)
+        self.codes = np.zeros((0, m), dtype=np.uint8)
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.centroids: Optional[np.ndarray] = None
+        self.codebooks: Optional[np.ndarray] = None
+        # Number of vectors the centroids and codebooks were trained for
+        self.trained_size = 0
+        self._lists: Optional[List[np.ndarray]] = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def train(self, vectors):
+        data = _as_matrix(vectors).astype(np.float32)
+        self.trained_size = len(data)
+        data = data * _inverse_norms(data)[:, None]
+        rng = np.random.default_rng(self.seed)
+        if len(data) > self.max_train_points:
+            data = data[rng.choice(len(data), size=self.max_train_points, replace=False)]
+
+        nlist = self._lists_for(len(data))
+        self.centroids = _kmeans(data, nlist, self.train_iterations, self.seed, spherical=True)
+        residuals = data - self.centroids[np.argmax(data @ self.centroids.T, axis=1)]
+
+        # Codebooks need far fewer points than the coarse quantizer
+        ks = min(256, len(data))
+        if len(residuals) > 64 * ks:
+            residuals = residuals[rng.choice(len(residuals), size=64 * ks, replace=False)]
+        sub_dim = self.dim // self.m
+        self.codebooks = np.stack([
+            _kmeans(residuals[:, j * sub_dim:(j + 1) * sub_dim], ks, self.train_iterations, self.seed + j, spherical=False)
+            for j in range(self.m)
+        ])
+
+    def add(self, ids, vectors):
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = _as_matrix(vectors)
+        if len(ids) == 0:
+            return
+        if not self.is_trained:
+            self.train(vectors)
+        rows = self.storage.add(ids, vectors)
+        end = rows[-1] + 1
+        if end > len(self.codes):
+            capacity = max(end, 2 * len(self.codes), 16)
+            self.codes = np.resize(self.codes, (capacity, self.m))
+            self.assignments = np.resize(self.assignments, capacity)
+        for start, block in _float32_blocks(vectors):
+            assignments, codes = self._encode(block)
+            self.codes[rows[start:start + len(block)]] = codes
+            self.assignments[rows[start:start + len(block)]] = assignments
+        self._lists = None
+
+    def remove(self, ids):
+        for from_row, to_row in self.storage.remove(ids):
+            self.codes[to_row] = self.codes[from_row]
+            self.assignments[to_row] = self.assignments[from_row]
+        self._lists = None
+
+    def search(self, queries, k: int):
+        queries = _as_matrix(queries).astype(np.float32, copy=False)
+        scores_out, ids_out = self._empty_result(len(queries), k)
+        n = self.storage.size
+        if n == 0 or k <= 0:
+            return scores_out, ids_out
+
+        lists = self._inverted_lists()
+        queries = queries * _inverse_norms(queries)[:, None]
+        sub_dim = self.dim // self.m
+        coarse = queries @ self.centroids.T
+        for i, query in enumerate(queries):
+            probe = _top_k(coarse[i], min(self.nprobe, len(self.centroids)))
+            candidate_rows = np.concatenate([lists[c] for c in probe])
+            if len(candidate_rows) == 0:
+                continue
+            # Asymmetric distance: <q, c + r> ~= <q, c> + sum_j <q_j, codebook_j[code_j]>
+            tables = np.einsum("jkd,jd->jk", self.codebooks, query.reshape(self.m, sub_dim))
+            approx = coarse[i, self.assignments[candidate_rows]] + \
+                tables[np.arange(self.m), self.codes[candidate_rows]].sum(axis=1)
+            shortlist = candidate_rows[_top_k(approx, min(len(approx), k * max(1, self.rerank)))]
+
+            # Exact re-scoring of the shortlist against the stored vectors
+            exact = (self.storage.gather(shortlist) @ query) * self.storage.inverse_norms[shortlist]
+            top = _top_k(exact, k)
+            scores_out[i, :len(top)] = exact[top]
+            ids_out[i, :len(top)] = self.storage.ids[shortlist[top]]
+        return scores_out, ids_out
+
+    def reconstruct(self, ids):
+        return self.storage.get(ids)
+
+    def copy(self):
+        # Centroids and codebooks are never modified after training, so they are shared
+        clone = copy.copy(self)
+        clone.storage = self.storage.copy()
+        clone.codes = self.codes.copy()
+        clone.assignments = self.assignments.copy()
+        return clone
+
+    def __len__(self):
+        return self.storage.size
+
+    def needs_retraining(self, size):
+        if not self.is_trained:
+            return False
+        return size > 2 * self.trained_size or self._lists_for(size) >= 2 * len(self.centroids)
+
+    def _lists_for(self, n_points: int) -> int:
+        # Aim for at least ~39 training points per list, as FAISS recommends
+        return max(1, min(self.nlist, min(n_points, self.max_train_points) // 39))
+
+    def _encode(self, vectors: np.ndarray):
+        data = vectors.astype(np.float32) * _inverse_norms(vectors)[:, None]
+        assignments = np.argmax(data @ self.centroids.T, axis=1).astype(np.int32)
+        residuals = data - self.centroids[assignments]
+        sub_dim = self.dim // self.m
+        codes = np.empty((len(data), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            sub = np.ascontiguousarray(residuals[:, j * sub_dim:(j + 1) * sub_dim])
+            codebook = self.codebooks[j]
+            codes[:, j] = np.argmax(sub @ codebook.T - 0.5 * (codebook ** 2).sum(axis=1), axis=1)
+        return assignments, codes
+
+    def _inverted_lists(self) -> List[np.ndarray]:
+        # Rebuilt lazily after modifications, so bulk adds/removes pay once
+        if self._lists is None:
+            n = self.storage.size
+            order = np.argsort(self.assignments[:n], kind="stable")
+            bounds = np.searchsorted(self.assignments[:n][order], np.arange(len(self.centroids) + 1))
+            self._lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(self.centroids))]
+        return self._lists
+
+
+INDEX_BACKENDS = {
+    "flat": FlatIndex,
+    "ivfpq": IVFPQIndex,
+}
+
+
+def create_index(backend: str, dim: int, **params) -> VectorIndex:
+    """Create a vector index by backend name ("flat" or "ivfpq")"""
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown vector index backend '{backend}', expected one of {sorted(INDEX_BACKENDS)}")
+    return INDEX_BACKENDS[backend](dim, **params)
@@ -276,22 +276,65 @@ function Chatbot() {
     
     setMessages(prev => [...prev, userMessage]);
     
+    let streamed = '';
+    
+    // Show the assistant message as soon as the first tokens arrive
+    const updateAssistantMessage = (content) => {
+      setMessages(prev => {
+        const last = prev[prev.length - 1];
+        if (last && last.role === 'assistant' && last.streaming) {
+          return [...prev.slice(0, -1), { ...last, content }];
+        }
+        return [...prev, { role: 'assistant', content, streaming: true }];
+      });
+    };
+    
     try {
       setLoading(true);
       
-      // Send query to API
-      const response = await axios.post('http://localhost:8000/api/query', {
-        patientId: selectedPatient.id,
-        query: query,
+      // Send query to the streaming API (newline-delimited JSON events)
+      const response = await fetch('http://localhost:8000/api/query/stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          patientId: selectedPatient.id,
+          query: query,
+        }),
       });
+      if (!response.ok || !response.body) {
+        throw new Error(`Query failed with status ${response.status}`);
+      }
       
-      // Add assistant message
-      const assistantMessage = {
-        role: 'assistant',
-        content: response.data.response,
-      };
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        for (const line of lines) {
+          if (!line.trim()) continue;
+          const event = JSON.parse(line);
+          if (event.type === 'token') {
+            streamed += event.text;
+            updateAssistantMessage(streamed);
+          } else if (event.type === 'done') {
+            streamed = event.response;
+            updateAssistantMessage(streamed);
+          } else if (event.type === 'error') {
+            throw new Error(event.detail);
+          }
+        }
+      }
       
-      setMessages(prev => [...prev, assistantMessage]);
+      // Mark the message as complete
+      setMessages(prev => prev.map(message => (
+        message.streaming ? { role: message.role, content: message.content } : message
+      )));
     } catch (error) {
       console.error('Error processing query:', error);
       
@@ -300,10 +343,10 @@ function Chatbot() {
       
       const assistantMessage = {
         role: 'assistant',
-        content: mockResponse,
+        content: streamed ? `${streamed}\n\n[Response interrupted: ${error.message}]` : mockResponse,
       };
       
-      setMessages(prev => [...prev, assistantMessage]);
+      setMessages(prev => [...prev.filter(message => !message.streaming), assistantMessage]);
     } finally {
       setLoading(false);
       setQuery('');